@@ -1,5 +1,11 @@
 """
 Add_forecast.py
+Combine a base rainfall series with supplemental and forecast series.
+
+The series are merged on their dates as streams (see rainfall_merge), where
+they overlap in time the kind that comes first in --priority is kept. With
+several --forecast (the members of an ensemble), each member is merged with the
+other series into its own output, <output_file>_memberNN.
 
 Authors: Guillaume Goodwin
 """
@@ -10,24 +16,7 @@ Authors: Guillaume Goodwin
 ################################################################################
 ################################################################################
 
-import os
 import sys
-import argparse
-import time
-import shutil
-import re
-import numpy
-import tkinter
-from tkinter import filedialog
-import platform
-import argparse
-import datetime
-from osgeo import gdal, ogr, osr
-from osgeo.gdalnumeric import *
-from osgeo.gdalconst import *
-import csv
-import pandas as pd
-
 
 ################################################################################
 ################################################################################
@@ -35,53 +24,38 @@ import pandas as pd
 ################################################################################
 ################################################################################
 
-from gpm_precipitation_tools.gpm_download_month_V06B import gpm_month_download
-
-#GPM DAY
-from gpm_precipitation_tools.gpm_download_day_V06B import gpm_day_download
-#GPM 30min
-from gpm_precipitation_tools.gpm_download_30min_V06B import gpm_30min_download
-
-#AncillaryData
-from gpm_precipitation_tools.image_process import process
-from gpm_precipitation_tools.General_functions import *
-
-################################################################################
-################################################################################
-"""Parse Arguments"""
-################################################################################
-################################################################################
-
-args = fn.parse_add_rainfall_Arguments()
-
-arglist = [args.base_r,args.supp_r,args.output_f]
-print('Found the files to combine!')
+from gpm_precipitation_tools.General_functions import parse_add_rainfall_Arguments
+from gpm_precipitation_tools.rainfall_merge import merge_members, check_priority
+from gpm_precipitation_tools.series_io import require_pyarrow
 
 
+def main(argv=None):
+	args = parse_add_rainfall_Arguments(argv)
 
-# Read in the rainfall file and write to arrays
-base_rain = pd.read_csv(arglist[0])
-rain_time = base_rain['duration_s'].to_numpy()
-rain_intensity = base_rain['intensity_mm_sec'].to_numpy()
+	inputs = [('base', path) for path in args.base_r] + [('supp', path) for path in args.supp_r] + [('forecast', path) for path in args.forecast]
+	if not inputs or args.output_f is None:
+		print('Give the series to combine (--base_rainfall, --supp_rainfall, --forecast) and --output_file')
+		return 1
+	print('Found the files to combine!')
 
-# Read in the supplemental rainfall file
-supp_rain = pd.read_csv(arglist[1])
+	if any(path.lower().endswith('.parquet') for kind, path in inputs + [('output', args.output_f)]):
+		try:
+			require_pyarrow()
+		except ImportError as error:
+			print(error)
+			return 1
 
-# Check they are in the same same time durations
-if supp_rain['duration_s'][0] == rain_time[0]:
-    print("Both durations are the same, {} seconds".format(str(rain_time[0])))
-else:
-    print("The durations are different, base time is: {} and supplemental time is {} did you intend this?".format(str(rain_time[0]),str(supp_rain['duration_s'][0])))
+	priority = [kind.strip() for kind in args.priority.split(',')]
+	try:
+		check_priority(priority)
+	except ValueError as error:
+		print(error)
+		return 1
+	for path, counts in merge_members(inputs, args.output_f, priority).items():
+		print('Wrote {} rows to {} ({} base, {} supplemental, {} forecast), {} overlapping rows dropped and {} cut'.format(
+			sum(counts[kind] for kind in ['base', 'supp', 'forecast']), path, counts['base'], counts['supp'], counts['forecast'], counts['dropped'], counts['cut']))
+	return 0
 
-# Append the new data
-for i in range(0,len(supp_rain)):
-    rain_time = numpy.append(rain_time,supp_rain['duration_s'][i])
-    rain_intensity = numpy.append(rain_intensity,supp_rain['intensity_mm_sec'][i])
-    print(i)
 
-output_data =numpy.column_stack([rain_time, rain_intensity])
-# Now save the stuff
-with open(arglist[2], "w", newline="") as f:
-	    writer = csv.writer(f)
-	    writer.writerow(['duration_s','intensity_mm_sec'])
-	    writer.writerows(output_data)
+if __name__ == '__main__':
+	sys.exit(main())
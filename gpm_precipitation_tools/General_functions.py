@@ -49,6 +49,11 @@ from gpm_precipitation_tools.gpm_download_30min_V06B import gpm_30min_download
 
 #AncillaryData
 from gpm_precipitation_tools.image_process import process
+from gpm_precipitation_tools import envi_io
+from gpm_precipitation_tools.envi_io import DEFAULT_PERCENTILES
+from gpm_precipitation_tools.cutline_mask import catchment_zones, area_weights, shapefile_digest
+from gpm_precipitation_tools.timeseries_state import TimeseriesState, settings_digest, extend_series, DATE_FORMAT, STATE_NAME
+from gpm_precipitation_tools.series_io import series_columns, DEFAULT_SERIES_FORMAT, EXTENSIONS
 
 
 ################################################################################
@@ -85,17 +90,21 @@ def parseArguments():
 ################################################################################
 ################################################################################
 
-def parse_add_rainfall_Arguments():
+def parse_add_rainfall_Arguments(argv=None):
 
 	parser = argparse.ArgumentParser(prog='Precipitation Processing Tool')
 
-	parser.add_argument('--base_rainfall', dest='base_r', help='Insert the pathway to the base rainfall file',type=str)
+	parser.add_argument('--base_rainfall', dest='base_r', action='append', default=[], help='Insert the pathway to a base rainfall file (can be repeated)',type=str)
 
-	parser.add_argument('--supp_rainfall', dest='supp_r', help='Insert the pathway to the supplemental rainfall file',type=str)
+	parser.add_argument('--supp_rainfall', dest='supp_r', action='append', default=[], help='Insert the pathway to a supplemental rainfall file (can be repeated)',type=str)
+
+	parser.add_argument('--forecast', dest='forecast', action='append', default=[], help='Insert the pathway to a forecast rainfall file, e.g. one per ensemble member (can be repeated)',type=str)
+
+	parser.add_argument('--priority', dest='priority', default='base,supp,forecast', help='Comma separated order of the kinds of series where they overlap, the first one wins (default base,supp,forecast)',type=str)
 
 	parser.add_argument('--output_file', dest='output_f', help='Insert the pathway to the output file',type=str)
 
-	args = parser.parse_args();
+	args = parser.parse_args(argv);
 	return args
 
 
@@ -167,184 +176,365 @@ def ENVI_raster_binary_to_2d_array(file_name):
 
 
 
-def maps_to_timeseries(arglist, working_dir, data_product):
+def bil_time(file_name):
+	"""
+	Start of the timestep of a processed file, from the YYYYMMDD-SHHMMSS part of its name, or None.
+	"""
+	# Calib_rainfall_20180101-S000000-V06B_cut.bil or the name of the granule
+	found = re.search(r'(\d{8})-S(\d{6})', file_name)
+	if found is None:
+		return None
+	return datetime.datetime.strptime(found.group(1) + found.group(2), '%Y%m%d%H%M%S')
+
+
+def series_digest(arglist, data_product, percentiles=DEFAULT_PERCENTILES, wet_threshold=0., series_format=DEFAULT_SERIES_FORMAT):
+	"""
+	Digest of the settings of the time series of a run, as kept in its TimeseriesState.
+	"""
+	area = shapefile_digest(cutline_path(arglist)) if cutline_path(arglist) is not None else None
+	return settings_digest({'product': data_product, 'area': area,
+		'id_field': catchment_field(arglist), 'fractional': fractional_cover(arglist),
+		'percentiles': list(percentiles), 'wet_threshold': wet_threshold,
+		'series_format': series_format, 'statistics': 'inside the area'})
+
+
+def maps_to_timeseries(arglist, working_dir, data_product, percentiles=DEFAULT_PERCENTILES, wet_threshold=0., append=False, series_format=DEFAULT_SERIES_FORMAT):
+	"""
+	Write the rainfall time series of the processed .bil files of a run.
+
+	Every file is mapped into memory once and gives a row with the duration of
+	its timestep, the mean intensity (mm/s) and several statistics of the area.
+	With --SptID, the same read also gives the mean intensity of every
+	catchment, written to a second file with one column per catchment.
+
+	Parameters
+	----------
+	arglist : list
+		[ProdTP, StartDate, EndDate, ProcessDir, SptSlc, OP, Precision, SptID, Fractional] from PPT_CMD_RUN.
+	working_dir : str
+		Directory of the .bil files, ending with the path separator.
+	data_product : str
+		GPM_M, GPM_D or GPM_30min.
+	percentiles : sequence of numbers
+		Percentiles of the area written as pNN columns.
+	wet_threshold : float
+		Pixels above this value count as wet.
+	append : bool
+		Only read the files that are new or changed since the existing series
+		was made and merge their rows into it (--Append). The series is made
+		again if it was made with other settings.
+	series_format : str
+		Format of the series files: csv, parquet or npz (see series_io).
+	"""
 	# List the .bil files
 	print('Got to the timeseries function')
-	files = sorted(os.listdir(working_dir)); bilfiles = []
+	with os.scandir(working_dir) as entries:
+		mtimes = {entry.name: entry.stat().st_mtime for entry in entries if entry.name.endswith('.bil')}
+	bilfiles = sorted(mtimes)
+	print(f'{len(bilfiles)} .bil files')
+
+	id_field = catchment_field(arglist)
+	state = TimeseriesState(working_dir)
+	area = shapefile_digest(cutline_path(arglist)) if cutline_path(arglist) is not None else None
+	digest = series_digest(arglist, data_product, percentiles, wet_threshold, series_format)
+	append = append and state.usable(digest)
+
+	timed = [(bil_time(file_name), file_name) for file_name in bilfiles]
+	if append:
+		# only the files that are new or changed (late ones too), in order of time
+		changed = set(state.changed(mtimes))
+		timed = sorted([(timer, file_name) for timer, file_name in timed if timer is not None and file_name in changed])
+		print(f'{len(timed)} new or changed files')
+		# the files that are gone are forgotten
+		state.inputs = {file_name: mtime for file_name, mtime in state.inputs.items() if file_name in mtimes}
+	else:
+		state.last, state.files, state.inputs = None, {}, {}
 
-	for i in range(len(files)):
-		ending = files[i][-4:]
-		print(f"i am the ending: {ending}")
-		if ending == '.bil':
-			bilfiles.append(files[i])
-	print(bilfiles)
-
-
-	#Timelist = []
-	#CumTimelist = []
-	#Intlist = []
 	Full_list = []
+	Catchment_list = []
+	zones = weights = None
 	thirty_one_day_months = [1,3, 5, 7, 8, 10, 12]
 	thirty_day_months = [4, 6, 9, 11]
-	february_special_month = [2]
-	for i in range(len(bilfiles)):
-		print (bilfiles[i])
-		leap_year = False
-		file_ending = bilfiles[i].split('/')[-1]
-		if file_ending[-8:] == '_cut.bil':
-			timer = datetime.datetime.strptime(bilfiles[i], 'Calib_rainfall_%Y%m%d-S%H%M%S-V06B_cut.bil')
-			month = timer.month
-			year = timer.year
-			if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
-				leap_year = True
-		else:
-			print('I am not the right file')
-			pass
-		# Add to the rainfall list
-		Rainarr, pixelWidth, (geotransform, inDs) = ENVI_raster_binary_to_2d_array(working_dir + bilfiles[i])
-		print(Rainarr)
-		# takes the average over the whole raster image
-		Rain = numpy.mean(Rainarr)
+	# all the files of a run share the same header: only parse it again if the size changes
+	header = None
+	for timer, file_name in timed:
+		if timer is None:
+			print(f'I am not the right file: {file_name}')
+
+		if header is None or os.path.getsize(working_dir + file_name) != envi_io.data_size(header):
+			header = envi_io.read_header(envi_io.header_path(working_dir + file_name))
+			if cutline_path(arglist) is not None:
+				# the pixels inside the area, the zeros around it in the cropped window don't count
+				x_pixels, y_pixels, window = envi_io.global_window(header)
+				weights = area_weights(cutline_path(arglist), x_pixels, y_pixels, window, fractional_cover(arglist), id_field)
+			if id_field is not None:
+				# the label grid of the catchments, rasterised when processing the granules
+				zone_window, zones = catchment_zones(cutline_path(arglist), id_field, x_pixels, y_pixels, fractional=fractional_cover(arglist))
+				if zone_window != window:
+					raise ValueError(f'{file_name} was not processed with the catchments of {cutline_path(arglist)}')
+		band = envi_io.read_band(working_dir + file_name, header)
+		# a single area was multiplied by its mask when cropping, catchments were not
+		stats = envi_io.zonal_statistics(band, percentiles, wet_threshold, weights, scaled=id_field is None)
+
 		if data_product == 'GPM_30min':
 			converting_factor = 30*60 # seconds in 30 minutes
 		elif data_product == 'GPM_D':
 			converting_factor = 24*3600 # seconds in a day
 		else:
+			month = timer.month
+			year = timer.year
 			if month in thirty_day_months:
 				converting_factor = 30*24*3600 # seconds in a month
-				print('I have 30 days')
 			elif month in thirty_one_day_months:
 				converting_factor = 31*24*3600 # seconds in a month
-				print('I have 31 days')
+			elif year % 4 == 0 and (year % 100 != 0 or year % 400 == 0):
+				converting_factor = 29*24*3600 # seconds in a month, february in a leap year
 			else:
-				if leap_year == True:
-					print('I am february in a leap year ')
-					converting_factor = 29*24*3600 # seconds in a month
-				else:
-					print('I am february in a non-leap year')
-					converting_factor = 28*24*3600 # seconds in a month
-		Intensity = Rain/(converting_factor) # Intensity of rainfall during the period (mm/sec) - converted from mm
-		#Intlist.append(Intensity)
+				converting_factor = 28*24*3600 # seconds in a month
+		# takes the average over the area
+		Intensity = stats['mean']/(converting_factor) # Intensity of rainfall during the period (mm/sec) - converted from mm
 
 		# Save it all together
-		Full_list.append([converting_factor, Intensity])
+		date = timer.strftime(DATE_FORMAT) if timer is not None else ''
+		Full_list.append([converting_factor, Intensity, date] + [stats[name] for name in envi_io.statistic_names(percentiles)])
+		if zones is not None:
+			# one bincount for all the catchments
+			Catchment_list.append([converting_factor, date] + list(envi_io.zonal_means(band, zones) / converting_factor))
+		if timer is not None:
+			state.last = timer if state.last is None else max(state.last, timer)
+		state.inputs[file_name] = mtimes[file_name]
 
 	# Now save the stuff
-	with open(working_dir+arglist[1]+"_to_"+arglist[2]+"_"+arglist[0]+"_rainfall.csv", "w", newline="") as f:
-	    writer = csv.writer(f)
-	    writer.writerow(['duration_s','rainfall_mm_sec'])
-	    writer.writerows(Full_list)
+	name = arglist[1]+"_to_"+arglist[2]+"_"+arglist[0]
+	extension = EXTENSIONS[series_format]
+	metadata = {'product': data_product, 'aoi': area, 'start': arglist[1], 'end': arglist[2],
+		'units': {'duration_s': 's', 'rainfall_mm_sec': 'mm/s', 'statistics': 'unit of the rasters'}}
+	extend_series(state.series_file('rainfall', name+"_rainfall"+extension),
+		['duration_s','rainfall_mm_sec','date'] + envi_io.statistic_names(percentiles), Full_list, 2, append, metadata)
+	if id_field is not None and (zones is not None or 'catchments' in state.files):
+		# wide table: a column of intensity (mm/sec) per catchment
+		ids = zones['ids'] if zones is not None else None
+		path = state.series_file('catchments', name+"_catchments"+extension)
+		if ids is None:
+			ids = series_columns(path)[2:]
+		extend_series(path, ['duration_s','date'] + ids, Catchment_list, 1, append,
+			dict(metadata, id_field=id_field, units={'duration_s': 's', 'catchments': 'mm/s'}))
+	state.digest = digest
+	state.product, state.aoi = data_product, area
+	state.save()
 	print ('DOOOOONE')
 	print (working_dir)
 
 
-def move_files(path_to_target, start_date, end_date):
-	files_to_move = []
-	path_to_bil_file_list = glob.glob(path_to_target + '*bil' )
-	path_to_hdr_file_list = glob.glob(path_to_target + '*hdr' )
-	path_to_nc4_file_list = glob.glob(path_to_target + '*nc4' )
-	path_to_hdf5_file_list = glob.glob(path_to_target + '*hdf5' )
-	files_to_move.extend(path_to_bil_file_list)
-	files_to_move.extend(path_to_hdr_file_list)
-	files_to_move.extend(path_to_nc4_file_list)
-	files_to_move.extend(path_to_hdf5_file_list)
-	new_directory = path_to_target+'run_start_'+start_date+'_end_'+end_date
-
-	# Check whether the specified path exists or not
-	isExist = os.path.exists(new_directory)
-	if not isExist:
-		# Create a new directory because it does not exist
-		os.mkdir(new_directory)
-		print("The new directory is created!")
-
-	for path_to_file in files_to_move:
-		file_name = os.path.basename(path_to_file)
-		shutil.move(path_to_file, new_directory+'/'+file_name)
+def previous_run(input_dir_data, prefix, backslh):
+	"""
+	Name of the directory of the last run that starts with prefix and made a time series, or None.
 
+	The directories of a run are named after its StartDate and EndDate, so a
+	run that appends to the series of a run with another EndDate finds it
+	from the product and StartDate (prefix GPM_RAW_<product>_<StartDate>_).
 
+	Returns
+	----------
+	name : str
+		Name of the download directory of that run, its processed files being
+		in name + '_processed'.
+	"""
+	found = []
+	for name in os.listdir(input_dir_data):
+		state = input_dir_data + backslh + name + backslh + STATE_NAME
+		if name.startswith(prefix) and name.endswith('_processed') and os.path.exists(state):
+			found.append((os.path.getmtime(state), name[:-len('_processed')]))
+	if not found:
+		return None
+	return max(found)[1]
 
 
 ################################################################################
 ################################################################################
 
 def download_months(arglist, zero_list, zero_dir, fst_dir, backslh, n):
-	if zero_list[n].endswith('.HDF5') > -1 and zero_list[n].find('.xml') == -1 and zero_list[n].find('.aux') == -1 and zero_list[n].find('.tfw') == -1:
+	if zero_list[n].endswith('.HDF5') and zero_list[n].find('.xml') == -1 and zero_list[n].find('.aux') == -1 and zero_list[n].find('.tfw') == -1:
 			if 	zero_list[n].find('.HDF5') > -1:
 				#extract_subdata = 'HDF5:"%s%s%s"://Grid/precipitation' % (zero_dir,backslh,zero_list[n])
 				extract_subdata = "%s%s%s" % (zero_dir,backslh,zero_list[n])
-				outfile = '%s%s%s.tif' % (fst_dir,backslh,zero_list[n][:-5])
+				outfile = granule_output(arglist, zero_list[n], fst_dir, backslh, cropped=False)
 				print(f'this is the outfile: {outfile}')
 
-				process(outfile,extract_subdata,arglist[0])
-				raster_crop(arglist, outfile)
+				if cutline_path(arglist) is None:
+					process(outfile,extract_subdata,arglist[0],precision=run_precision(arglist))
+				else:
+					# crop with the cached mask of the area while processing, no gdalwarp needed
+					process(cut_file_name(outfile),extract_subdata,arglist[0],cutfile=cutline_path(arglist),fractional=fractional_cover(arglist),precision=run_precision(arglist),id_field=catchment_field(arglist))
 				extract_subdata = outfile = None
 
 
 def download_days(arglist, zero_list, zero_dir, fst_dir, backslh, n):
-	if zero_list[n].endswith('.nc4') > -1 and zero_list[n].find('.xml') == -1 and zero_list[n].find('.aux') == -1 and zero_list[n].find('.tfw') == -1:
+	if zero_list[n].endswith('.nc4') and zero_list[n].find('.xml') == -1 and zero_list[n].find('.aux') == -1 and zero_list[n].find('.tfw') == -1:
 			#extract_subdata = 'HDF5:"%s%s%s"://precipitationCal' % (zero_dir, backslh, zero_list[n])
 			extract_subdata = "%s%s%s" % (zero_dir,backslh,zero_list[n])
 			print(f'this is extract_subdata: {extract_subdata}')
-			outfile = '%s%s%s_precipitationCal.tif' % (fst_dir,backslh, zero_list[n][:-4])
+			outfile = granule_output(arglist, zero_list[n], fst_dir, backslh, cropped=False)
 			print(f'this is the outfile: {outfile}')
 
-			process(outfile,extract_subdata,arglist[0])
-			raster_crop(arglist, outfile)
+			if cutline_path(arglist) is None:
+				process(outfile,extract_subdata,arglist[0],precision=run_precision(arglist))
+			else:
+				# crop with the cached mask of the area while processing, no gdalwarp needed
+				process(cut_file_name(outfile),extract_subdata,arglist[0],cutfile=cutline_path(arglist),fractional=fractional_cover(arglist),precision=run_precision(arglist),id_field=catchment_field(arglist))
 			extract_subdata = outfile = None
 
 
 
 def download_hhs(arglist, zero_list, zero_dir, fst_dir, backslh, n):
-	if zero_list[n].endswith('.HDF5') > -1 and zero_list[n].find('.xml') == -1 and zero_list[n].find('.aux') == -1 and zero_list[n].find('.tfw') == -1:
+	if zero_list[n].endswith('.HDF5') and zero_list[n].find('.xml') == -1 and zero_list[n].find('.aux') == -1 and zero_list[n].find('.tfw') == -1:
 		if 	zero_list[n].find('.HDF5') > -1:
 			extract_subdata = "%s%s%s" % (zero_dir,backslh,zero_list[n])
 			#extract_subdata = 'HDF5:"%s%s%s"://Grid/precipitation' % (zero_dir,backslh,zero_list[n])
-			outfile = '%s%s%s.bil' % (fst_dir,backslh,zero_list[n][:-5])
+			outfile = granule_output(arglist, zero_list[n], fst_dir, backslh, cropped=False)
 			print(f'this is the outfile: {outfile}')
 
-			process(outfile,extract_subdata,arglist[0])
-			raster_crop(arglist, outfile)
+			if cutline_path(arglist) is None:
+				process(outfile,extract_subdata,arglist[0],precision=run_precision(arglist))
+			else:
+				# crop with the cached mask of the area while processing, no gdalwarp needed
+				process(cut_file_name(outfile),extract_subdata,arglist[0],cutfile=cutline_path(arglist),fractional=fractional_cover(arglist),precision=run_precision(arglist),id_field=catchment_field(arglist))
 			extract_subdata = outfile = None
 
 
+def granule_output(arglist, file_name, fst_dir, backslh, cropped=True):
+	"""
+	Path of the file a raw granule is processed into, or None if it is not a granule of the product.
+
+	Parameters
+	----------
+	arglist : list
+		[ProdTP, StartDate, EndDate, ProcessDir, SptSlc, OP, Precision, SptID, Fractional] from PPT_CMD_RUN.
+	file_name : str
+		Name of the raw granule.
+	fst_dir : str
+		Directory of the processed files.
+	backslh : str
+		Path separator.
+	cropped : bool
+		Give the name of the cropped file when the run has a --SptSlc.
+	"""
+	if file_name.find('.xml') > -1 or file_name.find('.aux') > -1 or file_name.find('.tfw') > -1:
+		return None
+	if arglist[0] == 'GPM_D':
+		if not file_name.endswith('.nc4'):
+			return None
+		outfile = '%s%s%s_precipitationCal.tif' % (fst_dir,backslh,file_name[:-4])
+	elif not file_name.endswith('.HDF5'):
+		return None
+	elif arglist[0] == 'GPM_M':
+		outfile = '%s%s%s.tif' % (fst_dir,backslh,file_name[:-5])
+	else:
+		outfile = '%s%s%s.bil' % (fst_dir,backslh,file_name[:-5])
+	if cropped and cutline_path(arglist) is not None:
+		return cut_file_name(outfile)
+	return outfile
+
+
+def process_granule(arglist, file_name, zero_dir, fst_dir, backslh):
+	"""
+	Process a single raw granule with the function of its product.
+
+	Parameters
+	----------
+	arglist : list
+		[ProdTP, StartDate, EndDate, ProcessDir, SptSlc, OP, Precision, SptID, Fractional] from PPT_CMD_RUN.
+	file_name : str
+		Name of the raw granule in zero_dir.
+	zero_dir : str
+		Directory of the raw granules.
+	fst_dir : str
+		Directory of the processed files.
+	backslh : str
+		Path separator.
+	"""
+	if arglist[0] == 'GPM_M':
+		download_months(arglist, [file_name], zero_dir, fst_dir, backslh, 0)
+	elif arglist[0] == 'GPM_D':
+		download_days(arglist, [file_name], zero_dir, fst_dir, backslh, 0)
+	else:
+		download_hhs(arglist, [file_name], zero_dir, fst_dir, backslh, 0)
+
+
 
 ########
 # Crop the raster
 ########
+def cutline_path(arglist):
+	"""
+	Path to the --SptSlc shapefile, or None for a global product.
+	"""
+	if arglist[4] in [None, 'None', '']:
+		return None
+	return arglist[4]
+
+
+def run_precision(arglist):
+	"""
+	Precision (float32 or float64) of the grids of the run, or None for the default.
+	"""
+	if len(arglist) > 6:
+		return arglist[6]
+	return None
+
+
+def catchment_field(arglist):
+	"""
+	--SptID field with the catchment of each feature of the shapefile, or None for a single area.
+	"""
+	if len(arglist) > 7 and arglist[7] not in [None, 'None', '']:
+		return arglist[7]
+	return None
+
+
+def fractional_cover(arglist):
+	"""
+	True to weight the pixels on the edges by the fraction of their area inside (--Fractional).
+	"""
+	return len(arglist) > 8 and bool(arglist[8])
+
+
+def cut_file_name(outfile):
+	"""
+	Name of the cropped file made from a processed granule,
+	e.g. .../Calib_rainfall_20180101-S000000-V06B_cut.bil
+	"""
+	cutted_file = outfile[:-4] + '_cut.bil'
+
+	# Find out the file path
+	f_path_str = cutted_file.rsplit('/',1)[0]
+	f_path = f_path_str+'/'
+
+	# Create the file name from existing file
+	f_name_str = cutted_file.rsplit('/',1)[-1]
+	f_name_str_split = f_name_str.split('.')
+	date_str = f_name_str_split[4][:16]
+	end_string = f_name_str_split[6]
+	# the end results of the cutted file should be:
+	## A = split the file. we want only the stuff on the first chunk - this will have path info
+	## AA = 1 (name directory where we find the data)
+	## AAA = /1/ (add the slashes to make up the path)
+	## B = 20180101 (the date) - we also want to include the time if it's 30m
+	## BB = 'V06B_cut' - the final extension before the file type.
+
+	return f_path + 'Calib_rainfall_' + date_str + '-' + end_string + '.bil'
+
+
 def raster_crop(arglist, outfile):
-	if arglist[4] != 'None':
+	# Kept for rasters made outside of process(): process() crops with the cached mask itself
+	if cutline_path(arglist) is not None:
 		cutfile = arglist[4]
 		to_cut = outfile
 		print(f'cutfile file: {cutfile}')
 		print(f'to_cut file: {to_cut}')
-		cutted_file = outfile[:-4] + '_cut.bil'
+		cutted_file = cut_file_name(outfile)
 		print(f'cutted file: {cutted_file}')
 
-		# Find out the file path
-		f_path_str = cutted_file.rsplit('/',1)[0]
-		print(f'f_name {f_path_str}')
-		f_path = f_path_str+'/'
-		print(f'f_path {f_path}')
-
-		# Create the file name from existing file
-		f_name_str = cutted_file.rsplit('/',1)[-1]
-		f_name_str_split = f_name_str.split('.')
-		print(f_name_str_split)
-		date_str = f_name_str_split[4][:16]
-		print(f'date_str {date_str}')
-		end_string = f_name_str_split[6]
-		print(f'end_string {end_string}')
-		# the end results of the cutted file should be:
-		## A = split the file. we want only the stuff on the first chunk - this will have path info
-		## AA = 1 (name directory where we find the data)
-		## AAA = /1/ (add the slashes to make up the path)
-		## B = 20180101 (the date) - we also want to include the time if it's 30m
-		## BB = 'V06B_cut' - the final extension before the file type.
-
-
-
-		cutted_file = f_path + 'Calib_rainfall_' + date_str + '-' + end_string + '.bil'
-
 		# Cut the raster to your desired extent
 		os.system('gdalwarp -overwrite -of ENVI -t_srs EPSG:4326 -cutline ' + cutfile + ' -crop_to_cutline ' + to_cut + ' ' + cutted_file)
 		# Get rid of the big files
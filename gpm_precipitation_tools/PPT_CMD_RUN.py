@@ -46,6 +46,14 @@ from gpm_precipitation_tools.gpm_download_month_V06B import gpm_month_download
 from gpm_precipitation_tools.gpm_download_day_V06B import gpm_day_download
 #GPM 30min
 from gpm_precipitation_tools.gpm_download_30min_V06B import gpm_30min_download
+from gpm_precipitation_tools.download_engine import DEFAULT_WORKERS
+from gpm_precipitation_tools.listing_cache import ListingCache
+from gpm_precipitation_tools.precision import DEFAULT_PRECISION
+from gpm_precipitation_tools.series_io import SERIES_FORMATS, DEFAULT_SERIES_FORMAT, format_argument
+from gpm_precipitation_tools.granule_pipeline import StreamingProcessor, process_granules, processing_digests, DEFAULT_QUEUE_SIZE
+from gpm_precipitation_tools.run_state import RunState, RUN_STATE_NAME, file_signature
+from gpm_precipitation_tools.processed_cache import ProcessedCache, DEFAULT_MAX_SIZE
+from gpm_precipitation_tools.timeseries_state import TimeseriesState, settings_digest
 
 #AncillaryData
 from gpm_precipitation_tools.image_process import process
@@ -65,6 +73,17 @@ def print_welcome():
 	print("Use --ProcessDir to define where the data will be saved.")
 	print("Use --SptSlc to define the path to the shapefile of the region to get data from.")
 	print("Add --OP if you already have the data and only want to process it.")
+	print("Use --DownloadWorkers to set how many files are downloaded at the same time.")
+	print("Use --ListingCache to choose where the NASA directory listings are cached.")
+	print("Add --Revalidate to download again the files that changed on the NASA servers.")
+	print("Add --Stream to process each file as soon as it is downloaded.")
+	print("Use --Workers to set how many files are processed at the same time.")
+	print("Use --Precision to choose float32 (default) or float64 grids.")
+	print("Use --SptID to name the field of the catchment of each feature of --SptSlc.")
+	print("Add --Fractional to weight the pixels on the edges by the fraction of their area inside.")
+	print("Add --Append to add only the new files to the existing time series.")
+	print("Add --Restart to do everything again instead of going on from where a stopped run was.")
+	print("Use --ProcessedCache to share the processed files between runs, --ProcessedCacheSize for its size in MB.")
 	print("=======================================================================\n\n ")
 
 #=============================================================================
@@ -101,7 +120,7 @@ def main(args=None):
 		args = sys.argv[1:]
 
 	# If no arguments, send to the welcome screen.
-	if not len(sys.argv) > 1:
+	if not len(args) > 0:
 		full_paramfile = print_welcome()
 		sys.exit()
 
@@ -125,12 +144,44 @@ def main(args=None):
 
 	parser.add_argument('--OP', dest='OP',action="store_true", help='Call this argument if you only want to process the data. Make sure you have a directory with a raw files subfolder.')
 
-	args = parser.parse_args();
+	parser.add_argument('--DownloadWorkers', dest='DownloadWorkers', help='Number of files downloaded at the same time', default=DEFAULT_WORKERS, type=int)
+
+	parser.add_argument('--ListingCache', dest='ListingCache', help='Directory where the NASA directory listings are cached (default: ~/.gpm_precipitation_tools/listings)', default=None, type=str)
+
+	parser.add_argument('--Revalidate', dest='Revalidate', action="store_true", help='Call this argument to check with the server whether the files already downloaded have changed.')
+
+	parser.add_argument('--Stream', dest='Stream', action="store_true", help='Call this argument to process each file as soon as it is downloaded instead of after the whole download.')
+
+	parser.add_argument('--QueueSize', dest='QueueSize', help='With --Stream, number of downloaded files allowed to wait for processing', default=DEFAULT_QUEUE_SIZE, type=int)
+
+	parser.add_argument('--Workers', '--workers', dest='Workers', help='Number of processes used to process the files', default=1, type=int)
+
+	parser.add_argument('--Precision', choices=['float32','float64'], default=DEFAULT_PRECISION, dest='Precision', help='Precision of the processed grids')
+
+	parser.add_argument('--SptID', dest='SptID', help='Field of the --SptSlc features with their catchment ID: one time series column per catchment', default=None, type=str)
+
+	parser.add_argument('--Fractional', dest='Fractional', action="store_true", help='Call this argument to weight the pixels on the edges of the area by the fraction of their area inside.')
+
+	parser.add_argument('--Append', dest='Append', action="store_true", help='Call this argument to add the new files to the existing time series instead of making it again from all the files. The directories of the last run with the same product and start date are renamed with the new end date.')
+
+	parser.add_argument('--Restart', dest='Restart', action="store_true", help='Call this argument to forget the run state of the process directory and process every file again. Without it, a run that was stopped goes on from where it was.')
+
+	parser.add_argument('--ProcessedCache', dest='ProcessedCache', help='Directory of a cache of processed files shared between runs, e.g. ~/.gpm_precipitation_tools/processed (default: no cache)', default=None, type=str)
+
+	parser.add_argument('--ProcessedCacheSize', dest='ProcessedCacheSize', help='Size of the --ProcessedCache in MB, the files used the longest time ago are removed beyond it', default=DEFAULT_MAX_SIZE, type=float)
+
+	parser.add_argument('--SeriesFormat', choices=SERIES_FORMATS, default=DEFAULT_SERIES_FORMAT, type=format_argument, dest='SeriesFormat', help='Format of the time series files: csv (default), parquet (needs pyarrow) or npz. Parquet and npz are typed, compressed and keep the metadata of the series.')
+
+	args = parser.parse_args(args);
+
+	# checked now, not once every file is downloaded and processed
+	if args.SptID is not None and args.SptSlc is None:
+		parser.error('--SptID needs the --SptSlc file whose features have the catchment IDs')
 
 	if args.OP == '':
 		args.OP == False
 
-	arglist = [args.ProdTP,args.StartDate,args.EndDate,args.ProcessDir,args.SptSlc,args.OP]
+	arglist = [args.ProdTP,args.StartDate,args.EndDate,args.ProcessDir,args.SptSlc,args.OP,args.Precision,args.SptID,args.Fractional]
 	print(arglist)
 
 	################################################################################
@@ -183,6 +234,19 @@ def main(args=None):
 		print ("Please tell me what to download")
 		sys.exit(2)
 
+	# the directories are named after the EndDate: appending goes on from those of the last run with the same StartDate
+	moved = []
+	if args.Append == True and not os.path.exists(input_dir_data + backslh + create_dir + "_processed"):
+		previous = previous_run(input_dir_data, create_dir[:-len(arglist[2])], backslh)
+		if previous is not None:
+			print(f'appending to the time series of {previous}')
+			moved.append((input_dir_data + backslh + previous + "_processed", input_dir_data + backslh + create_dir + "_processed"))
+			if os.path.isdir(input_dir_data + backslh + previous) and not os.path.exists(input_dir_data + backslh + create_dir):
+				# the granules downloaded by that run are not downloaded again
+				moved.append((input_dir_data + backslh + previous, input_dir_data + backslh + create_dir))
+			for old_dir, new_dir in moved:
+				os.rename(old_dir, new_dir)
+
 	try:
 		os.mkdir(input_dir_data + backslh + create_dir)
 	except:
@@ -191,8 +255,6 @@ def main(args=None):
 	download_dir = input_dir_data + backslh + create_dir
 	print(f'this is the download dir: {download_dir,backslh,arglist[1],arglist[2]}')
 
-	if arglist[5] == False:
-		dwnld(download_dir,backslh=backslh,Start_Date = arglist[1],End_Date = arglist[2])
 	DirEnd = create_dir
 
 	zero_dir = download_dir#[:-1]
@@ -203,6 +265,30 @@ def main(args=None):
 	except:
 		print (process_dir + "_processed"+": this directory already exists")
 
+	# What every granule went through, so that a stopped run goes on from where it was
+	run_state = RunState(process_dir + backslh + RUN_STATE_NAME)
+	if args.Restart == True:
+		run_state.clear()
+	for old_dir, new_dir in moved:
+		run_state.move(old_dir, new_dir)
+	print(f'run state: {run_state.summary()}')
+	cache = ProcessedCache(args.ProcessedCache, args.ProcessedCacheSize) if args.ProcessedCache is not None else None
+
+	streamed = False
+	# the files that could not be downloaded or processed make the run fail at the end
+	failed_downloads = []
+	if arglist[5] == False and args.Stream == True:
+		# Process each file as it arrives: the download workers wait when the queue is full
+		with StreamingProcessor(arglist, zero_dir, process_dir, backslh, queue_size=args.QueueSize, workers=args.Workers, run_state=run_state, cache=cache) as streamer:
+			downloads = dwnld(download_dir,backslh=backslh,Start_Date = arglist[1],End_Date = arglist[2], workers = args.DownloadWorkers, listing_cache = ListingCache(args.ListingCache), revalidate = args.Revalidate, on_done = streamer.put)
+		for file_name, error in streamer.failed:
+			print(f'{file_name} failed: {error}')
+		streamed = True
+	elif arglist[5] == False:
+		downloads = dwnld(download_dir,backslh=backslh,Start_Date = arglist[1],End_Date = arglist[2], workers = args.DownloadWorkers, listing_cache = ListingCache(args.ListingCache), revalidate = args.Revalidate)
+	if arglist[5] == False:
+		failed_downloads = [url for url, target, ok in downloads if not ok]
+
 
 
 	################################################################################
@@ -216,28 +302,19 @@ def main(args=None):
 	zero_list = sorted(zero_list, key = lambda x: x.rsplit('.', 1)[0])
 	print(f'I am zero list: {zero_list}')
 	print(f'i am arglist {arglist}')
+	raw_files = [file_name for file_name in zero_list if os.path.isfile(zero_dir + backslh + file_name) and granule_output(arglist, file_name, process_dir, backslh) is not None]
+	run_state.mark_many(raw_files, 'downloaded', {file_name: file_signature(zero_dir + backslh + file_name) for file_name in raw_files},
+		{file_name: zero_dir + backslh + file_name for file_name in raw_files})
 
-	if arglist[0] == 'GPM_M': # We do not expect this case to arise in our use case
-		for n in range(0,len(zero_list),1):
-			download_months(arglist, zero_list, zero_dir, process_dir, backslh, n)
-
-
-
-	elif arglist[0] == 'GPM_D': # We do not expect this case to arise in our use case
-		print('hello from GPM_D')
-		for n in range(0,len(zero_list),1):
-			print('I shall start the download')
-			download_days(arglist, zero_list, zero_dir, process_dir, backslh, n)
-			print('done with download_days')
-
-
-
-	elif arglist[0] == 'GPM_30min':
-		for n in range(0,len(zero_list)-1,1):
-			download_hhs(arglist, zero_list, zero_dir, process_dir, backslh, n)
-			print('done with download_hhs')
-
+	if streamed == True:
+		print('the files were processed while downloading')
 
+	if arglist[0] in ['GPM_M', 'GPM_D', 'GPM_30min']:
+		# Every file is independent: spread them over --Workers processes
+		# After --Stream this only picks up the files downloaded by a run that was stopped
+		processed_files = process_granules(arglist, zero_list, zero_dir, process_dir, backslh, workers=args.Workers, run_state=run_state, cache=cache)
+		# the granules that failed while streaming and again here
+		failed_files = [file_name for file_name, error in processed_files if error is not None]
 
 	else:
 		print ("ERROR")
@@ -252,12 +329,29 @@ def main(args=None):
 	working_dir = process_dir + backslh #'./1/'
 	print(f'working dir: {working_dir}')
 
-	maps_to_timeseries(arglist, working_dir, arglist[0])
+	# the series only need making again if a granule or the settings of the series changed
+	# only the granules processed with these settings are in the series: the others are aggregated by a later run
+	processed = processing_digests(arglist, raw_files, zero_dir)
+	processed = {file_name: processed[file_name] for file_name in run_state.done(list(processed), 'processed', processed)}
+	aggregation = {file_name: settings_digest({'processed': digest, 'series_format': args.SeriesFormat}) for file_name, digest in processed.items()}
+	series = TimeseriesState(working_dir)
+	if series.files and series.usable(series_digest(arglist, arglist[0], series_format=args.SeriesFormat)) and not run_state.pending(list(aggregation), 'aggregated', aggregation):
+		print('the time series are up to date')
+	else:
+		maps_to_timeseries(arglist, working_dir, arglist[0], append=args.Append, series_format=args.SeriesFormat)
+		run_state.mark_many(list(aggregation), 'aggregated', aggregation)
+	run_state.close()
 
-	move_files(working_dir, arglist[1], arglist[2])
+	# the processed files stay where the run state and the time series state expect them
 	print(f'input dir data: {input_dir_data}')
 
+	# a run with missing files must not look complete (e.g. to the workers of shard_run)
+	if failed_downloads or failed_files:
+		print(f'ERROR! {len(failed_downloads)} files could not be downloaded and {len(failed_files)} could not be processed')
+		return 1
+	return 0
+
 
 #=============================================================================
 if __name__ =="__main__":
-	main()
+	sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+credentials.py
+NASA Earthdata login without the login window.
+
+The downloaders used to always ask for the username and password in a Qt
+window. They are now read from the environment or from ~/.netrc first, so
+that runs on machines without a display (like the workers of shard_run) never
+wait for a window, and the window is only opened as a last resort.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import netrc
+
+
+EARTHDATA_HOST = 'urs.earthdata.nasa.gov'
+USERNAME_VARIABLE = 'EARTHDATA_USERNAME'
+PASSWORD_VARIABLE = 'EARTHDATA_PASSWORD'
+
+
+def netrc_path():
+    return os.environ.get('NETRC', os.path.join(os.path.expanduser('~'), '.netrc'))
+
+
+def earthdata_login(interactive=True):
+    """
+    NASA Earthdata username and password.
+
+    They are read from $EARTHDATA_USERNAME and $EARTHDATA_PASSWORD, then from
+    the urs.earthdata.nasa.gov entry of ~/.netrc (or $NETRC), and only then
+    asked for in the login window.
+
+    Parameters
+    ----------
+    interactive : bool
+        Open the login window if the login is not found. If False, a missing
+        login is an error.
+
+    Returns
+    ----------
+    login : (str, str)
+        Username and password.
+    """
+    if os.environ.get(USERNAME_VARIABLE) and os.environ.get(PASSWORD_VARIABLE):
+        return os.environ[USERNAME_VARIABLE], os.environ[PASSWORD_VARIABLE]
+
+    try:
+        entry = netrc.netrc(netrc_path()).authenticators(EARTHDATA_HOST)
+    except (OSError, netrc.NetrcParseError):
+        entry = None
+    if entry is not None and entry[0] and entry[2]:
+        return entry[0], entry[2]
+
+    if not interactive:
+        raise RuntimeError(f'No Earthdata login: set {USERNAME_VARIABLE} and {PASSWORD_VARIABLE} '
+                           f'or add "machine {EARTHDATA_HOST} login ... password ..." to {netrc_path()}')
+    # PyQt is only needed for the window
+    from gpm_precipitation_tools.Login_UI import retrieveLogin
+    login = retrieveLogin()
+    if login is None:
+        raise RuntimeError('The Earthdata login was cancelled')
+    return tuple(login)
+
+
+def login_environment(login, environment=None):
+    """
+    Copy of an environment (default: this one) that gives a login to the
+    processes started with it, see earthdata_login.
+    """
+    environment = dict(os.environ if environment is None else environment)
+    environment[USERNAME_VARIABLE], environment[PASSWORD_VARIABLE] = login
+    return environment
@@ -0,0 +1,449 @@
+"""
+cutline_mask.py
+Rasterise the area of interest once and reuse it to crop every granule.
+
+The IMERG grid never changes, so instead of running gdalwarp -cutline on every
+timestep we burn the --SptSlc shapefile into a mask over the pixel window that
+covers it. Cropping a granule is then a numpy slice and a multiplication. The
+masks are kept on disk, keyed by the content of the shapefile and the grid, so
+later runs don't even rasterise it again.
+
+With an ID field, the features of the file are several zones (catchments)
+and they are rasterised once to a label grid, so the statistics of all the
+zones come from the same read of each granule.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import hashlib
+import functools
+import numpy
+from osgeo import gdal, ogr, osr
+
+
+DEFAULT_MASK_DIR = os.path.join(os.path.expanduser('~'), '.gpm_precipitation_tools', 'masks')
+SHAPEFILE_SIDECARS = ['.shp', '.shx', '.dbf', '.prj', '.cpg']
+# (supersample, all_touched) to try in turn for an area smaller than a pixel:
+# the fraction of the pixels it covers, then every pixel it touches
+FALLBACKS = [(10, False), (1, True)]
+
+
+def wgs84():
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+    if hasattr(osr, 'OAMS_TRADITIONAL_GIS_ORDER'):
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return srs
+
+
+def shapefile_digest(cutfile):
+    """
+    sha256 of the content of a vector file (and of its sidecar files for a shapefile).
+
+    Parameters
+    ----------
+    cutfile : str
+        Path to the shapefile or GeoPackage.
+
+    Returns
+    ----------
+    digest : str
+        Hex digest that changes whenever the geometry file changes.
+    """
+    base, extension = os.path.splitext(cutfile)
+    if extension.lower() == '.shp':
+        paths = [base + sidecar for sidecar in SHAPEFILE_SIDECARS if os.path.exists(base + sidecar)]
+    else:
+        paths = [cutfile]
+
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(os.path.splitext(path)[1].encode())
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024*1024), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def aoi_window(cutfile, x_pixels, y_pixels, buffer=1):
+    """
+    Pixel window of the global WGS84 grid that covers the features of a shapefile.
+
+    The window is computed once per shapefile and grid, and then reused for every granule.
+
+    Parameters
+    ----------
+    cutfile : str
+        Path to the shapefile of the area of interest (any coordinate system).
+    x_pixels : int
+        Number of columns of the global grid (longitude).
+    y_pixels : int
+        Number of rows of the global grid (latitude, north up).
+    buffer : int
+        Extra pixels kept around the features.
+
+    Returns
+    ----------
+    window : (int, int, int, int)
+        Column offset, row offset, number of columns and number of rows.
+    """
+    shapes = ogr.Open(cutfile)
+    if shapes is None:
+        raise IOError("Couldn't open the shapefile " + cutfile)
+    layer = shapes.GetLayer()
+
+    # Bring the features to WGS84 before measuring them
+    transformation = None
+    if layer.GetSpatialRef() is not None:
+        transformation = osr.CoordinateTransformation(layer.GetSpatialRef(), wgs84())
+
+    lon_min = lat_min = numpy.inf
+    lon_max = lat_max = -numpy.inf
+    for feature in layer:
+        geometry = feature.GetGeometryRef().Clone()
+        if transformation is not None:
+            geometry.Transform(transformation)
+        x0, x1, y0, y1 = geometry.GetEnvelope()
+        lon_min = min(lon_min, x0); lon_max = max(lon_max, x1)
+        lat_min = min(lat_min, y0); lat_max = max(lat_max, y1)
+
+    if not numpy.isfinite(lon_min):
+        raise ValueError("There are no features in " + cutfile)
+
+    X_PXL_SIZE = 360. / x_pixels
+    Y_PXL_SIZE = 180. / y_pixels
+
+    col_start = max(0, int(numpy.floor((lon_min + 180) / X_PXL_SIZE)) - buffer)
+    col_end = min(x_pixels, int(numpy.ceil((lon_max + 180) / X_PXL_SIZE)) + buffer)
+    row_start = max(0, int(numpy.floor((90 - lat_max) / Y_PXL_SIZE)) - buffer)
+    row_end = min(y_pixels, int(numpy.ceil((90 - lat_min) / Y_PXL_SIZE)) + buffer)
+
+    return col_start, row_start, col_end - col_start, row_end - row_start
+
+
+def rasterise(cutfile, window, x_pixels, y_pixels, supersample=1, all_touched=False):
+    """
+    Burn the features of a shapefile into a window of the global grid.
+
+    A pixel is inside when its centre is inside a feature, like gdalwarp -cutline,
+    or when a feature touches it with all_touched.
+    With supersample > 1 every pixel is split in supersample x supersample
+    sub-pixels and the result is the fraction of sub-pixels inside.
+
+    Returns
+    ----------
+    mask : 2-D numpy array (float32)
+        Values between 0 and 1 over the window.
+    """
+    col_off, row_off, n_cols, n_rows = window
+    X_PXL_SIZE = 360. / x_pixels
+    Y_PXL_SIZE = 180. / y_pixels
+
+    target = gdal.GetDriverByName('MEM').Create('', n_cols * supersample, n_rows * supersample, 1, gdal.GDT_Byte)
+    target.SetGeoTransform((-180 + col_off * X_PXL_SIZE, X_PXL_SIZE / supersample, 0,
+                            90 - row_off * Y_PXL_SIZE, 0, -Y_PXL_SIZE / supersample))
+    target.SetProjection(wgs84().ExportToWkt())
+
+    shapes = ogr.Open(cutfile)
+    gdal.RasterizeLayer(target, [1], shapes.GetLayer(), burn_values=[1], options=['ALL_TOUCHED=TRUE'] if all_touched else [])
+    burnt = target.GetRasterBand(1).ReadAsArray().astype(numpy.float32)
+    target = shapes = None
+
+    if supersample == 1:
+        return burnt
+    return burnt.reshape(n_rows, supersample, n_cols, supersample).mean(axis=(1, 3))
+
+
+def trim(window, mask):
+    """
+    Shrink a window and its mask to the pixels that are (partly) inside, like -crop_to_cutline.
+    """
+    rows = numpy.flatnonzero(mask.any(axis=1))
+    cols = numpy.flatnonzero(mask.any(axis=0))
+    if len(rows) == 0:
+        raise ValueError('The area of interest does not cover any pixel of the grid')
+    col_off, row_off = window[0] + cols[0], window[1] + rows[0]
+    mask = mask[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return (int(col_off), int(row_off), mask.shape[1], mask.shape[0]), mask
+
+
+@functools.lru_cache(maxsize=None)
+def cutline_mask(cutfile, x_pixels, y_pixels, fractional=False, cache_dir=None):
+    """
+    Window and mask of the area of interest on the global grid, from the disk cache if possible.
+
+    Parameters
+    ----------
+    cutfile : str
+        Path to the shapefile of the area of interest.
+    x_pixels : int
+        Number of columns of the global grid.
+    y_pixels : int
+        Number of rows of the global grid.
+    fractional : bool
+        Weight the pixels on the edges by the fraction of their area inside
+        instead of keeping them whole if their centre is inside.
+    cache_dir : str
+        Where the masks are kept. Defaults to $GPM_MASK_CACHE or
+        ~/.gpm_precipitation_tools/masks.
+
+    Returns
+    ----------
+    window : (int, int, int, int)
+        Column offset, row offset, number of columns and number of rows.
+    mask : 2-D numpy array (float32)
+        1 inside, 0 outside (fractions on the edges with fractional). An
+        area that holds no pixel centre gets the fraction of the pixels it
+        covers, or else every pixel it touches.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('GPM_MASK_CACHE', DEFAULT_MASK_DIR)
+    mode = 'fraction' if fractional else 'centre'
+    cache_file = os.path.join(cache_dir, f'{shapefile_digest(cutfile)}_{x_pixels}x{y_pixels}_{mode}.npz')
+
+    if os.path.exists(cache_file):
+        try:
+            with numpy.load(cache_file) as cached:
+                return tuple(int(v) for v in cached['window']), cached['mask']
+        except (OSError, ValueError, KeyError):
+            pass
+
+    window = aoi_window(cutfile, x_pixels, y_pixels)
+    mask = rasterise(cutfile, window, x_pixels, y_pixels, supersample=10 if fractional else 1)
+    for supersample, all_touched in FALLBACKS:
+        if mask.any():
+            break
+        # no pixel centre inside: a catchment smaller than a pixel
+        mask = rasterise(cutfile, window, x_pixels, y_pixels, supersample=supersample, all_touched=all_touched)
+    window, mask = trim(window, mask)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = cache_file[:-4] + f'.{os.getpid()}.tmp.npz'
+    numpy.savez(temporary, window=numpy.array(window), mask=mask)
+    os.replace(temporary, cache_file)
+    return window, mask
+
+
+def label_layer(cutfile, id_field):
+    """
+    Copy the features of a vector file into a memory layer with an integer label per ID.
+
+    Features that share an ID (e.g. the parts of a catchment) get the same label.
+
+    Returns
+    ----------
+    memory : ogr.DataSource
+        Data source that owns the layer (keep it alive while using the layer).
+    layer : ogr.Layer
+        Features with a 'label' field, 1 for the first ID, 2 for the second...
+    ids : list of str
+        IDs in the order of their labels.
+    """
+    shapes = ogr.Open(cutfile)
+    if shapes is None:
+        raise IOError("Couldn't open the shapefile " + cutfile)
+    layer = shapes.GetLayer()
+    if layer.GetLayerDefn().GetFieldIndex(id_field) < 0:
+        raise ValueError(f'There is no field {id_field} in {cutfile}')
+
+    memory = ogr.GetDriverByName('Memory').CreateDataSource('labels')
+    labels = memory.CreateLayer('labels', layer.GetSpatialRef(), ogr.wkbUnknown)
+    labels.CreateField(ogr.FieldDefn('label', ogr.OFTInteger))
+
+    ids = {}
+    for feature in layer:
+        label = ids.setdefault(str(feature.GetField(id_field)), len(ids) + 1)
+        copy = ogr.Feature(labels.GetLayerDefn())
+        copy.SetGeometry(feature.GetGeometryRef().Clone())
+        copy.SetField('label', label)
+        labels.CreateFeature(copy)
+    if not ids:
+        raise ValueError("There are no features in " + cutfile)
+    return memory, labels, list(ids)
+
+
+def rasterise_labels(cutfile, id_field, window, x_pixels, y_pixels, supersample=1, all_touched=False):
+    """
+    Burn the label of every feature into a window of the global grid (every pixel it touches with all_touched).
+
+    Returns
+    ----------
+    ids : list of str
+        IDs of the features, the label of ids[k] is k + 1.
+    burnt : 2-D numpy array (int32)
+        Label of every (sub-)pixel, 0 outside the features. Where features
+        overlap the last one wins.
+    """
+    col_off, row_off, n_cols, n_rows = window
+    X_PXL_SIZE = 360. / x_pixels
+    Y_PXL_SIZE = 180. / y_pixels
+
+    target = gdal.GetDriverByName('MEM').Create('', n_cols * supersample, n_rows * supersample, 1, gdal.GDT_Int32)
+    target.SetGeoTransform((-180 + col_off * X_PXL_SIZE, X_PXL_SIZE / supersample, 0,
+                            90 - row_off * Y_PXL_SIZE, 0, -Y_PXL_SIZE / supersample))
+    target.SetProjection(wgs84().ExportToWkt())
+
+    memory, labels, ids = label_layer(cutfile, id_field)
+    gdal.RasterizeLayer(target, [1], labels, options=['ATTRIBUTE=label'] + (['ALL_TOUCHED=TRUE'] if all_touched else []))
+    burnt = target.GetRasterBand(1).ReadAsArray().astype(numpy.int32)
+    target = labels = memory = None
+    return ids, burnt
+
+
+def label_weights(burnt, n_labels, supersample=1):
+    """
+    Sparse (pixel, label, weight) table of a (supersampled) label grid.
+
+    A pixel appears once per label it contains, weighted by the fraction of
+    its sub-pixels with that label.
+
+    Returns
+    ----------
+    pixel : 1-D numpy array (int64)
+        Index of the pixel in the flattened window.
+    label : 1-D numpy array (int32)
+        Label minus 1, i.e. index in the list of IDs.
+    weight : 1-D numpy array (float32)
+        Fraction of the pixel covered by the label.
+    """
+    n_rows, n_cols = burnt.shape[0] // supersample, burnt.shape[1] // supersample
+    # one row of sub-pixel labels per pixel
+    sub = burnt.reshape(n_rows, supersample, n_cols, supersample).transpose(0, 2, 1, 3).reshape(n_rows * n_cols, -1)
+    pixel = numpy.repeat(numpy.arange(n_rows * n_cols, dtype=numpy.int64), sub.shape[1])
+    sub = sub.ravel()
+    inside = sub > 0
+
+    keys, counts = numpy.unique(pixel[inside] * (n_labels + 1) + sub[inside], return_counts=True)
+    return (keys // (n_labels + 1), (keys % (n_labels + 1) - 1).astype(numpy.int32),
+            (counts / float(supersample * supersample)).astype(numpy.float32))
+
+
+def zone_mask(window, zones):
+    """
+    Mask of the pixels of a window that are (partly) in any of the zones.
+    """
+    mask = numpy.zeros(window[2] * window[3], dtype=numpy.float32)
+    mask[zones['pixel']] = 1
+    return mask.reshape(window[3], window[2])
+
+
+def area_weights(cutfile, x_pixels, y_pixels, window, fractional=False, id_field=None):
+    """
+    Fraction of every pixel of a cropped window inside the area of interest (or any of its catchments).
+
+    Parameters
+    ----------
+    cutfile : str
+        Path to the shapefile the rasters were cropped with.
+    x_pixels, y_pixels : int
+        Number of columns and rows of the global grid.
+    window : (int, int, int, int)
+        Window of the cropped rasters, see envi_io.global_window.
+    fractional : bool
+        The rasters were cropped with fractional weights.
+    id_field : str
+        ID field of the catchments the rasters were cropped with, or None for a single area.
+
+    Returns
+    ----------
+    weights : 2-D numpy array (float32)
+        1 inside, 0 outside, fractions on the edges with fractional.
+    """
+    if id_field is None:
+        area_window, weights = cutline_mask(cutfile, x_pixels, y_pixels, fractional=fractional)
+    else:
+        area_window, zones = catchment_zones(cutfile, id_field, x_pixels, y_pixels, fractional=fractional)
+        # a pixel shared by several catchments counts once
+        cover = numpy.bincount(zones['pixel'], weights=zones['weight'], minlength=area_window[2] * area_window[3])
+        weights = numpy.minimum(cover, 1).astype(numpy.float32).reshape(area_window[3], area_window[2])
+    if tuple(area_window) != tuple(window):
+        raise ValueError(f'The rasters were not cropped with the area of {cutfile}')
+    return weights
+
+
+@functools.lru_cache(maxsize=None)
+def catchment_zones(cutfile, id_field, x_pixels, y_pixels, fractional=False, cache_dir=None):
+    """
+    Window of all the features of a vector file and the zone of every pixel, from the disk cache if possible.
+
+    The zones are a sparse label grid: the per-zone means of a granule are then
+    one numpy.bincount, however many features there are.
+
+    Parameters
+    ----------
+    cutfile : str
+        Path to the shapefile or GeoPackage with one or more features per zone.
+    id_field : str
+        Attribute with the ID of the zone of each feature.
+    x_pixels : int
+        Number of columns of the global grid.
+    y_pixels : int
+        Number of rows of the global grid.
+    fractional : bool
+        Weight the pixels by the fraction of their area in each zone instead
+        of giving them to the zone their centre is in. A zone that holds no
+        pixel centre is weighted by fraction anyway, or else gets every pixel
+        it touches.
+    cache_dir : str
+        Where the zones are kept. Defaults to $GPM_MASK_CACHE or
+        ~/.gpm_precipitation_tools/masks.
+
+    Returns
+    ----------
+    window : (int, int, int, int)
+        Column offset, row offset, number of columns and number of rows.
+    zones : dict
+        ids (list of str), and pixel, label, weight and total (1-D numpy arrays):
+        see label_weights. total is the sum of the weights of each zone.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('GPM_MASK_CACHE', DEFAULT_MASK_DIR)
+    mode = 'fraction' if fractional else 'centre'
+    field = hashlib.sha256(id_field.encode()).hexdigest()[:8]
+    cache_file = os.path.join(cache_dir, f'{shapefile_digest(cutfile)}_{field}_{x_pixels}x{y_pixels}_{mode}_zones.npz')
+
+    if os.path.exists(cache_file):
+        try:
+            with numpy.load(cache_file) as cached:
+                zones = {name: cached[name] for name in ['pixel', 'label', 'weight', 'total']}
+                zones['ids'] = [str(i) for i in cached['ids']]
+                return tuple(int(v) for v in cached['window']), zones
+        except (OSError, ValueError, KeyError):
+            pass
+
+    supersample = 10 if fractional else 1
+    window = aoi_window(cutfile, x_pixels, y_pixels)
+    ids, burnt = rasterise_labels(cutfile, id_field, window, x_pixels, y_pixels, supersample=supersample)
+    pixel, label, weight = label_weights(burnt, len(ids), supersample=supersample)
+    for finer, all_touched in FALLBACKS:
+        missing = numpy.setdiff1d(numpy.arange(len(ids)), label)
+        if len(missing) == 0:
+            break
+        # catchments smaller than a pixel hold no pixel centre: add the pixels they cover or touch
+        _, burnt = rasterise_labels(cutfile, id_field, window, x_pixels, y_pixels, supersample=finer, all_touched=all_touched)
+        extra = label_weights(burnt, len(ids), supersample=finer)
+        keep = numpy.isin(extra[1], missing)
+        pixel, label, weight = [numpy.concatenate([found, more[keep]]) for found, more in zip((pixel, label, weight), extra)]
+
+    # Shrink the window to the pixels in any zone and renumber them
+    full = window
+    window, _ = trim(full, zone_mask(full, {'pixel': pixel}))
+    rows = pixel // full[2] - (window[1] - full[1])
+    cols = pixel % full[2] - (window[0] - full[0])
+    pixel = rows * window[2] + cols
+
+    zones = {'ids': ids, 'pixel': pixel, 'label': label, 'weight': weight,
+             'total': numpy.bincount(label, weights=weight, minlength=len(ids))}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    temporary = cache_file[:-4] + f'.{os.getpid()}.tmp.npz'
+    numpy.savez(temporary, window=numpy.array(window), ids=numpy.array(ids),
+                pixel=pixel, label=label, weight=weight, total=zones['total'])
+    os.replace(temporary, cache_file)
+    return window, zones
@@ -0,0 +1,348 @@
+"""
+download_engine.py
+Shared in-process downloader for the NASA GPM (GES DISC) archive.
+
+All the gpm_*_download functions hand their list of granules to a GPMDownloader
+instead of starting one wget process per file. The downloader keeps one
+keep-alive HTTP session per worker thread, so the TLS handshake and the
+Earthdata login redirect are paid once per worker and not once per granule.
+The workers and their sessions live as long as the downloader.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.credentials import EARTHDATA_HOST
+
+
+DEFAULT_WORKERS = 4
+# seconds before the first retry, doubled at every attempt
+DEFAULT_BACKOFF = 1.
+
+
+def retryable(status_code):
+    """
+    True for the answers of a server that is busy or failing, which may work later.
+    """
+    return status_code == 429 or status_code >= 500
+
+
+def retry_after(response):
+    """
+    Seconds the server asks to wait (Retry-After header), or None.
+    """
+    try:
+        return float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class EarthdataSession(requests.Session):
+    """
+    requests session that keeps the Earthdata credentials across the redirect
+    from the GES DISC data server to the login server and back.
+
+    requests strips the Authorization header whenever a redirect changes host.
+    This is the behaviour we want everywhere except between GES DISC and
+    urs.earthdata.nasa.gov.
+    """
+
+    def __init__(self, username, password, pool_size=DEFAULT_WORKERS):
+        super().__init__()
+        self.auth = (username, password)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        self.mount('https://', adapter)
+        self.mount('http://', adapter)
+
+    def rebuild_auth(self, prepared_request, response):
+        headers = prepared_request.headers
+        url = prepared_request.url
+
+        if 'Authorization' in headers:
+            original_host = urlparse(response.request.url).hostname
+            redirect_host = urlparse(url).hostname
+
+            if original_host != redirect_host and redirect_host != EARTHDATA_HOST and original_host != EARTHDATA_HOST:
+                del headers['Authorization']
+
+
+class GPMDownloader(object):
+    """
+    Bounded pool of download workers sharing the same NASA Earthdata login.
+
+    Parameters
+    ----------
+    username : str
+        NASA Earthdata username.
+    password : str
+        NASA Earthdata password.
+    workers : int
+        Number of granules downloaded at the same time.
+    retries : int
+        Number of extra attempts for a granule before giving up on it. Only
+        connection errors, 429 (too many requests) and 5xx answers are tried again.
+    backoff : float
+        Seconds to wait before the first retry, doubled at every attempt.
+    timeout : float
+        Seconds to wait for the server before an attempt fails.
+    chunk_size : int
+        Number of bytes written to disk at a time.
+    listing_cache : ListingCache
+        Local cache of the directory listings read with get_text.
+    """
+
+    def __init__(self, username, password, workers=DEFAULT_WORKERS, retries=3, backoff=DEFAULT_BACKOFF, timeout=60, chunk_size=1024*1024, listing_cache=None):
+        self.username = username
+        self.password = password
+        self.workers = max(1, int(workers))
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.listing_cache = listing_cache
+        self._local = threading.local()
+        self._sessions = []
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def session(self):
+        """
+        Return the keep-alive session of the calling thread, creating it on first use.
+        """
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = EarthdataSession(self.username, self.password, pool_size=self.workers)
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def pool(self):
+        """
+        Return the worker threads, started on first use. Their sessions stay open between calls.
+        """
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions = []
+        self._local = threading.local()
+
+    def get_text(self, url):
+        """
+        Read a remote page (e.g. a directory listing) as text, going through
+        the listing cache if there is one.
+
+        Parameters
+        ----------
+        url : str
+            Address of the page.
+
+        Returns
+        ----------
+        text : str or None
+            Decoded page, or None if the page could not be read.
+        """
+        if self.listing_cache is not None:
+            return self.listing_cache.get_text(url, self.get_conditional)
+
+        result = self.get_conditional(url)
+        if result is None or result[0] != 200:
+            return None
+        return result[1]
+
+    def get_conditional(self, url, headers=None):
+        """
+        Read a remote page with extra request headers (e.g. If-None-Match).
+
+        Returns
+        ----------
+        result : (int, str, CaseInsensitiveDict) or None
+            Status code, decoded page and response headers (any spelling of
+            their names works), or None if the server could not be reached.
+        """
+        try:
+            response = self.session().get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException:
+            return None
+        return response.status_code, response.content.decode('utf-8'), response.headers
+
+    def fetch(self, url, target):
+        """
+        Download a single granule to target.
+
+        The data is streamed to a temporary .part file that is only renamed
+        once the transfer is complete, so an interrupted run never leaves a
+        truncated granule behind.
+
+        Parameters
+        ----------
+        url : str
+            Address of the granule.
+        target : str
+            Path of the file to write.
+
+        Returns
+        ----------
+        info : dict or None
+            size, remote_modified (Last-Modified header) and checksum (sha256)
+            of the granule, or None if it could not be downloaded.
+        """
+        partial = target + '.part'
+        delay = self.backoff
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(delay)
+                delay *= 2
+            try:
+                with self.session().get(url, stream=True, timeout=self.timeout) as response:
+                    if response.status_code == 404:
+                        # planned granules that are not published yet
+                        print(f'{url} is not on the server')
+                        return None
+                    if response.status_code >= 400 and not retryable(response.status_code):
+                        # e.g. 401 or 403: asking again won't change the answer
+                        print(f'{url} was refused ({response.status_code}), check the Earthdata login and the approved applications')
+                        break
+                    if retryable(response.status_code) and retry_after(response) is not None:
+                        delay = max(delay, retry_after(response))
+                    response.raise_for_status()
+                    digest = hashlib.sha256()
+                    size = 0
+                    with open(partial, 'wb') as f:
+                        for chunk in response.iter_content(chunk_size=self.chunk_size):
+                            f.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+                    remote_modified = response.headers.get('Last-Modified')
+                os.replace(partial, target)
+                return {'size': size, 'remote_modified': remote_modified, 'checksum': digest.hexdigest()}
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError,
+                    requests.exceptions.ChunkedEncodingError) as error:
+                print(f'attempt {attempt + 1} failed for {url}: {error}')
+            except (requests.RequestException, OSError) as error:
+                print(f'could not download {url}: {error}')
+                break
+
+        if os.path.exists(partial):
+            os.remove(partial)
+        return None
+
+    def remote_modified(self, url):
+        """
+        Last-Modified header of a remote file, read with a HEAD request.
+        """
+        try:
+            response = self.session().head(url, allow_redirects=True, timeout=self.timeout)
+        except requests.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return response.headers.get('Last-Modified')
+
+    def outdated(self, jobs, manifest, revalidate=False):
+        """
+        Keep the jobs whose granule is missing from the manifest or, with
+        revalidate, has changed on the server since it was downloaded.
+
+        Parameters
+        ----------
+        jobs : list of (str, str)
+            (url, target path) pairs.
+        manifest : DownloadManifest
+            Manifest of the download directory.
+        revalidate : bool
+            Ask the server (HEAD request) whether the granules already
+            downloaded have changed.
+
+        Returns
+        ----------
+        jobs : list of (str, str)
+            Jobs that still have to be downloaded.
+        """
+        if not revalidate:
+            return [job for job in jobs if not manifest.is_current(os.path.basename(job[1]))]
+
+        def check(job):
+            name = os.path.basename(job[1])
+            if not manifest.is_current(name):
+                return True
+            return not manifest.is_current(name, remote_modified=self.remote_modified(job[0]))
+
+        keep = list(self.pool().map(check, jobs))
+        return [job for job, k in zip(jobs, keep) if k]
+
+    def download_all(self, jobs, manifest=None, on_done=None):
+        """
+        Download a list of granules with the worker pool.
+
+        Parameters
+        ----------
+        jobs : list of (str, str)
+            (url, target path) pairs.
+        manifest : DownloadManifest
+            If given, every finished granule is recorded in it.
+        on_done : function
+            If given, called from the worker thread with the target path of
+            every granule as soon as it is on disk.
+
+        Returns
+        ----------
+        results : list of (str, str, bool)
+            (url, target path, ok) for every job, in the order of jobs.
+        """
+        jobs = list(jobs)
+        if len(jobs) == 0:
+            return []
+
+        def work(job):
+            info = self.fetch(*job)
+            if info is not None and manifest is not None:
+                manifest.record(os.path.basename(job[1]), **info)
+            if info is not None and on_done is not None:
+                on_done(job[1])
+            return info is not None
+
+        oks = list(self.pool().map(work, jobs))
+
+        failed = [url for (url, target), ok in zip(jobs, oks) if not ok]
+        print(f'downloaded {len(jobs) - len(failed)} of {len(jobs)} files')
+        for url in failed:
+            print(f'could not download {url}')
+
+        return [(url, target, ok) for (url, target), ok in zip(jobs, oks)]
@@ -0,0 +1,115 @@
+"""
+download_manifest.py
+Record of the granules downloaded into a directory.
+
+Every finished download appends one JSON line with the file name, its size,
+the modification time given by the server and a checksum. A granule that is
+in the manifest and still on disk with the same size does not need to be
+requested again.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import json
+import hashlib
+import threading
+
+
+MANIFEST_NAME = 'download_manifest.jsonl'
+
+
+def file_checksum(path, chunk_size=1024*1024):
+    """
+    sha256 of a file on disk, read in chunks.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest(object):
+    """
+    JSON-lines manifest of a download directory.
+
+    Parameters
+    ----------
+    directory : str
+        Download directory. The manifest is written inside it.
+    name : str
+        File name of the manifest.
+    """
+
+    def __init__(self, directory, name=MANIFEST_NAME):
+        self.directory = directory
+        self.path = os.path.join(directory, name)
+        self.entries = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        """
+        Read the manifest. Later lines override earlier ones for the same file.
+        """
+        self.entries = {}
+        self._cut_short = False
+        if not os.path.exists(self.path):
+            return
+        with open(self.path) as f:
+            for line in f:
+                self._cut_short = not line.endswith('\n')
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # a line cut short by an interrupted run
+                    continue
+                self.entries[entry['name']] = entry
+
+    def record(self, name, size, remote_modified=None, checksum=None):
+        """
+        Add a downloaded granule to the manifest.
+        """
+        entry = {'name': name, 'size': size, 'remote_modified': remote_modified, 'checksum': checksum}
+        with self._lock:
+            self.entries[name] = entry
+            with open(self.path, 'a') as f:
+                if self._cut_short:
+                    f.write('\n')
+                    self._cut_short = False
+                f.write(json.dumps(entry) + '\n')
+
+    def is_current(self, name, remote_modified=None):
+        """
+        True if a granule was downloaded, is still on disk with the recorded size
+        and, when remote_modified is given, has not changed on the server since.
+        """
+        entry = self.entries.get(name)
+        if entry is None:
+            return False
+        path = os.path.join(self.directory, name)
+        if not os.path.exists(path) or os.path.getsize(path) != entry['size']:
+            return False
+        if remote_modified is not None and entry['remote_modified'] is not None:
+            return remote_modified == entry['remote_modified']
+        return True
+
+    def verify(self, name):
+        """
+        True if the granule on disk still matches the recorded checksum.
+        """
+        entry = self.entries.get(name)
+        if entry is None or entry['checksum'] is None or not self.is_current(name):
+            return False
+        return file_checksum(os.path.join(self.directory, name)) == entry['checksum']
+
+    def missing(self, names):
+        """
+        Names of the granules that still have to be downloaded.
+        """
+        return [name for name in names if not self.is_current(name)]
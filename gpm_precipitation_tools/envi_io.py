@@ -0,0 +1,261 @@
+"""
+envi_io.py
+Read the processed ENVI rasters (.bil + .hdr) without GDAL.
+
+The time series stage opens thousands of small rasters that all share the same
+header. The header is plain text, so it is parsed once and every .bil is then
+mapped straight into memory with numpy, and all the statistics of a file are
+computed from that single read.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import shutil
+import numpy
+
+
+# ENVI "data type" codes
+ENVI_DTYPES = {1: 'u1', 2: 'i2', 3: 'i4', 4: 'f4', 5: 'f8', 12: 'u2', 13: 'u4', 14: 'i8', 15: 'u8'}
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+def header_path(bil_file):
+    """
+    Path of the .hdr of an ENVI file: GDAL writes name.hdr, other tools name.bil.hdr.
+    """
+    candidates = [os.path.splitext(bil_file)[0] + '.hdr', bil_file + '.hdr']
+    for candidate in candidates:
+        if os.path.exists(candidate):
+            return candidate
+    raise IOError("Couldn't find the ENVI .hdr file of " + bil_file)
+
+
+def read_header(hdr_file):
+    """
+    Parse an ENVI header.
+
+    Parameters
+    ----------
+    hdr_file : str
+        Path to the .hdr file.
+
+    Returns
+    ----------
+    header : dict
+        samples, lines, bands, offset, dtype (numpy dtype with the byte order)
+        and interleave, plus the raw text of every other field.
+    """
+    fields = {}
+    with open(hdr_file) as f:
+        lines = f.read().splitlines()
+    if not lines or lines[0].strip() != 'ENVI':
+        raise IOError(hdr_file + " is not an ENVI header")
+
+    key, value = None, None
+    for line in lines[1:]:
+        if key is not None:
+            # inside a {...} value that spans several lines
+            value += '\n' + line
+        elif '=' in line:
+            key, value = [part.strip() for part in line.split('=', 1)]
+        else:
+            continue
+        if value.startswith('{') and not value.rstrip().endswith('}'):
+            continue
+        fields[key.lower()] = value
+        key, value = None, None
+
+    byte_order = '>' if fields.get('byte order', '0').strip() == '1' else '<'
+    header = dict(fields)
+    header.update({
+        'samples': int(fields['samples']),
+        'lines': int(fields['lines']),
+        'bands': int(fields.get('bands', 1)),
+        'offset': int(fields.get('header offset', 0)),
+        'dtype': numpy.dtype(byte_order + ENVI_DTYPES[int(fields['data type'])]),
+        'interleave': fields.get('interleave', 'bsq').lower(),
+    })
+    return header
+
+
+def data_size(header):
+    """
+    Size in bytes that the .bil file of a header should have.
+    """
+    return header['offset'] + header['samples'] * header['lines'] * header['bands'] * header['dtype'].itemsize
+
+
+def read_band(bil_file, header=None):
+    """
+    Memory-map the first band of an ENVI file.
+
+    Parameters
+    ----------
+    bil_file : str
+        Path to the .bil file.
+    header : dict
+        Header from read_header, shared by all the files of a run.
+        Read from the file's own .hdr if None.
+
+    Returns
+    ----------
+    band : 2-D numpy.memmap
+        lines x samples, read only.
+    """
+    if header is None:
+        header = read_header(header_path(bil_file))
+    samples, lines, bands = header['samples'], header['lines'], header['bands']
+
+    data = numpy.memmap(bil_file, dtype=header['dtype'], mode='r', offset=header['offset'])
+    if header['interleave'] == 'bsq':
+        return data[:lines * samples].reshape(lines, samples)
+    if header['interleave'] == 'bil':
+        return data.reshape(lines, bands, samples)[:, 0, :]
+    return data.reshape(lines, samples, bands)[:, :, 0]
+
+
+def zonal_statistics(band, percentiles=DEFAULT_PERCENTILES, wet_threshold=0., weights=None, scaled=False):
+    """
+    Statistics of a precipitation grid over the area of interest.
+
+    The window of a cropped file is the rectangle around the area, with zeros
+    outside it. With the weights of the pixels (cutline_mask.area_weights),
+    only the pixels inside count: the mean and the wet fraction weight them by
+    the fraction of their area inside, and the max and the percentiles use
+    their precipitation.
+
+    Parameters
+    ----------
+    band : 2-D numpy array
+        Precipitation of one timestep.
+    percentiles : sequence of numbers
+        Percentiles to compute, between 0 and 100.
+    wet_threshold : float
+        A pixel is wet when its precipitation is above this value.
+    weights : 2-D numpy array
+        Fraction of each pixel inside the area, 0 outside. Every pixel counts
+        in full if None.
+    scaled : bool
+        The band was already multiplied by the weights, as image_process.process
+        does for a single area.
+
+    Returns
+    ----------
+    stats : dict
+        mean, max, sum, wet_fraction and one pNN entry per percentile.
+    """
+    # one read from disk, then every statistic from memory
+    values = numpy.asarray(band).ravel()
+    if weights is None:
+        stats = {
+            'mean': float(values.mean()),
+            'max': float(values.max()),
+            'sum': float(values.sum(dtype=numpy.float64)),
+            'wet_fraction': float(numpy.count_nonzero(values > wet_threshold)) / values.size,
+        }
+    else:
+        weights = numpy.asarray(weights, dtype=numpy.float64).ravel()
+        inside = numpy.flatnonzero(weights > 0)
+        weights = weights[inside]
+        values = values[inside].astype(numpy.float64)
+        if scaled:
+            total = values.sum()
+            values /= weights
+        else:
+            total = numpy.dot(values, weights)
+        area = weights.sum()
+        stats = {
+            'mean': float(total / area),
+            'max': float(values.max()),
+            'sum': float(total),
+            'wet_fraction': float(weights[values > wet_threshold].sum() / area),
+        }
+    if len(percentiles):
+        for q, value in zip(percentiles, numpy.percentile(values, percentiles)):
+            stats[percentile_name(q)] = float(value)
+    return stats
+
+
+def percentile_name(q):
+    """
+    Column name of a percentile, e.g. p90 or p99.5.
+    """
+    return 'p' + ('%g' % q)
+
+
+def statistic_names(percentiles=DEFAULT_PERCENTILES):
+    """
+    Names of the statistics given by zonal_statistics, in order.
+    """
+    return ['mean', 'max', 'sum', 'wet_fraction'] + [percentile_name(q) for q in percentiles]
+
+
+def global_window(header):
+    """
+    Size of the global grid and window of it covered by an ENVI file, from its map info.
+
+    Returns
+    ----------
+    x_pixels, y_pixels : int
+        Number of columns and rows of the global WGS84 grid.
+    window : (int, int, int, int)
+        Column offset, row offset, number of columns and number of rows.
+    """
+    if 'map info' not in header:
+        raise ValueError('The ENVI header has no map info')
+    fields = [field.strip() for field in header['map info'].strip('{}').split(',')]
+    # projection, reference pixel (x, y), its coordinates (x, y), pixel size (x, y), ...
+    ref_x, ref_y, x0, y0, dx, dy = [float(field) for field in fields[1:7]]
+    x0 -= (ref_x - 1) * dx
+    y0 += (ref_y - 1) * dy
+    x_pixels, y_pixels = int(round(360. / dx)), int(round(180. / dy))
+    window = (int(round((x0 + 180) / dx)), int(round((90 - y0) / dy)), header['samples'], header['lines'])
+    return x_pixels, y_pixels, window
+
+
+def zonal_means(band, zones):
+    """
+    Mean of a precipitation grid in every zone of a label grid.
+
+    Parameters
+    ----------
+    band : 2-D numpy array
+        Precipitation of one timestep over the window of the zones.
+    zones : dict
+        Zones from cutline_mask.catchment_zones.
+
+    Returns
+    ----------
+    means : 1-D numpy array
+        One (weighted) mean per zone, in the order of zones['ids'].
+        NaN for a zone that covers no pixel.
+    """
+    values = numpy.asarray(band).ravel()[zones['pixel']] * zones['weight']
+    sums = numpy.bincount(zones['label'], weights=values, minlength=len(zones['ids']))
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return sums / zones['total']
+
+
+def write_band(bil_file, band, hdr_file):
+    """
+    Write a grid as an ENVI file with the header of another file of the same grid.
+
+    Parameters
+    ----------
+    bil_file : str
+        Path to the new .bil file (its .hdr is written next to it).
+    band : 2-D numpy array
+        Grid to write, converted to the data type of the header.
+    hdr_file : str
+        Header to copy, e.g. the one of a file the grid was computed from.
+    """
+    header = read_header(hdr_file)
+    if band.shape != (header['lines'], header['samples']) or header['bands'] != 1 or header['offset'] != 0:
+        raise ValueError(f'A {band.shape} grid does not fit the header {hdr_file}')
+    numpy.asarray(band, dtype=header['dtype']).tofile(bil_file)
+    shutil.copyfile(hdr_file, os.path.splitext(bil_file)[0] + '.hdr')
@@ -32,151 +32,42 @@ import string
 import datetime
 import urllib.request
 
-from gpm_precipitation_tools.Login_UI import retrieveLogin
+from gpm_precipitation_tools.credentials import earthdata_login
+from gpm_precipitation_tools.download_engine import GPMDownloader, DEFAULT_WORKERS
+from gpm_precipitation_tools.granule_planner import plan_granules, verify_plan
+from gpm_precipitation_tools.download_manifest import DownloadManifest
 
-def gpm_day_download(input_dir, Start_Date = None,End_Date = None, backslh ='\\'):
+def gpm_day_download(input_dir, Start_Date = None,End_Date = None, backslh ='\\', workers = DEFAULT_WORKERS, verify = False, listing_cache = None, revalidate = False, on_done = None):
 
 
     # This is my auto-login
-    GetLoginInfo = list(retrieveLogin())
-
-    #Get actual time
-    try:
-        Start_Date = list(map(int,Start_Date.split('-')))
-        start_year = int(Start_Date[0])
-        start_month = int(Start_Date[1])
-        start_day = int(Start_Date[2])
-    except:
-        Start_Date = ['2000','06','01']
-        start_year = int(Start_Date[0])
-        start_month = int(Start_Date[1])
-        start_day = int(Start_Date[2])
-    try:
-        End_Date =  list(map(int,(End_Date).split('-')))
-        end_year = int(End_Date[0])
-        end_month = int(End_Date[1])
-        end_day = int(End_Date[2])
-    except:
-        End_Date = list(map(int,((datetime.datetime.now()).strftime('%Y-%m-%d')).split('-')))
-        end_year = int(End_Date[0])
-        end_month = int(End_Date[1])
-        end_day = int(End_Date[2])
-
-
-    str_Start_Date = list(map(str,Start_Date))
-    str_End_Date = list(map(str,End_Date))
-
-
-
-    #Start month
-    if len(str_Start_Date[1]) == 1:
-        str_Start_Date[1] = '0' + str_Start_Date[1]
-    #End month
-    if len(str_End_Date[1]) == 1:
-        str_End_Date[1] = '0' + str_End_Date[1]
-
-    #Start day
-    if len(str_Start_Date[2]) == 1:
-        str_Start_Date[2] = '0' + str_Start_Date[2]
-    #End day
-    if len(str_End_Date[2]) == 1:
-       str_End_Date[2] = '0' + str_End_Date[2]
-
-
-    #print str_Start_Date
-    years = list(map(str,range(start_year,end_year+1)))
-
-    #Download files
-    try:
-        for i in range(0,len(years),1):
-
-            month = []
-            months = []
-
-            month = list(map(str,range(1,13)))
-
-            months = list(map(lambda x: '0' + x if len(x)==1 else x,month))
-
-            if years[i] == str_Start_Date[0]:
-                try:
-                    del months[:months.index(str_Start_Date[1])]
-                except:
-                    pass
-
-            if years[i] == str_End_Date[0]:
-                try:
-                    del months[months.index(str_End_Date[1])+1:]
-                except:
-                    pass
-
-            for j in range(0,len(months),1):
-                #print months[j]
-                url ='https://gpm1.gesdisc.eosdis.nasa.gov/data/GPM_L3/GPM_3IMERGDF.06/'+years[i]+'/'+months[j]+'/'
-                print (url)
-
-                #quit()
-                #Acess the URL
-                try:
-                    urlpath =urlopen(url)
-                except:
-                    continue
-                #Decode the URL
-                string = urlpath.read().decode('utf-8')
-
-                #Extract HDF5 files and make an file list
-                pattern = re.compile('3B.*?nc4.*?')
-                filelist = list(set(list(map(str,pattern.findall(string)))))
-                filelist.sort()
-                #print (filelist)
-
-
-                try:
-                    try:
-                        startImg = filelist.index('3B-DAY.MS.MRG.3IMERG.'+str_Start_Date[0]+str_Start_Date[1]+str_Start_Date[2]+'-S000000-E235959.V06.nc4')
-                    except:
-                        startImg = filelist.index('3B-DAY.MS.MRG.3IMERG.20000601-S000000-E235959.V06.nc4')
-                except:
-                    startImg = None
-
-                #DEL UNDER START
-                if years[i] == str_Start_Date[0]:
-                    if months[j] == str_Start_Date[1]:
-                        #Start month
-                        try:
-                            del filelist[:startImg]
-                        except:
-                            pass
-                    else:
-                        pass
-                else:
-                    pass
-
-                try:
-                    endImg = filelist.index('3B-DAY.MS.MRG.3IMERG.'+str_End_Date[0]+str_End_Date[1]+str_End_Date[2]+'-S000000-E235959.V06.nc4')
-
-                except:
-                    endImg = None
-
-                #DEL OVER END
-                if years[i] == str_End_Date[0]:
-                    if months[j] == str_End_Date[1]:
-                        #End month
-                        try:
-                            del filelist[endImg+1:]
-                        except:
-                            pass
-                else:
-                    pass
-
-                filteredList = filelist #= list(filter(lambda x: x not in os.listdir(input_dir),filelist))
-
-                #print(filteredList)
-
-                for item in range(0,len(filteredList)):
-                    os.system('wget --user=' + GetLoginInfo[0] + ' --password=' + GetLoginInfo[1] + ' --show-progress -c -q '+  url + filteredList[item] + ' -O ' + input_dir + backslh + filteredList[item])
-
-                    #os.system('wget --user=' + os.environ["NASA_USERNAME"] + ' --password=' + os.environ["NASA_PASSWORD"] + ' --show-progress -c -q '+  url + filteredList[item] + ' -O ' + input_dir + backslh + filteredList[item])
-
-    except:
-        print ('\nDownloads finished')
+    GetLoginInfo = list(earthdata_login())
+    downloader = GPMDownloader(GetLoginInfo[0], GetLoginInfo[1], workers=workers, listing_cache=listing_cache)
+
+    # One file per day, named after the date: no need to read the monthly listings
+    plan = plan_granules('GPM_D', Start_Date, End_Date)
+    print (f'{len(plan)} files planned between {Start_Date} and {End_Date}')
+
+    # Only read the listings if we want to check the plan against the server
+    if verify == True:
+        plan = verify_plan(plan, 'GPM_D', downloader.get_text)
+
+    # Skip what is already on disk and recorded in the manifest
+    manifest = DownloadManifest(input_dir)
+    jobs = [(granule.url, input_dir + backslh + granule.name) for granule in plan]
+    filteredList = downloader.outdated(jobs, manifest, revalidate=revalidate)
+    print (f'{len(plan) - len(filteredList)} files already downloaded')
+
+    # The files we already have can be processed straight away
+    if on_done is not None:
+        to_download = set(filteredList)
+        for job in jobs:
+            if job not in to_download:
+                on_done(job[1])
+
+    results = downloader.download_all(filteredList, manifest=manifest, on_done=on_done)
+    downloader.close()
+
     print ('\nDownloads finished')
+    # (url, target, ok) of every download, to tell the caller about the failed ones
+    return results
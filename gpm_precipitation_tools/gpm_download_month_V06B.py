@@ -33,7 +33,9 @@ import datetime
 import numpy as np
 from urllib.request import urlopen
 
-from gpm_precipitation_tools.Login_UI import retrieveLogin
+from gpm_precipitation_tools.credentials import earthdata_login
+from gpm_precipitation_tools.download_engine import GPMDownloader, DEFAULT_WORKERS
+from gpm_precipitation_tools.download_manifest import DownloadManifest
 
 def what_files_to_keep_case_1(mylist,start_month_download,end_month_download, items_to_keep):
     # for the first year of the data required, given the end date is also in that year and there is only one year to take data from
@@ -90,9 +92,11 @@ def what_files_to_keep_case_4(mylist, end_month_download,items_to_keep):
 
 
 
-def gpm_month_download(outputDir, Start_Date = None,End_Date = None, backslh ='\\'):
+def gpm_month_download(outputDir, Start_Date = None,End_Date = None, backslh ='\\', workers = DEFAULT_WORKERS, listing_cache = None, revalidate = False, on_done = None):
 
-    GetLoginInfo = list(retrieveLogin())
+    GetLoginInfo = list(earthdata_login())
+    downloader = GPMDownloader(GetLoginInfo[0], GetLoginInfo[1], workers=workers, listing_cache=listing_cache)
+    manifest = DownloadManifest(outputDir)
 
     #Get actual time
     try:
@@ -145,6 +149,7 @@ def gpm_month_download(outputDir, Start_Date = None,End_Date = None, backslh ='\
     num_months = (end_datetime.year - start_datetime.year) * 12 + (end_datetime.month - start_datetime.month)
     full_file_list = []
     year_count = 0
+    results = []
 
 
     for i in range(0,len(years),1):
@@ -154,20 +159,19 @@ def gpm_month_download(outputDir, Start_Date = None,End_Date = None, backslh ='\
         print(url)
 
         #Acess the URL
-        try:
-            urlpath =urlopen(url)
-        except:
+        string = downloader.get_text(url)
+        if string is None:
+            # the files of this year are missing
+            print(f'could not read {url}')
+            results.append((url, None, False))
             continue
 
-        #Decode the URL
-        string = urlpath.read().decode('utf-8')
-
         #Extract HDF5 files and make a file list
         pattern = re.compile('3B.*?HDF5.*?')
         filelist = list(set(list(map(str,pattern.findall(string)))))
         filelist.sort()
 
-        filteredList = filelist #= list(filter(lambda x: x not in os.listdir(outputDir),filelist))
+        filteredList = filelist
         # extend to get a full list
         #full_file_list.extend(filteredList)
         start_month_download = int(str_Start_Date[1])
@@ -176,6 +180,7 @@ def gpm_month_download(outputDir, Start_Date = None,End_Date = None, backslh ='\
 
         months_to_download = np.arange(int(start_month_download), int(end_month_download),1)
         #items_to_keep = []
+        already_kept = len(items_to_keep)
         #print(f'this is year count {year_count}')
         #print(f'this is the length of years: {len(years)}')
         if (year_count == 0 and len(years)==1):
@@ -206,10 +211,21 @@ def gpm_month_download(outputDir, Start_Date = None,End_Date = None, backslh ='\
         print('Starting download')
 
 
-        for item in range(0,len(items_to_keep)):
-            os.system('wget --user=' + GetLoginInfo[0] + ' --password=' + GetLoginInfo[1] + ' --show-progress -c -q '+  url + items_to_keep[item] + ' -O ' + outputDir + backslh + items_to_keep[item])
+        # only this year's files live under this year's url, and we skip the ones in the manifest
+        jobs = [(url + name, outputDir + backslh + name) for name in items_to_keep[already_kept:]]
+        to_download = downloader.outdated(jobs, manifest, revalidate=revalidate)
+
+        # The files we already have can be processed straight away
+        if on_done is not None:
+            for job in jobs:
+                if job not in to_download:
+                    on_done(job[1])
+
+        results.extend(downloader.download_all(to_download, manifest=manifest, on_done=on_done))
 
-            #os.system('wget --user=' + os.environ["NASA_USERNAME"] + ' --password=' + os.environ["NASA_PASSWORD"] + ' --show-progress -c -q '+  url + items_to_keep[item] + ' -O ' + outputDir + backslh + items_to_keep[item])
+    downloader.close()
+    # (url, target, ok) of every download, to tell the caller about the failed ones
+    return results
 
     #except:
         #print ('\nDownloads finished')
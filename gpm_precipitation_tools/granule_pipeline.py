@@ -0,0 +1,278 @@
+"""
+granule_pipeline.py
+Process the granules of a run, in parallel and/or while the rest of the date
+range is still downloading.
+
+Every granule is independent (translate, rotate, scale, write, crop), so they
+are spread over a pool of processes. In streaming mode the download workers put
+every finished granule in a bounded queue and a consumer thread hands them to
+the pool as they come. When the queue is full the download workers wait, so the
+downloads can't run away from the processing.
+
+With a RunState, the granules already processed with the same raw file and
+settings are skipped, so a run that was stopped picks up where it was. With a
+ProcessedCache, a granule processed before with the same settings, in any run,
+is taken from the cache instead of being processed again.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import queue
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.General_functions import process_granule, granule_output, cutline_path, run_precision, \
+    catchment_field, fractional_cover
+from gpm_precipitation_tools.cutline_mask import shapefile_digest
+from gpm_precipitation_tools.timeseries_state import settings_digest
+from gpm_precipitation_tools.run_state import file_signature
+
+
+DEFAULT_QUEUE_SIZE = 16
+
+
+def process_one(task):
+    """
+    Process a single granule, catching its errors so that the others go on.
+
+    Parameters
+    ----------
+    task : tuple
+        (arglist, file_name, zero_dir, process_dir, backslh, cache, settings),
+        cache being a ProcessedCache or None and settings the processing_settings
+        of arglist.
+
+    Returns
+    ----------
+    result : (str, str or None)
+        Granule name and the error traceback, or None if it worked.
+    """
+    arglist, file_name, zero_dir, process_dir, backslh, cache, settings = task
+    try:
+        outfile = granule_output(arglist, file_name, process_dir, backslh)
+        if cache is None or outfile is None:
+            process_granule(arglist, file_name, zero_dir, process_dir, backslh)
+            return file_name, None
+        key = cache.key(os.path.join(zero_dir, file_name), settings)
+        if not cache.fetch(key, outfile):
+            process_granule(arglist, file_name, zero_dir, process_dir, backslh)
+            cache.store(key, outfile)
+        return file_name, None
+    except Exception:
+        return file_name, traceback.format_exc()
+
+
+def processing_settings(arglist):
+    """
+    Settings of a run that change the processed files.
+    """
+    return {'product': arglist[0],
+            'area': shapefile_digest(cutline_path(arglist)) if cutline_path(arglist) is not None else None,
+            'precision': run_precision(arglist), 'id_field': catchment_field(arglist),
+            'fractional': fractional_cover(arglist)}
+
+
+def granule_digest(settings, path):
+    """
+    Digest of the processing of a granule: its raw file and the settings of the run.
+    """
+    return settings_digest(dict(settings, raw=file_signature(path)))
+
+
+def processing_digests(arglist, file_names, zero_dir):
+    """
+    Digest of the processing of each granule on disk.
+    """
+    settings = processing_settings(arglist)
+    return {file_name: granule_digest(settings, os.path.join(zero_dir, file_name))
+            for file_name in file_names if os.path.isfile(os.path.join(zero_dir, file_name))}
+
+
+def process_granules(arglist, file_names, zero_dir, process_dir, backslh, workers=1, run_state=None, cache=None):
+    """
+    Process a list of granules with a pool of worker processes.
+
+    Parameters
+    ----------
+    arglist : list
+        [ProdTP, StartDate, EndDate, ProcessDir, SptSlc, OP, Precision, SptID, Fractional] from PPT_CMD_RUN.
+    file_names : list of str
+        Names of the raw granules in zero_dir.
+    zero_dir : str
+        Directory of the raw granules.
+    process_dir : str
+        Directory of the processed files.
+    backslh : str
+        Path separator.
+    workers : int
+        Number of processes. 1 processes the granules in this process.
+    run_state : RunState
+        Skip the granules already processed and record the new ones.
+    cache : ProcessedCache
+        Take the granules processed before from the cache and add the new ones.
+
+    Returns
+    ----------
+    results : list of (str, str or None)
+        Granule name and error traceback (None if it worked), in the order of
+        file_names (without the granules skipped).
+    """
+    if run_state is not None:
+        file_names = [file_name for file_name in file_names if granule_output(arglist, file_name, process_dir, backslh) is not None]
+        digests = processing_digests(arglist, file_names, zero_dir)
+        pending = run_state.pending(file_names, 'processed', digests)
+        print(f'{len(file_names) - len(pending)} files were already processed')
+        file_names = pending
+
+    settings = processing_settings(arglist) if cache is not None else None
+    tasks = [(arglist, file_name, zero_dir, process_dir, backslh, cache, settings) for file_name in file_names]
+
+    if workers <= 1:
+        results = [process_one(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(process_one, tasks))
+
+    failed = [(file_name, error) for file_name, error in results if error is not None]
+    if run_state is not None:
+        done = [file_name for file_name, error in results if error is None]
+        run_state.mark_many(done, 'processed', digests,
+                            {file_name: granule_output(arglist, file_name, process_dir, backslh) for file_name in done})
+    print(f'processed {len(results) - len(failed)} of {len(results)} files')
+    if cache is not None:
+        cache.evict()
+    for file_name, error in failed:
+        print(f'{file_name} failed: {error}')
+    return results
+
+
+class StreamingProcessor(object):
+    """
+    Consumer side of the download-while-processing mode of PPT_CMD_RUN.
+
+    Parameters
+    ----------
+    arglist : list
+        [ProdTP, StartDate, EndDate, ProcessDir, SptSlc, OP, Precision, SptID, Fractional] from PPT_CMD_RUN.
+    zero_dir : str
+        Directory of the raw granules.
+    process_dir : str
+        Directory of the processed files.
+    backslh : str
+        Path separator.
+    queue_size : int
+        Number of downloaded granules allowed to wait for processing.
+    workers : int
+        Number of processes working on the granules.
+    run_state : RunState
+        Skip the granules already processed and record the new ones.
+    cache : ProcessedCache
+        Take the granules processed before from the cache and add the new ones.
+    """
+
+    def __init__(self, arglist, zero_dir, process_dir, backslh, queue_size=DEFAULT_QUEUE_SIZE, workers=1, run_state=None, cache=None):
+        self.arglist = arglist
+        self.zero_dir = zero_dir
+        self.process_dir = process_dir
+        self.backslh = backslh
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.workers = max(1, workers)
+        self.failed = []
+        self.processed = []
+        self.run_state = run_state
+        self.cache = cache
+        self._settings = processing_settings(arglist) if run_state is not None or cache is not None else None
+        self._digests = {}
+        self._consumer = None
+        self._pool = None
+        # at most one granule waiting per worker on top of the running ones
+        self._slots = threading.Semaphore(2 * self.workers)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.workers > 1:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        self._consumer = threading.Thread(target=self._consume, name='granule-consumer', daemon=True)
+        self._consumer.start()
+
+    def put(self, path):
+        """
+        Queue a granule that is on disk. Blocks while the queue is full.
+        """
+        file_name = os.path.basename(path)
+        if self.run_state is not None:
+            digest = self._digests[file_name] = granule_digest(self._settings, os.path.join(self.zero_dir, file_name))
+            if self.run_state.is_done(file_name, 'processed', digest):
+                return
+        self.queue.put(file_name)
+
+    def close(self):
+        """
+        Wait until every queued granule is processed.
+
+        Returns
+        ----------
+        failed : list of (str, str)
+            (granule name, error) of the granules that could not be processed.
+        """
+        if self._consumer is not None:
+            self.queue.put(None)
+            self._consumer.join()
+            self._consumer = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+        if self.cache is not None:
+            self.cache.evict()
+        return self.failed
+
+    def record(self, result):
+        file_name, error = result
+        if error is None:
+            self.processed.append(file_name)
+            if self.run_state is not None:
+                self.run_state.mark(file_name, 'processed', self._digests.get(file_name),
+                                    granule_output(self.arglist, file_name, self.process_dir, self.backslh))
+        else:
+            # one bad granule shouldn't stop the whole run
+            print(f'could not process {file_name}')
+            self.failed.append((file_name, error))
+
+    def _done(self, file_name, future):
+        self._slots.release()
+        try:
+            self.record(future.result())
+        except Exception:
+            # e.g. the worker process died
+            self.record((file_name, traceback.format_exc()))
+
+    def _consume(self):
+        while True:
+            file_name = self.queue.get()
+            if file_name is None:
+                break
+            task = (self.arglist, file_name, self.zero_dir, self.process_dir, self.backslh, self.cache, self._settings)
+            if self._pool is None:
+                self.record(process_one(task))
+            else:
+                self._slots.acquire()
+                future = self._pool.submit(process_one, task)
+                future.add_done_callback(lambda future, file_name=file_name: self._done(file_name, future))
@@ -0,0 +1,258 @@
+"""
+granule_planner.py
+Work out the names and addresses of the IMERG granules covering a date range
+without reading the remote directory listings.
+
+The GES DISC file names follow a fixed pattern, e.g. for the half-hourly product:
+3B-HHR-E.MS.MRG.3IMERG.20180101-S003000-E005959.0030.V06B.HDF5
+with 48 slots per day, the start/end time of the slot and the minute of the day.
+The listings are only needed to check a plan (see verify_plan).
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import re
+import datetime
+from collections import namedtuple
+
+
+GESDISC_URL = 'https://gpm1.gesdisc.eosdis.nasa.gov/data/GPM_L3/'
+
+# collection: remote folder of the product
+# directory: sub folders of a granule (year, day of year, month)
+# name: file name of a granule
+# step: '30min', 'day' or 'month'
+PRODUCTS = {
+    'GPM_30min': {
+        'collection': 'GPM_3IMERGHHE.06',
+        'directory': '{t:%Y}/{t:%j}/',
+        'name': '3B-HHR-E.MS.MRG.3IMERG.{t:%Y%m%d}-S{t:%H%M%S}-E{end:%H%M%S}.{minute:04d}.{version}.HDF5',
+        'version': 'V06B',
+        'step': '30min',
+    },
+    'GPM_D': {
+        'collection': 'GPM_3IMERGDF.06',
+        'directory': '{t:%Y}/{t:%m}/',
+        'name': '3B-DAY.MS.MRG.3IMERG.{t:%Y%m%d}-S000000-E235959.{version}.nc4',
+        'version': 'V06',
+        'step': 'day',
+    },
+    'GPM_M': {
+        'collection': 'GPM_3IMERGM.06',
+        'directory': '{t:%Y}/',
+        'name': '3B-MO.MS.MRG.3IMERG.{t:%Y%m}01-S000000-E235959.{t:%m}.{version}.HDF5',
+        'version': 'V06B',
+        'step': 'month',
+    },
+}
+
+Granule = namedtuple('Granule', ['name', 'url', 'directory', 'start'])
+
+
+def parse_date(date_string, default):
+    """
+    Read a date in the format %Y-%m-%d, falling back to default like the downloaders do.
+
+    Parameters
+    ----------
+    date_string : str, datetime.date or None
+        Date to read.
+    default : datetime.date
+        Date used if date_string can't be read.
+
+    Returns
+    ----------
+    date : datetime.date
+        Date read from date_string.
+    """
+    if isinstance(date_string, datetime.datetime):
+        return date_string.date()
+    if isinstance(date_string, datetime.date):
+        return date_string
+    try:
+        return datetime.datetime.strptime(str(date_string), '%Y-%m-%d').date()
+    except ValueError:
+        return default
+
+
+def slot_starts(step, start_date, end_date):
+    """
+    List the start times of every granule of a product between two dates (both included).
+
+    Parameters
+    ----------
+    step : str
+        '30min', 'day' or 'month'.
+    start_date : datetime.date
+        First day.
+    end_date : datetime.date
+        Last day.
+
+    Returns
+    ----------
+    starts : list of datetime
+        Start time of every granule.
+    """
+    starts = []
+    if step == 'month':
+        year, month = start_date.year, start_date.month
+        while (year, month) <= (end_date.year, end_date.month):
+            starts.append(datetime.datetime(year, month, 1))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return starts
+
+    t = datetime.datetime.combine(start_date, datetime.time())
+    end = datetime.datetime.combine(end_date, datetime.time()) + datetime.timedelta(days=1)
+    delta = datetime.timedelta(minutes=30) if step == '30min' else datetime.timedelta(days=1)
+    while t < end:
+        starts.append(t)
+        t += delta
+    return starts
+
+
+def slot_end(step, t):
+    """
+    End (excluded) of the slot of a step ('30min', 'day' or 'month') that starts at t.
+    """
+    if step == 'month':
+        return datetime.datetime(t.year + 1, 1, 1) if t.month == 12 else datetime.datetime(t.year, t.month + 1, 1)
+    return t + (datetime.timedelta(minutes=30) if step == '30min' else datetime.timedelta(days=1))
+
+
+def granule_name(product, t, version=None):
+    """
+    Name of the granule of a product starting at t.
+
+    Parameters
+    ----------
+    product : str
+        GPM_30min, GPM_D or GPM_M.
+    t : datetime
+        Start time of the granule.
+    version : str
+        Version suffix of the file. Defaults to the one in PRODUCTS.
+
+    Returns
+    ----------
+    name : str
+        File name on the GES DISC server.
+    """
+    spec = PRODUCTS[product]
+    end = t + datetime.timedelta(minutes=29, seconds=59)
+    minute = t.hour * 60 + t.minute
+    return spec['name'].format(t=t, end=end, minute=minute, version=version or spec['version'])
+
+
+def plan_granules(product, Start_Date=None, End_Date=None, version=None, now=None):
+    """
+    List every granule of a product between two dates, without any network access.
+
+    Slots that have not ended yet are left out since they can't be on the server.
+
+    Parameters
+    ----------
+    product : str
+        GPM_30min, GPM_D or GPM_M.
+    Start_Date : str or datetime.date
+        First day (%Y-%m-%d). Defaults to 2000-06-01 like the downloaders.
+    End_Date : str or datetime.date
+        Last day (%Y-%m-%d). Defaults to today.
+    version : str
+        Version suffix of the files. Defaults to the one in PRODUCTS.
+    now : datetime
+        Current UTC time, only used to drop the slots that have not ended.
+
+    Returns
+    ----------
+    plan : list of Granule
+        Expected granules, in time order.
+    """
+    spec = PRODUCTS[product]
+    if now is None:
+        now = datetime.datetime.utcnow()
+
+    start_date = parse_date(Start_Date, datetime.date(2000, 6, 1))
+    end_date = parse_date(End_Date, now.date())
+
+    plan = []
+    for t in slot_starts(spec['step'], start_date, end_date):
+        if slot_end(spec['step'], t) > now:
+            break
+        directory = GESDISC_URL + spec['collection'] + '/' + spec['directory'].format(t=t)
+        name = granule_name(product, t, version=version)
+        plan.append(Granule(name, directory + name, directory, t))
+    return plan
+
+
+def group_by_directory(plan):
+    """
+    Group a plan by remote directory, keeping the time order.
+
+    Returns
+    ----------
+    groups : dict
+        Remote directory url: list of Granule.
+    """
+    groups = {}
+    for granule in plan:
+        groups.setdefault(granule.directory, []).append(granule)
+    return groups
+
+
+def listed_names(text, product):
+    """
+    Extract the granule names from the html of a GES DISC directory listing.
+    """
+    extension = PRODUCTS[product]['name'].rsplit('.', 1)[-1]
+    pattern = re.compile(r'3B[^"<>/]*?\.' + extension + r'(?=["<])')
+    return sorted(set(pattern.findall(text)))
+
+
+def verify_plan(plan, product, get_text):
+    """
+    Check a plan against the remote directory listings.
+
+    A planned granule missing from its listing is replaced by the listed file
+    with the same start time (e.g. a newer version suffix), or dropped if there
+    is none. Directories whose listing can't be read are kept as planned.
+
+    Parameters
+    ----------
+    plan : list of Granule
+        Plan from plan_granules.
+    product : str
+        GPM_30min, GPM_D or GPM_M.
+    get_text : function
+        Reads a url and returns its text, or None on failure.
+
+    Returns
+    ----------
+    verified_plan : list of Granule
+        Granules that exist on the server.
+    """
+    verified_plan = []
+    for directory, granules in group_by_directory(plan).items():
+        text = get_text(directory)
+        if text is None:
+            verified_plan.extend(granules)
+            continue
+
+        names = listed_names(text, product)
+        by_start = {}
+        for name in names:
+            by_start.setdefault(name.split('.')[4], name)
+
+        available = set(names)
+        for granule in granules:
+            if granule.name in available:
+                verified_plan.append(granule)
+            elif granule.name.split('.')[4] in by_start:
+                name = by_start[granule.name.split('.')[4]]
+                verified_plan.append(Granule(name, directory + name, directory, granule.start))
+            else:
+                print(f'{granule.name} is not on the server')
+    return verified_plan
@@ -30,8 +30,39 @@ from osgeo import gdal, ogr, osr
 from osgeo.gdalnumeric import *
 from osgeo.gdalconst import *
 
+from gpm_precipitation_tools.cutline_mask import cutline_mask, catchment_zones, zone_mask
+from gpm_precipitation_tools.precision import resolve_dtype
+
+
+def precipitation_subdataset(data_file, dataInfo):
+	"""
+	GDAL name of the precipitation variable inside a GPM file.
+
+	Parameters
+	----------
+	data_file : str
+		Path to the HDF5 (or nc4) file.
+	dataInfo : str
+		GPM_M, GPM_D or GPM_30min.
+
+	Returns
+	----------
+	subdataset : str
+		Name that gdal.Open reads the precipitation band from.
+	"""
+	if dataInfo == 'GPM_30min':
+		variable = '//Grid/precipitationCal'
+	elif dataInfo == 'GPM_D':
+		variable = '//precipitationCal'
+	else:
+		variable = '//Grid/precipitation'
+	return 'HDF5:"' + str(data_file) + '":' + variable
+
+
+GDAL_TYPES = {numpy.dtype(numpy.float32): gdal.GDT_Float32, numpy.dtype(numpy.float64): gdal.GDT_Float64}
+
 
-def process(out_dir,data_file,dataInfo):
+def process(out_dir,data_file,dataInfo,cutfile=None,fractional=False,precision=None,id_field=None):
 	print ()
 	print ('PROCESSING')
 	print (out_dir)
@@ -41,6 +72,7 @@ def process(out_dir,data_file,dataInfo):
 
 
 	hourFactor = None
+	dtype = resolve_dtype(precision)
 
 	if dataInfo in ['GPM_D','GPM_30min']:
 		hourFactor = 1
@@ -79,36 +111,26 @@ def process(out_dir,data_file,dataInfo):
 	fname = str(data_file)
 	outname = str(out_dir)
 	outfile =  outname #[:-4].replace(".", "")
-	data_file_no_extension = os.path.splitext(data_file)[0]
 	#outfile = outfile + '.bil'
 
 	#####################################
-	# 0. Make the HDF5 file into a .tif containing the calibrated precipitation
+	# 0. Open the calibrated precipitation straight from the HDF5 file
+	# (no intermediate .tif, no gdal_translate process)
 	#####################################
 	print (f"data file name:{data_file}")
-	print(f'This is the data file no extension: {data_file_no_extension}')
-	#quit()
-	if dataInfo == 'GPM_30min':
-		os.system('gdal_translate -of GTiff HDF5:' + data_file + '://Grid/precipitationCal ' + data_file_no_extension + '.tif')
-	elif dataInfo == 'GPM_D':
-		os.system('gdal_translate -of GTiff HDF5:' + data_file + '://precipitationCal ' + data_file_no_extension + '.tif')
-	else:
-		os.system('gdal_translate -of GTiff HDF5:' + data_file + '://Grid/precipitation ' + data_file_no_extension + '.tif')
 
-	print('done converting')
-	print(' I can do my job up to here. I am not a complete failure yay!')
+	ds = gdal.Open(precipitation_subdataset(data_file, dataInfo))
+	if ds is None:
+		raise IOError("Couldn't open the precipitation in " + data_file)
 
 
 	#####################################
-	# 1. The produced .tif file is rotated 90° so we must rotated back and assign a correct projection
+	# 1. The precipitation grid is rotated 90° so we must rotated back and assign a correct projection
 	# While we're at it, let's amke it a .bil file
 	#####################################
 
 	print ('transposing and projecting into ', outfile)
 
-	# Open the created .tif
-	ds = gdal.Open(data_file_no_extension + '.tif')
-
 	# Find out its transformation
 	#gt=ds.GetGeoTransform()
 
@@ -116,20 +138,10 @@ def process(out_dir,data_file,dataInfo):
 	band = ds.GetRasterBand(1)
 	print('done extracting band')
 
-
-
-	arr = band.ReadAsArray()
-	TPSGPM = rot90(arr,1)
-	TPSGPM = ((TPSGPM.astype(float))> 0)*((TPSGPM.astype(float))*hourFactor) + ((TPSGPM.astype(float))< 0)*0
-
-	# Set the driver
-	driver = gdal.GetDriverByName("ENVI")
-	print('set the driver')
-
 	# Set the extents and pixel sizes. That will be the tricky part
 	x_pixels = ds.RasterYSize  # number of pixels in x
 	y_pixels = ds.RasterXSize  # number of pixels in y
-	# WHY THE SWITCH? WE ROTATED THE TPSGPM ArrAY, REMEMBER?
+	# WHY THE SWITCH? THE GRID IS STORED ROTATED, REMEMBER?
 
 	# x_min & y_max are like the "top left" corner. In WGS84, these are:
 	x_min = -180; x_max = 180
@@ -140,25 +152,55 @@ def process(out_dir,data_file,dataInfo):
 	Y_PXL_SIZE = (y_max - y_min) / y_pixels  # size of the Y pixels
 	print('calculated raster properties')
 
+	# Only read the window of the (rotated back) grid that covers the area of interest.
+	# The mask of the area is rasterised once and cached, so this replaces gdalwarp -cutline
+	if cutfile is None:
+		window, mask = (0, 0, x_pixels, y_pixels), None
+	elif id_field is None:
+		window, mask = cutline_mask(cutfile, x_pixels, y_pixels, fractional=fractional)
+	else:
+		# several catchments: keep every pixel of any of them, the time series weights them per catchment
+		window, zones = catchment_zones(cutfile, id_field, x_pixels, y_pixels, fractional=fractional)
+		mask = zone_mask(window, zones)
+	col_off, row_off, n_cols, n_rows = window
+
+	# In the stored grid, our rows are columns counted from the end and our columns are rows
+	# GDAL converts to our precision while reading, so there's no copy to make
+	arr = band.ReadAsArray(y_pixels - (row_off + n_rows), col_off, n_rows, n_cols, buf_type=GDAL_TYPES[dtype])
+	# One contiguous copy of the window, so that GDAL can write it as it is
+	TPSGPM = numpy.ascontiguousarray(rot90(arr,1))
+	arr = None
+
+	# Scale in place: the fill values (negative) become 0, then hours to the whole period
+	numpy.maximum(TPSGPM, 0, out=TPSGPM)
+	if hourFactor != 1:
+		TPSGPM *= hourFactor
+	if mask is not None:
+		TPSGPM *= mask
+
+	# Set the driver
+	driver = gdal.GetDriverByName("ENVI")
+	print('set the driver')
+
 
 	#wkt_projection = 'a projection in wkt that you got from other file'
 
 	# Create the dataset
 	dataset = driver.Create(
 		outfile,
-        x_pixels,
-        y_pixels,
+        n_cols,
+        n_rows,
         1,
-        gdal.GDT_Float32, )
+        GDAL_TYPES[dtype], )
 	print('created driver')
 
 	# Define the GeoTransform
 
 	dataset.SetGeoTransform((
-        x_min,    # 0
+        x_min + col_off * X_PXL_SIZE,    # 0
         X_PXL_SIZE,  # 1
         0,                      # 2
-        y_max,    # 3
+        y_max - row_off * Y_PXL_SIZE,    # 3
         0,                      # 4
         -Y_PXL_SIZE))
 
@@ -180,9 +222,5 @@ def process(out_dir,data_file,dataInfo):
 
 	# Save to disk
 	dataset.FlushCache()  # Write to disk.
-	print('remove tif file')
-
-	# remove the annoying tif file
-	os.system('rm ' + data_file_no_extension + '.tif')
-	print('Done removing')
+	dataset = ds = None
 	print('Script image_process.py is working fine')
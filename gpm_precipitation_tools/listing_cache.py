@@ -0,0 +1,160 @@
+"""
+listing_cache.py
+Local cache of the GES DISC directory listings.
+
+A listing is stored per product/year/(month|day of year), which is how the
+archive is organised. Listings of periods that ended long ago can't change any
+more and are kept forever; recent ones are revalidated with a conditional
+request (ETag / If-Modified-Since) once they are older than the TTL.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import json
+import time
+import calendar
+import datetime
+from urllib.parse import urlparse
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.gpm_precipitation_tools', 'listings')
+
+
+class ListingCache(object):
+    """
+    Directory listings cached on disk.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Where the listings are stored. Defaults to $GPM_LISTING_CACHE or
+        ~/.gpm_precipitation_tools/listings.
+    ttl : float
+        Seconds during which a recent listing is used without asking the server.
+    settle_days : int
+        Number of days after the end of a period after which its listing is
+        considered final. The final-run products are published a few months late.
+    """
+
+    def __init__(self, cache_dir=None, ttl=3600, settle_days=120):
+        if cache_dir is None:
+            cache_dir = os.environ.get('GPM_LISTING_CACHE', DEFAULT_CACHE_DIR)
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.settle_days = settle_days
+
+    def key(self, url):
+        """
+        Split a listing url into (collection, year, month or day of year).
+
+        e.g. .../GPM_L3/GPM_3IMERGHHE.06/2018/001/ gives ('GPM_3IMERGHHE.06', '2018', '001')
+        and .../GPM_L3/GPM_3IMERGM.06/2018/ gives ('GPM_3IMERGM.06', '2018', None).
+        """
+        parts = [part for part in urlparse(url).path.split('/') if part != '']
+        if len(parts) >= 3 and parts[-2].isdigit() and len(parts[-2]) == 4:
+            return parts[-3], parts[-2], parts[-1]
+        return parts[-2], parts[-1], None
+
+    def path(self, url):
+        collection, year, sub = self.key(url)
+        if sub is None:
+            return os.path.join(self.cache_dir, collection, year + '.json')
+        return os.path.join(self.cache_dir, collection, year, sub + '.json')
+
+    def period_end(self, url):
+        """
+        Last day covered by a listing.
+        """
+        collection, year, sub = self.key(url)
+        year = int(year)
+        if sub is None:
+            return datetime.date(year, 12, 31)
+        if len(sub) == 3:
+            return datetime.date(year, 1, 1) + datetime.timedelta(days=int(sub) - 1)
+        month = int(sub)
+        return datetime.date(year, month, calendar.monthrange(year, month)[1])
+
+    def is_final(self, url, today=None):
+        """
+        True if the period of a listing ended more than settle_days ago.
+        """
+        if today is None:
+            today = datetime.date.today()
+        try:
+            return (today - self.period_end(url)).days > self.settle_days
+        except ValueError:
+            return False
+
+    def load(self, url):
+        try:
+            with open(self.path(url)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def save(self, url, entry):
+        path = self.path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temporary, path)
+
+    def get_text(self, url, fetch):
+        """
+        Read a listing, from the cache if possible.
+
+        Parameters
+        ----------
+        url : str
+            Address of the listing.
+        fetch : function
+            fetch(url, headers) returns (status, text, headers) or None if
+            the server can't be reached.
+
+        Returns
+        ----------
+        text : str or None
+            Html of the listing.
+        """
+        entry = self.load(url)
+
+        if entry is not None:
+            if entry.get('final') or time.time() - entry['fetched'] < self.ttl:
+                return entry['text']
+
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        result = fetch(url, headers)
+        if result is None:
+            # Better an old listing than none at all
+            return entry['text'] if entry is not None else None
+
+        status, text, response_headers = result
+        # header names are case insensitive (servers send etag, ETag...)
+        response_headers = {name.lower(): value for name, value in response_headers.items()}
+        if status == 304 and entry is not None:
+            text = entry['text']
+        elif status != 200:
+            return entry['text'] if entry is not None else None
+
+        previous = entry if entry is not None else {}
+        self.save(url, {
+            'url': url,
+            'text': text,
+            'fetched': time.time(),
+            'final': self.is_final(url),
+            'etag': response_headers.get('etag', previous.get('etag')),
+            'last_modified': response_headers.get('last-modified', previous.get('last_modified')),
+        })
+        return text
@@ -0,0 +1,235 @@
+"""
+point_extraction.py
+Precipitation time series of many points (e.g. rain gauges) from the joint dataset.
+
+All the points are moved to the coordinate system of the rasters in one pyproj
+call, and their series are read together: the points are grouped by the
+storage chunk (tile) of the joint dataset they fall in, and only the box
+around the points of each tile is read, a block of timesteps at a time. Each
+chunk that holds a point is read once however many points there are, and
+memory stays within a budget however long the series are.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyproj
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.raster_stack import time_chunk, DEFAULT_MEMORY_BUDGET
+
+
+DEFAULT_POINTS_CRS = 'EPSG:4326'
+X_COLUMNS = ['lon', 'longitude', 'x', 'x_lon']
+Y_COLUMNS = ['lat', 'latitude', 'y', 'y_lat']
+ID_COLUMNS = ['id', 'name', 'station', 'point_id']
+
+
+def find_column(columns, candidates, what):
+    lower = {str(column).lower(): column for column in columns}
+    for candidate in candidates:
+        if candidate in lower:
+            return lower[candidate]
+    raise ValueError(f'No {what} column in the points, use one of {candidates}')
+
+
+def read_points(points_file):
+    """
+    Read the points of a CSV or GeoJSON file.
+
+    A CSV needs lon/lat (or x/y) columns and can have an id column. A GeoJSON
+    needs Point features, with their id in the feature id or an id property.
+    Points without an id are numbered from 0.
+
+    Parameters
+    ----------
+    points_file : str
+        Path to the .csv, .json or .geojson file.
+
+    Returns
+    ----------
+    ids : list of str
+        Name of each point.
+    xs, ys : 1-D numpy arrays
+        Coordinates of the points.
+    """
+    if os.path.splitext(points_file)[1].lower() in ['.json', '.geojson']:
+        with open(points_file) as f:
+            collection = json.load(f)
+        ids, xs, ys = [], [], []
+        for n, feature in enumerate(collection['features']):
+            geometry = feature['geometry']
+            if geometry['type'] != 'Point':
+                raise ValueError(f'Feature {n} of {points_file} is a {geometry["type"]}, not a Point')
+            properties = feature.get('properties') or {}
+            point_id = feature.get('id')
+            for column in ID_COLUMNS:
+                if point_id is None and column in properties:
+                    point_id = properties[column]
+            ids.append(str(n if point_id is None else point_id))
+            xs.append(geometry['coordinates'][0])
+            ys.append(geometry['coordinates'][1])
+        return ids, np.asarray(xs, dtype=float), np.asarray(ys, dtype=float)
+
+    points = pd.read_csv(points_file)
+    xs = points[find_column(points.columns, X_COLUMNS, 'longitude')].to_numpy(dtype=float)
+    ys = points[find_column(points.columns, Y_COLUMNS, 'latitude')].to_numpy(dtype=float)
+    try:
+        ids = points[find_column(points.columns, ID_COLUMNS, 'id')].astype(str).tolist()
+    except ValueError:
+        ids = [str(n) for n in range(len(points))]
+    return ids, xs, ys
+
+
+def transform_points(xs, ys, in_crs, out_crs):
+    """
+    Move arrays of coordinates to another coordinate system in one call.
+    """
+    transformer = pyproj.Transformer.from_crs(pyproj.CRS(in_crs), pyproj.CRS(out_crs), always_xy=True)
+    return transformer.transform(np.asarray(xs), np.asarray(ys))
+
+
+def nearest_index(coordinates, values):
+    """
+    Index of the nearest coordinate of each value, for increasing or decreasing coordinates.
+    """
+    values = np.asarray(values, dtype=float)
+    descending = len(coordinates) > 1 and coordinates[0] > coordinates[-1]
+    ordered = coordinates[::-1] if descending else coordinates
+    right = np.clip(np.searchsorted(ordered, values), 1, len(ordered) - 1) if len(ordered) > 1 else np.zeros(values.shape, dtype=int)
+    left = np.maximum(right - 1, 0)
+    index = np.where(np.abs(values - ordered[left]) <= np.abs(ordered[right] - values), left, right)
+    return len(ordered) - 1 - index if descending else index
+
+
+def storage_chunks(precipitation):
+    """
+    (time, y, x) sizes of the storage chunks of the precipitation, its whole size where it isn't chunked.
+    """
+    encoding = precipitation.encoding
+    sizes = encoding.get('chunksizes') or encoding.get('chunks')
+    if sizes is not None and len(sizes) == precipitation.ndim:
+        sizes = dict(zip(precipitation.dims, sizes))
+    else:
+        sizes = encoding.get('preferred_chunks') or {}
+    return tuple(int(sizes.get(dim) or precipitation.sizes[dim]) for dim in ['time', 'y', 'x'])
+
+
+def read_pixels(precipitation, rows, cols, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Series of many pixels of the joint dataset, reading only the chunks that hold them.
+
+    Pointwise indexing of a netCDF file reads the box of every row and column
+    of the points (xarray can only index it along each dimension), which is
+    about the whole dataset for scattered points. Instead, the points are
+    grouped by storage tile and the box around the points of each tile is
+    read, a block of whole time chunks at a time.
+
+    Parameters
+    ----------
+    precipitation : xarray DataArray
+        Precipitation along time, y and x (and a band of size 1), lazily loaded.
+    rows, cols : 1-D numpy arrays of int
+        Row and column of each point.
+    memory_budget : float
+        Memory allowed for a block, in MB.
+
+    Returns
+    ----------
+    values : 2-D numpy array
+        Precipitation, time x point.
+    """
+    rows, cols = np.asarray(rows, dtype=int), np.asarray(cols, dtype=int)
+    chunk_time, chunk_y, chunk_x = storage_chunks(precipitation)
+    precipitation = precipitation.squeeze([dim for dim in precipitation.dims if dim not in ['time', 'y', 'x']], drop=True)
+    precipitation = precipitation.transpose('time', 'y', 'x')
+    n_time = precipitation.sizes['time']
+    values = np.empty((n_time, len(rows)), dtype=precipitation.dtype)
+
+    tiles = {}
+    for n, (row, col) in enumerate(zip(rows, cols)):
+        tiles.setdefault((row // chunk_y, col // chunk_x), []).append(n)
+    for points in tiles.values():
+        tile_rows, tile_cols = rows[points], cols[points]
+        top, left = tile_rows.min(), tile_cols.min()
+        box = precipitation.isel(y=slice(top, tile_rows.max() + 1), x=slice(left, tile_cols.max() + 1))
+        step = time_chunk(box.sizes['y'], box.sizes['x'], precipitation.dtype, memory_budget)
+        # whole time chunks, so that no chunk is decompressed twice
+        step = max(1, step // chunk_time) * chunk_time
+        for start in range(0, n_time, step):
+            block = box.isel(time=slice(start, start + step)).values
+            values[start:start + len(block), points] = block[:, tile_rows - top, tile_cols - left]
+    return values
+
+
+def extract_points(joint_ds, ids, xs, ys, layout='wide', memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Precipitation series of many points, reading only the chunks of the joint dataset that hold them.
+
+    Parameters
+    ----------
+    joint_ds : xarray dataset
+        Joint dataset with a precipitation variable along time, y and x.
+    ids : list of str
+        Name of each point.
+    xs, ys : 1-D numpy arrays
+        Coordinates of the points in the coordinate system of the dataset.
+    layout : str
+        'wide': a column per point. 'long': one row per date and point.
+    memory_budget : float
+        Memory allowed for a block of the reads, in MB.
+
+    Returns
+    ----------
+    table : pandas DataFrame
+        Precipitation (mm/s) of the nearest pixel of every point, by date.
+    """
+    rows = nearest_index(joint_ds['y'].values, ys)
+    cols = nearest_index(joint_ds['x'].values, xs)
+    values = read_pixels(joint_ds['precipitation'], rows, cols, memory_budget)
+    return points_table(values, pd.to_datetime(joint_ds['time'].values), ids, xs, ys, layout)
+
+
+def points_table(values, dates, ids, xs, ys, layout='wide'):
+    """
+    Table of the series of many points.
+
+    Parameters
+    ----------
+    values : 2-D numpy array
+        Precipitation (mm/s), time x point.
+    dates : sequence of datetime
+        Date of each timestep.
+    ids : list of str
+        Name of each point.
+    xs, ys : 1-D numpy arrays
+        Coordinates of the points, written in the long layout.
+    layout : str
+        'wide': a column per point. 'long': one row per date and point.
+
+    Returns
+    ----------
+    table : pandas DataFrame
+        Series by date.
+    """
+    wide = pd.DataFrame(values, index=pd.Index(dates, name='date'), columns=ids).sort_index()
+    if layout == 'wide':
+        return wide
+    if layout != 'long':
+        raise ValueError(f'Unknown layout {layout}, use wide or long')
+
+    coordinates = pd.DataFrame({'point_id': ids, 'x': xs, 'y': ys})
+    long = wide.reset_index().melt(id_vars='date', var_name='point_id', value_name='precipitation_mm/s')
+    return long.merge(coordinates, on='point_id', how='left')[['date', 'point_id', 'x', 'y', 'precipitation_mm/s']]
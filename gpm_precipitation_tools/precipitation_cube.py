@@ -0,0 +1,143 @@
+"""
+precipitation_cube.py
+One open handle on the joint dataset of a run, serving points, maps and aggregates.
+
+The joint dataset (time x y x x) is opened once. Its coordinate system and the
+coordinates of its pixels are read once and kept, so every request after that
+only reads the values it needs.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import pandas as pd
+import rioxarray
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.raster_stack import write_stack, open_stack, write_slice, DEFAULT_MEMORY_BUDGET
+from gpm_precipitation_tools.point_extraction import transform_points, points_table, nearest_index, read_pixels
+
+
+class PrecipitationCube(object):
+    """
+    Joint precipitation dataset of a run.
+
+    Parameters
+    ----------
+    path : str
+        netCDF file or Zarr store written by raster_stack.write_stack.
+    memory_budget : float
+        Memory allowed for a block of the point reads, in MB.
+    """
+
+    def __init__(self, path, memory_budget=DEFAULT_MEMORY_BUDGET):
+        self.path = path
+        self.memory_budget = memory_budget
+        self.dataset = open_stack(path)
+        self.precipitation = self.dataset['precipitation']
+        # read once: the metadata of the cube doesn't change while it's open
+        self.crs = self.dataset.rio.crs
+        if self.crs is None:
+            self.dataset.close()
+            raise ValueError(f'{path} has no coordinate system (no grid_mapping to a spatial_ref variable), stack the rasters again')
+        self.x = self.dataset['x'].values
+        self.y = self.dataset['y'].values
+        self.dates = pd.to_datetime(self.dataset['time'].values)
+
+    @classmethod
+    def from_rasters(cls, file_names, dates, output_file, dtype, memory_budget=DEFAULT_MEMORY_BUDGET, **storage):
+        """
+        Stack the rasters of a run (see raster_stack.write_stack) and open the result.
+        """
+        write_stack(file_names, dates, output_file, dtype, memory_budget=memory_budget, **storage)
+        return cls(output_file, memory_budget)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.dataset.close()
+
+    def pixels(self, xs, ys, crs=None):
+        """
+        Column and row of the pixel nearest to each point.
+
+        Parameters
+        ----------
+        xs, ys : sequences of floats
+            Coordinates of the points.
+        crs : str
+            Coordinate system of the points, the one of the cube if None.
+        """
+        if crs is not None:
+            xs, ys = transform_points(xs, ys, crs, self.crs)
+        return nearest_index(self.x, xs), nearest_index(self.y, ys)
+
+    def point_values(self, xs, ys, crs=None):
+        """
+        Series of many points, read together (time x point numpy array), see point_extraction.read_pixels.
+        """
+        cols, rows = self.pixels(xs, ys, crs)
+        return read_pixels(self.precipitation, rows, cols, self.memory_budget)
+
+    def points(self, ids, xs, ys, crs=None, layout='wide'):
+        """
+        Table of the series of many points, see point_extraction.points_table.
+        """
+        if crs is not None:
+            xs, ys = transform_points(xs, ys, crs, self.crs)
+        return points_table(self.point_values(xs, ys), self.dates, ids, xs, ys, layout)
+
+    def point_series(self, x, y, crs=None):
+        """
+        Series of one point, as a 1-D numpy array in order of time.
+        """
+        return self.point_values([x], [y], crs)[:, 0]
+
+    def slice(self, time):
+        """
+        Map of one timestep.
+        """
+        return self.precipitation.sel(time=time)
+
+    def write_slice(self, time, stem, **storage):
+        """
+        Write the map of one timestep, see raster_stack.write_slice.
+        """
+        return write_slice(self.slice(time), stem, **storage)
+
+    def aggregate(self, how='sum', freq=None):
+        """
+        Aggregate the cube along time.
+
+        Parameters
+        ----------
+        how : str
+            'sum', 'mean', 'max' or 'min'.
+        freq : str
+            pandas frequency (e.g. '1D', '1MS') to aggregate into a coarser
+            series of maps, or None for a single map over the whole period.
+        """
+        if how not in ['sum', 'mean', 'max', 'min']:
+            raise ValueError(f'Unknown aggregation {how}')
+        if freq is None:
+            return getattr(self.precipitation, how)('time')
+        return getattr(self.precipitation.resample(time=freq), how)()
+
+    def area_series(self, how='mean'):
+        """
+        Series of the mean (or other aggregate) of each map over the whole cube.
+        """
+        spatial = [dim for dim in self.precipitation.dims if dim != 'time']
+        return getattr(self.precipitation, how)(spatial).to_series()
@@ -0,0 +1,42 @@
+"""
+precision.py
+Floating point precision used for the precipitation grids across the package.
+
+Everything from the read of a granule to the joint netCDF file uses the same
+dtype, float32 by default: it is the precision of the IMERG data itself and
+halves the memory of every grid compared to numpy's default float64.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import numpy
+
+
+DEFAULT_PRECISION = 'float32'
+PRECISIONS = {'float32': numpy.float32, 'float64': numpy.float64}
+
+
+def resolve_dtype(precision=None):
+    """
+    numpy dtype of a precision name.
+
+    Parameters
+    ----------
+    precision : str
+        'float32' or 'float64'. Defaults to $GPM_PRECISION or float32.
+
+    Returns
+    ----------
+    dtype : numpy dtype
+        dtype of the precipitation grids.
+    """
+    if precision is None:
+        precision = os.environ.get('GPM_PRECISION', DEFAULT_PRECISION)
+    if precision not in PRECISIONS:
+        raise ValueError(f'Unknown precision {precision}, use one of {list(PRECISIONS)}')
+    return numpy.dtype(PRECISIONS[precision])
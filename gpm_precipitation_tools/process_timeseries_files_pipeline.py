@@ -15,13 +15,20 @@ import datetime
 import re
 import sys
 import argparse
-import glob
 import os
 import pandas as pd
 from shapely.geometry import Point
 from shapely.ops import transform
 import pyproj
 
+from gpm_precipitation_tools.precision import resolve_dtype, DEFAULT_PRECISION
+from gpm_precipitation_tools.point_extraction import read_points, DEFAULT_POINTS_CRS
+from gpm_precipitation_tools.precipitation_cube import PrecipitationCube
+from gpm_precipitation_tools.raster_catalog import RasterCatalog, CATALOG_NAME, folder_settings
+from gpm_precipitation_tools.series_io import write_series, format_argument, SERIES_FORMATS, DEFAULT_SERIES_FORMAT, EXTENSIONS
+from gpm_precipitation_tools.raster_stack import stack_file_name, read_map, write_slice, DEFAULT_MEMORY_BUDGET, \
+	OUTPUT_FORMATS, DEFAULT_OUTPUT_FORMAT, DEFAULT_CHUNKS, COMPRESSIONS, DEFAULT_COMPRESSION, DEFAULT_COMPLEVEL
+
 #=============================================================================
 # This is just a welcome screen that is displayed if no arguments are provided.
 #=============================================================================
@@ -35,6 +42,13 @@ def print_welcome():
 	print("Use --x_lon to define the longitude of the point")
 	print("Use --y_lat to define where the latitude of the point.")
 	print("Use --time to define the Date time in format %Y-%m-%d:%H%M%S.")
+	print("Use --points to give a CSV or GeoJSON file of points to extract all at once.")
+	print("Use --start_time and --end_time to only use the files of a period.")
+	print("Use --ProdTP and --SptSlc to only use the files of a product and area.")
+	print("Use --memory_budget to set the memory (MB) used to stack the files.")
+	print("Use --output_format to choose netcdf4 (default), zarr or netcdf3 files.")
+	print("Use --chunks to choose the chunks of the files: map, series (default) or time,y,x sizes.")
+	print("Use --compression to choose zlib (default), zstd or none.")
 	print("=======================================================================\n\n ")
 
 #=============================================================================
@@ -45,76 +59,67 @@ def main(args=None):
 	if args is None:
 		args = sys.argv[1:]
 	# If no arguments, send to the welcome screen.
-	if not len(sys.argv) > 1:
+	if not len(args) > 0:
 		full_paramfile = print_welcome()
 		sys.exit()
 
 	parser = argparse.ArgumentParser()
 	parser.add_argument("-f", "--file_folder", dest = "file_folder", help="Folder with the files")
 	parser.add_argument("-c", "--crs", dest = "crs", help="Coordinate system in the format EPSG:XXXX")
-	parser.add_argument("-x", "--x_lon",dest = "longitude", help="Longitude of point", type=int)
-	parser.add_argument("-y", "--y_lat",dest ="latitude", help="Latitude of point", type=int)
+	parser.add_argument("-x", "--x_lon",dest = "longitude", help="Longitude of point", type=float)
+	parser.add_argument("-y", "--y_lat",dest ="latitude", help="Latitude of point", type=float)
+	parser.add_argument("--points", dest = "points", help="CSV (lon, lat and optional id columns) or GeoJSON file of points, in the coordinate system of --crs (default EPSG:4326)")
+	parser.add_argument("--points_layout", dest = "points_layout", help="Table of the points: wide (a column per point, default) or long (a row per date and point)", choices=['wide','long'], default='wide')
 	parser.add_argument("-t", "--time",dest = "time", help="Date time in format %Y-%m-%d:%H%M%S")#, type=int)
+	parser.add_argument("--start_time", dest = "start_time", help="Only use the files from this date time (format %Y-%m-%d:%H%M%S)")
+	parser.add_argument("--end_time", dest = "end_time", help="Only use the files until this date time (format %Y-%m-%d:%H%M%S)")
+	parser.add_argument("--series_format", dest = "series_format", help="Format of the time series files: csv (default), parquet (needs pyarrow) or npz", choices=SERIES_FORMATS, default=DEFAULT_SERIES_FORMAT, type=format_argument)
+	parser.add_argument("--ProdTP", dest = "ProdTP", help="Only use the files of this product (default: the one of the time series of the folder)", choices=['GPM_M','GPM_D','GPM_30min'])
+	parser.add_argument("--SptSlc", dest = "SptSlc", help="Only use the files cropped with this shapefile (default: the one of the time series of the folder)")
+	parser.add_argument("--catalog", dest = "catalog", help="SQLite catalog of the files (default: raster_catalog.sqlite in the file folder)")
+	parser.add_argument("-p", "--precision", dest = "precision", help="Precision of the joint dataset: float32 (default) or float64", choices=['float32','float64'], default=DEFAULT_PRECISION)
+
+	parser.add_argument("-m", "--memory_budget", dest = "memory_budget", help="Memory (MB) used to stack the files, a block of timesteps at a time", type=float, default=DEFAULT_MEMORY_BUDGET)
+
+	parser.add_argument("-o", "--output_format", dest = "output_format", help="Format of the joint dataset: netcdf4 (default), zarr or netcdf3 (uncompressed)", choices=OUTPUT_FORMATS, default=DEFAULT_OUTPUT_FORMAT)
+	parser.add_argument("--chunks", dest = "chunks", help="Chunks of the joint dataset: map (one timestep per chunk), series (long series of small tiles, default) or time,y,x sizes", default=DEFAULT_CHUNKS)
+	parser.add_argument("--compression", dest = "compression", help="Compression of the joint dataset: zlib (default), zstd or none", choices=COMPRESSIONS, default=DEFAULT_COMPRESSION)
+	parser.add_argument("--complevel", dest = "complevel", help="Compression level", type=int, default=DEFAULT_COMPLEVEL)
 
-	args = parser.parse_args()
+	args = parser.parse_args(args)
 
 	file_folder = args.file_folder
 	coordinate = args.crs
 	x_lon_to_slice = args.longitude
 	y_lat_to_slice = args.latitude
 	time_to_slice = args.time
-	print(time_to_slice)
-	time_to_slice = datetime.datetime.strptime(time_to_slice, "%Y-%m-%d:%H%M%S")
-	print(type(time_to_slice))
-	print(time_to_slice)
-
-	# extract all raster files from the given folder
+	dtype = resolve_dtype(args.precision)
+	memory_budget = args.memory_budget
+	output_format = args.output_format
+	if time_to_slice is not None:
+		time_to_slice = datetime.datetime.strptime(time_to_slice, "%Y-%m-%d:%H%M%S")
+		print(time_to_slice)
+	start_time = datetime.datetime.strptime(args.start_time, "%Y-%m-%d:%H%M%S") if args.start_time else None
+	end_time = datetime.datetime.strptime(args.end_time, "%Y-%m-%d:%H%M%S") if args.end_time else None
+
+	# catalog of the raster files of the given folder: only the new files are looked at
 	os.chdir(file_folder)
-	file_names = []
-	for file in glob.glob("*.bil"):
-		file_names.append(file)
-
+	aoi = None
+	if args.SptSlc is not None:
+		from gpm_precipitation_tools.cutline_mask import shapefile_digest
+		aoi = shapefile_digest(args.SptSlc)
+	# the product and area of the files whose name doesn't tell them come from the time series of the folder
+	product, aoi = folder_settings('.', args.ProdTP, aoi)
+	catalog = RasterCatalog(args.catalog or CATALOG_NAME)
+	added, removed = catalog.update('.', aoi=aoi, product=product)
+	print(f'catalog of {file_folder}: {added} files added, {removed} removed')
 
-
-	print(f'These are the files I am going to process: {file_names}')
 	print(f'file folder: {file_folder},\
 	 longitude: {x_lon_to_slice},\
 	  latitude: {y_lat_to_slice}, \
 	  full_date: {time_to_slice}')
 
 
-	def sort_file_list(file_list):
-		"""
-		Sort list of files based on date given on the filename.
-
-		Parameters
-		----------
-		file_list : list of str
-			List of files to sort.
-
-		Returns
-		----------
-		file_list_sorted : list of str
-			List of sorted files.
-
-		Author: MRSO
-		"""
-		file_list_sorted=[]
-		timeformat = "%Y%m%d" # this is how your timestamp looks like
-		regex = re.compile("Calib_rainfall_([0-9]{8})-S([0-9]{6})")
-		#Calib_rainfall_20140110-S000000-bil
-		def gettimestamp(thestring):
-			m = regex.search(thestring)
-			print(m)
-			return datetime.datetime.strptime(m.groups()[0], timeformat)
-
-		for fn in sorted(file_list, key=gettimestamp):
-			file_list_sorted.append(fn)
-		return file_list_sorted
-
-
-
-
 	def extract_datetime_from_file(file_name):
 		"""
 		Extract date from a file name and convert it to a datetime object.
@@ -144,57 +149,47 @@ def main(args=None):
 		return date_formatted
 
 
-	def output_precipitation_timeseries(lon, lat, netcdf_filename):
+	def output_precipitation_timeseries(lon, lat, cube):
 		"""
-		Extract a precipitation timeseries from a netCDF file given a lat, lon point.
+		Extract a precipitation timeseries from the joint dataset given a lat, lon point.
 
 		Parameters
 		----------
-		lon : int
+		lon : float
 			Longitude.
-		lat : int
+		lat : float
 			Latitude.
-		netcdf_filename : str
-			Name of netCDF (.nc) file to extract date from.
+		cube : PrecipitationCube
+			Joint dataset, already open.
 
 		Returns
 		----------
-		precip_timeseries : list of int
+		precip_timeseries : numpy array
 			Timeseries of precipitation for the given lat, lon coordinates.
 		"""
-		joint_ds = xr.open_dataset(netcdf_filename, engine="rasterio")
-		print(joint_ds)
-		print('this is the joint business')
-		print(joint_ds.sel(x=lon, y = lat, method="nearest").precipitation)
-		precip_timeseries = joint_ds.sel(x=lon, y = lat, method="nearest").precipitation
-		# this following line sometimes fails
-		#precip_timeseries = joint_ds.sel(x=lon, y = lat, method="nearest").precipitation.to_numpy().ravel()
-		return precip_timeseries
-
-	def output_precipitation_raster(time_to_slice, netcdf_filename):
+		return cube.point_series(lon, lat)
+
+	def output_precipitation_raster(time_to_slice, cube):
 		"""
-		Slice a netCDF file from a timeslice and create new netCDF file with the sliced data.
+		Slice the joint dataset from a timeslice and create new netCDF file with the sliced data.
 
 		Parameters
 		----------
 		time_to_slice : datetime
 			Date and time to slice from the data.
-		netcdf_filename : str
-			Name of netCDF (.nc) file to extract date from.
+		cube : PrecipitationCube
+			Joint dataset, already open.
 
 		Returns
 		----------
 		None
 		"""
-		# could potentially increase functionality by adding output data format: netcdf or raster
-		joint_ds = xr.open_dataset(netcdf_filename, engine="rasterio")
-		sliced_joint_ds = joint_ds.sel(time=time_to_slice).precipitation
 		date_string_name = time_to_slice.strftime('%Y%m%d-%H%M%S')
-		sliced_joint_ds.to_netcdf(f'output_precipitation_raster_{date_string_name}.nc', mode='w', format='NETCDF3_64BIT')
-		#return sliced_joint_ds
+		cube.write_slice(time_to_slice, f'output_precipitation_raster_{date_string_name}',
+			output_format=output_format, compression=args.compression, complevel=args.complevel)
 
 
-	def concatenate_raster_files(dataset_names, output_joint_file_name):
+	def concatenate_raster_files(dataset_names, output_joint_file_name, date_list=None):
 		"""
 		Read from a list of raster files, concatenate them along the time direction\
 		and create a netCDF file.
@@ -205,35 +200,22 @@ def main(args=None):
 			Names of the raster files to concatenate.
 		output_joint_file_name : str
 			Name of output file.
+		date_list : list of datetime
+			Dates of the raster files, read from their names if None.
 
 		Returns
 		----------
-		joint_ds : xarray dataset
-			Concatenated raster files.
+		cube : PrecipitationCube
+			Concatenated raster files, opened once for all the outputs.
 		date_list : list of datetime
 			Dates corresponding to the raster files.
 		"""
-		joint_ds_list = []
-		date_list = []
-		for i in range(len(dataset_names)):
-			date_file = re.search("([0-9]{8})", dataset_names[i])
-			hour_file = re.search("(S[0-9]{6})", dataset_names[i])
-
-			date_file = extract_datetime_from_file(dataset_names[i])
-
-			xds = xr.open_dataset(dataset_names[i], engine="rasterio")
-			# the spatial reference is the coordinate system information
-			expanded_ds = xds.expand_dims("time").assign_coords(time=("time", [date_file]))
-			expanded_ds = expanded_ds.drop('band')
-			expanded_ds = expanded_ds.rename({'band_data':'precipitation'})
-			joint_ds_list.append(expanded_ds)
-			date_list.append(date_file)
-
-		joint_ds = xr.concat(joint_ds_list, dim='time')
-		joint_ds['precipitation'].attrs = {'description':'precipitation amount in mm/s'}
-		joint_ds.to_netcdf(output_joint_file_name, mode='w', format='NETCDF3_64BIT')
-
-		return joint_ds, date_list
+		# written a block of timesteps at a time, so the stack never has to fit in memory
+		if date_list is None:
+			date_list = [extract_datetime_from_file(dataset_name) for dataset_name in dataset_names]
+		cube = PrecipitationCube.from_rasters(dataset_names, date_list, output_joint_file_name, dtype, memory_budget=memory_budget,
+			output_format=output_format, chunks=args.chunks, compression=args.compression, complevel=args.complevel)
+		return cube, date_list
 
 	def convert_crs_point(point_x, point_y, in_proj, out_proj):
 		"""
@@ -262,48 +244,82 @@ def main(args=None):
 		AoI_point = transform(project, in_pt)
 		return AoI_point
 
+	def frame_columns(frame):
+		"""
+		Columns of a table, as given to series_io.write_series.
+		"""
+		return {str(name): frame[name].values for name in frame.columns}
+
+	def series_metadata(file_folder, args, **extra):
+		"""
+		Metadata kept with the Parquet and NPZ series: where they come from and their units.
+		"""
+		metadata = {'source': os.path.abspath(file_folder), 'crs': args.crs or DEFAULT_POINTS_CRS,
+			'units': {'precipitation': 'unit of the rasters'}}
+		metadata.update(extra)
+		return metadata
+
 	# first we need to convert the point to the coordinate system that we want.
 	# need to first check what the coordinate system of the area is
 
 
 
-	file_names_sorted = sort_file_list(file_names)
+	if time_to_slice is not None and args.points is None and (x_lon_to_slice is None or y_lat_to_slice is None):
+		# only one map: no need for the joint dataset, the catalog knows the file
+		map_file = catalog.at(time_to_slice, product, aoi)
+		catalog.close()
+		if map_file is None:
+			print(f'There is no file for {time_to_slice} in {file_folder}')
+			sys.exit(2)
+		date_string_name = time_to_slice.strftime('%Y%m%d-%H%M%S')
+		write_slice(read_map(map_file, time_to_slice), f'output_precipitation_raster_{date_string_name}',
+			output_format=output_format, compression=args.compression, complevel=args.complevel)
+		return
 
-	print(f'These are the files I am going to concatenate: {file_names}')
-	output_joint_file_name = 'joint_ds_with_all_times.nc'
+	# in order of time, from the catalog
+	rasters = catalog.between(start_time, end_time, product, aoi)
+	catalog.close()
+	print(f'These are the files I am going to concatenate: {len(rasters)} from {rasters[0][0]} to {rasters[-1][0]}' if rasters else 'There are no files to concatenate')
+	output_joint_file_name = stack_file_name('joint_ds_with_all_times', output_format)
 
 
-	joint_ds, date_list = concatenate_raster_files(file_names_sorted, output_joint_file_name)
+	cube, date_list = concatenate_raster_files([path for date, path in rasters], output_joint_file_name, [date for date, path in rasters])
 	print(f'I have concatenated all your files and created a time series')
 
-	print(f'This is the date list: {date_list}')
-
-	# need to make this better as this is not necessarily the closest point
-	time_selected = joint_ds.sel(time=time_to_slice)
-
 	# first we need to convert the point to the coordinate system that we want.
 	# need to first check what the coordinate system of the area is
+	raster_crs = cube.crs
+
+	if args.points is not None:
+		# all the points at once: one transformation and one read of the joint dataset
+		point_ids, point_x, point_y = read_points(args.points)
+		points_df = cube.points(point_ids, point_x, point_y, crs=coordinate or DEFAULT_POINTS_CRS, layout=args.points_layout)
+		write_series(f'precipitation_timeseries_points_{args.points_layout}{EXTENSIONS[args.series_format]}',
+			frame_columns(points_df.reset_index() if args.points_layout == 'wide' else points_df), series_metadata(file_folder, args))
+		print(f'extracted the time series of {len(point_ids)} points')
 
-	joint_ds = xr.open_dataset('joint_ds_with_all_times.nc', engine="rasterio")
-	raster_crs = joint_ds.rio.crs
+	if x_lon_to_slice is not None and y_lat_to_slice is not None:
+		converted_lat_lon = convert_crs_point(x_lon_to_slice, y_lat_to_slice, coordinate, raster_crs)
+		x_converted = round(converted_lat_lon.x, 2)
+		y_converted = round(converted_lat_lon.y,2)
 
-	converted_lat_lon = convert_crs_point(x_lon_to_slice, y_lat_to_slice, coordinate, raster_crs)
-	x_converted = round(converted_lat_lon.x, 2)
-	y_converted = round(converted_lat_lon.y,2)
 
+		timeseries=output_precipitation_timeseries(x_converted, y_converted, cube)
 
-	timeseries=output_precipitation_timeseries(x_converted, y_converted, output_joint_file_name)
+		timeseries_df = pd.DataFrame(timeseries, columns=['precipitation_mm/s'])
+		# need to add time datetime column
+		timeseries_df['date'] = cube.dates
+		timeseries_df = timeseries_df.set_index('date')
+		timeseries_df = timeseries_df.sort_values(by='date')
+		print(timeseries_df.head)
 
-	timeseries_df = pd.DataFrame(timeseries, columns=['precipitation_mm/s'])
-	# need to add time datetime column
-	timeseries_df['date'] = pd.to_datetime(date_list)
-	timeseries_df = timeseries_df.set_index('date')
-	timeseries_df = timeseries_df.sort_values(by='date')
-	print(timeseries_df.head)
+		write_series(f'precipitation_timeseries_point_lon_{x_lon_to_slice}_lat_{y_lat_to_slice}{EXTENSIONS[args.series_format]}',
+			frame_columns(timeseries_df.reset_index()), series_metadata(file_folder, args, lon=x_lon_to_slice, lat=y_lat_to_slice))
 
-	timeseries_df.to_csv(f'precipitation_timeseries_point_lon_{x_lon_to_slice}_lat_{y_lat_to_slice}.csv')
+	if time_to_slice is not None:
+		output_precipitation_raster(time_to_slice, cube)
 
-	output_precipitation_raster(time_to_slice, output_joint_file_name)
+	cube.close()
 
 #=============================================================================
 if __name__ =="__main__":
@@ -0,0 +1,187 @@
+"""
+processed_cache.py
+Shared cache of the processed granules, addressed by what they are made from.
+
+A processed granule depends only on its raw file, the area it is cropped to and
+the settings of the product, so its key is the sha256 of the checksum of the
+raw file, the digest of the settings (product, area, precision, catchments)
+and the version of the processing. Runs over overlapping date ranges, in any
+directory, get the processed files from the cache instead of making them
+again. The cache is kept under a size by removing the entries that were used
+the longest time ago.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import json
+import shutil
+import hashlib
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.download_manifest import file_checksum
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.gpm_precipitation_tools', 'processed')
+DEFAULT_MAX_SIZE = 10240  # MB
+# change it when image_process writes different files from the same granule
+PROCESSING_VERSION = 1
+
+
+def output_files(outfile):
+    """
+    Files of a processed granule: the raster, its ENVI header and the GDAL sidecar, by role.
+    """
+    return {'raster': outfile, 'hdr': os.path.splitext(outfile)[0] + '.hdr', 'aux.xml': outfile + '.aux.xml'}
+
+
+def place(source, target):
+    """
+    Copy a file in or out of the cache. Not a hard link: GDAL writes the
+    processed files in place, which would change the cached copy too.
+    """
+    if os.path.exists(target):
+        os.remove(target)
+    shutil.copy2(source, target)
+
+
+class ProcessedCache(object):
+    """
+    Processed granules cached on disk.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Where the processed granules are stored. Defaults to
+        $GPM_PROCESSED_CACHE or ~/.gpm_precipitation_tools/processed.
+    max_size : float
+        Size of the cache in MB, enforced by evict.
+    """
+
+    def __init__(self, cache_dir=None, max_size=DEFAULT_MAX_SIZE):
+        if cache_dir is None:
+            cache_dir = os.environ.get('GPM_PROCESSED_CACHE', DEFAULT_CACHE_DIR)
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+
+    def key(self, raw_file, settings):
+        """
+        Key of a raw granule processed with some settings.
+
+        Parameters
+        ----------
+        raw_file : str
+            Path to the raw granule.
+        settings : dict
+            Settings of the run that change the processed file (see
+            granule_pipeline.processing_settings).
+        """
+        content = {'raw': file_checksum(raw_file), 'settings': settings, 'version': PROCESSING_VERSION}
+        return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+    def entry(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def fetch(self, key, outfile):
+        """
+        Put the cached files of a key at outfile, all of them or none.
+
+        Returns
+        ----------
+        found : bool
+            False if the key is not in the cache, or was evicted by another
+            run while its files were copied.
+        """
+        entry = self.entry(key)
+        temporaries = {}
+        try:
+            for role, target in output_files(outfile).items():
+                source = os.path.join(entry, role)
+                if role == 'raster' or os.path.exists(source):
+                    temporaries[target] = target + f'.{os.getpid()}.tmp'
+                    shutil.copy2(source, temporaries[target])
+            # the time of last use, for the eviction. evict renames an entry
+            # before removing it, so an entry still there had all its files copied
+            os.utime(entry)
+        except FileNotFoundError:
+            for temporary in temporaries.values():
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+            return False
+        for target, temporary in temporaries.items():
+            os.replace(temporary, target)
+        return True
+
+    def store(self, key, outfile):
+        """
+        Add the files of a processed granule to the cache.
+        """
+        entry = self.entry(key)
+        if os.path.exists(entry) or not os.path.exists(outfile):
+            return
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        # filled next to the entry and renamed, so that an entry is always complete
+        temporary = entry + f'.{os.getpid()}.tmp'
+        os.makedirs(temporary, exist_ok=True)
+        for role, source in output_files(outfile).items():
+            if os.path.exists(source):
+                place(source, os.path.join(temporary, role))
+        try:
+            os.rename(temporary, entry)
+        except OSError:
+            # another run stored the same granule first
+            shutil.rmtree(temporary, ignore_errors=True)
+
+    def entries(self):
+        """
+        (time of last use, size in bytes, path) of every entry.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+        found = []
+        with os.scandir(self.cache_dir) as prefixes:
+            for prefix in prefixes:
+                if not prefix.is_dir():
+                    continue
+                with os.scandir(prefix.path) as entries:
+                    for entry in entries:
+                        if entry.is_dir() and not entry.name.endswith('.tmp'):
+                            size = sum(item.stat().st_size for item in os.scandir(entry.path))
+                            found.append((entry.stat().st_mtime, size, entry.path))
+        return found
+
+    def evict(self):
+        """
+        Remove the entries used the longest time ago until the cache fits in max_size.
+
+        Returns
+        ----------
+        removed : int
+            Number of entries removed.
+        """
+        entries = sorted(self.entries())
+        total = sum(size for used, size, path in entries)
+        removed = 0
+        for used, size, path in entries:
+            if total <= self.max_size * 1024 * 1024:
+                break
+            total -= size
+            # renamed first, so that a run fetching the entry gets all of its files or none
+            trash = path + f'.{os.getpid()}.tmp'
+            try:
+                os.rename(path, trash)
+            except OSError:
+                # removed by another run
+                continue
+            shutil.rmtree(trash, ignore_errors=True)
+            removed += 1
+        return removed
@@ -0,0 +1,312 @@
+"""
+rainfall_merge.py
+Merge rainfall series (observed, supplemental and forecast) into one, streaming.
+
+Every input series is read row by row and the series are merged on their
+dates with a k-way merge, so memory doesn't depend on their length. A row
+covers the time from its date to its date plus its duration, and where rows
+of several series overlap in time, the series that comes first in the
+priority order is kept: a row partly covered by a series with a higher
+priority (e.g. a 3-hourly forecast over a half-hourly base series) is cut to
+the time that isn't covered, with the same intensity. Series without a date
+column (like the forecasts of earlier versions) are placed right after the end
+of the series before them. Several forecasts (the members of an ensemble) are
+not merged together: each member gives its own output, merged with the other
+series. The series can also be Parquet or NPZ files (see series_io), which are
+read whole since they are compact, and the merged series is written a batch of
+rows at a time.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import csv
+import heapq
+import datetime
+import itertools
+
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+INTENSITY_COLUMNS = ['intensity_mm_sec', 'rainfall_mm_sec']
+KINDS = ['base', 'supp', 'forecast']
+DEFAULT_PRIORITY = ['base', 'supp', 'forecast']
+BATCH_ROWS = 65536
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def intensity_column(columns, path):
+    for column in INTENSITY_COLUMNS:
+        if column in columns:
+            return column
+    raise ValueError(f'{path} has no {" or ".join(INTENSITY_COLUMNS)} column')
+
+
+def is_csv(path):
+    return path.lower().endswith('.csv')
+
+
+def header(path):
+    if not is_csv(path):
+        from gpm_precipitation_tools.series_io import series_columns
+        return series_columns(path)
+    with open(path, newline='') as f:
+        return next(csv.reader(f), [])
+
+
+def series_end(path, start=None):
+    """
+    End of a series (date of its last row plus its duration), read as a stream.
+    """
+    last = None
+    for last in read_series(path, start):
+        pass
+    if last is None:
+        return None
+    return datetime.datetime.strptime(last[0], DATE_FORMAT) + datetime.timedelta(seconds=float(last[1]))
+
+
+def read_series(path, start=None):
+    """
+    Rows of a series as (date, duration_s, intensity_mm_sec), one at a time.
+
+    Parameters
+    ----------
+    path : str
+        CSV, Parquet or NPZ file with duration_s, intensity_mm_sec (or
+        rainfall_mm_sec) and optionally date columns.
+    start : datetime
+        Date of the first row of a series without a date column. The next
+        rows follow each other by their duration.
+    """
+    if not is_csv(path):
+        yield from series_rows(path, columnar_rows(path), start)
+        return
+    with open(path, newline='') as f:
+        yield from series_rows(path, csv.reader(f), start)
+
+
+def series_rows(path, reader, start):
+    columns = next(reader, None)
+    if columns is None:
+        return
+    duration = columns.index('duration_s')
+    intensity = columns.index(intensity_column(columns, path))
+    date = columns.index('date') if 'date' in columns else None
+    if date is None and start is None:
+        raise ValueError(f'{path} has no date column, it needs a series with dates before it')
+
+    previous = ''
+    for row in reader:
+        if not row:
+            continue
+        if date is not None:
+            when = row[date]
+        else:
+            when = start.strftime(DATE_FORMAT)
+            start += datetime.timedelta(seconds=float(row[duration]))
+        if when < previous:
+            raise ValueError(f'{path} is not in order of date ({when} after {previous})')
+        previous = when
+        yield when, row[duration], row[intensity]
+
+
+def columnar_rows(path):
+    """
+    Header and rows of a Parquet or NPZ series, as text like the rows of a CSV file.
+    """
+    from gpm_precipitation_tools.series_io import read_series as read_columns, date_strings
+    columns, metadata = read_columns(path)
+    yield list(columns)
+    values = [date_strings(values) if name == 'date' else [repr(value) for value in values.tolist()]
+              for name, values in columns.items()]
+    for row in zip(*values):
+        yield list(row)
+
+
+def seconds(when):
+    return (datetime.datetime.strptime(when, DATE_FORMAT) - EPOCH).total_seconds()
+
+
+def date_text(time):
+    return (EPOCH + datetime.timedelta(seconds=time)).strftime(DATE_FORMAT)
+
+
+def duration_text(duration):
+    return str(int(duration)) if duration == int(duration) else repr(duration)
+
+
+def keyed_rows(rows, key, kind):
+    for when, duration, value in rows:
+        start = seconds(when)
+        yield start, key, start + float(duration), when, duration, value, kind
+
+
+def merge_series(inputs, output_file, priority=DEFAULT_PRIORITY):
+    """
+    Merge rainfall series on their dates and write the result.
+
+    Parameters
+    ----------
+    inputs : list of (str, str)
+        (kind, path) of the series, kind being base, supp or forecast. Series
+        without dates are placed after the end of the series before them in
+        this list (the first series without dates, if none has any, starts on
+        1970-01-01 and the output is then a plain concatenation).
+    output_file : str
+        File of the merged series: CSV, written as it goes, or Parquet or NPZ.
+    priority : list of str
+        Order of the kinds when series overlap: the first kind wins. Within a
+        kind, the series given first wins.
+
+    Returns
+    ----------
+    counts : dict
+        Number of rows written from each kind, of rows dropped because they
+        were covered entirely and of rows cut because they were covered in part.
+    """
+    for kind, path in inputs:
+        if kind not in KINDS:
+            raise ValueError(f'Unknown kind of series {kind}, use one of {KINDS}')
+    check_priority(priority)
+    rank = {kind: n for n, kind in enumerate(list(priority) + [kind for kind in KINDS if kind not in priority])}
+
+    streams = []
+    end = EPOCH
+    # the series whose end isn't known yet: only read when a series without dates follows them
+    unread = []
+    for order, (kind, path) in enumerate(inputs):
+        has_dates = 'date' in header(path)
+        if not has_dates:
+            # the last of them that has rows
+            end = next((found for found in (series_end(*series) for series in reversed(unread)) if found is not None), end)
+            unread = []
+        start = None if has_dates else end
+        key = (rank[kind], order)
+        streams.append(keyed_rows(read_series(path, start), key, kind))
+        unread.append((path, start))
+
+    counts = {kind: 0 for kind in KINDS}
+    counts['dropped'] = counts['cut'] = 0
+    from gpm_precipitation_tools.series_io import SeriesWriter
+    rows = kept_rows(streams, counts)
+    with SeriesWriter(output_file, ['duration_s', 'intensity_mm_sec', 'date', 'source'],
+                      {'sources': [path for kind, path in inputs], 'priority': list(priority),
+                       'units': {'duration_s': 's', 'intensity_mm_sec': 'mm/s'}}) as writer:
+        for batch in iter(lambda: list(itertools.islice(rows, BATCH_ROWS)), []):
+            writer.write(batch)
+    return counts
+
+
+def check_priority(priority):
+    """
+    Refuse a priority order with kinds of series that don't exist (e.g. a typo in --priority).
+    """
+    unknown = [kind for kind in priority if kind not in KINDS]
+    if unknown:
+        raise ValueError(f'Unknown kind of series {", ".join(unknown)} in the priority, use {KINDS}')
+
+
+def member_path(output_file, number):
+    """
+    Output of the nth member of an ensemble (from 1): <name>_member<NN>.<extension>.
+    """
+    stem, extension = os.path.splitext(output_file)
+    return f'{stem}_member{number:02d}{extension}'
+
+
+def merge_members(inputs, output_file, priority=DEFAULT_PRIORITY):
+    """
+    Merge rainfall series, with one output per forecast when there are several.
+
+    The forecasts are the members of an ensemble: they are not merged with
+    each other, each one is merged with the base and supplemental series
+    into its own output (see member_path). With one forecast or none, this is
+    merge_series.
+
+    Parameters
+    ----------
+    inputs, output_file, priority
+        See merge_series.
+
+    Returns
+    ----------
+    counts : dict
+        Counts of merge_series by output file.
+    """
+    forecasts = [n for n, (kind, path) in enumerate(inputs) if kind == 'forecast']
+    if len(forecasts) <= 1:
+        return {output_file: merge_series(inputs, output_file, priority)}
+    counts = {}
+    for number, member in enumerate(forecasts, 1):
+        # the other members are left out, the series keep their order
+        member_inputs = [series for n, series in enumerate(inputs) if n == member or n not in forecasts]
+        path = member_path(output_file, number)
+        counts[path] = merge_series(member_inputs, path, priority)
+    return counts
+
+
+def kept_rows(streams, counts):
+    """
+    Rows of the merged series, as (duration_s, intensity_mm_sec, date, source).
+
+    A sweep over the start and end times of the rows: between two of them, the
+    row with the highest priority among the rows covering that time is kept.
+    Only the rows covering the current time are held, one per series at most,
+    and only their numbers are remembered.
+    """
+    # numbered in order of start, then of priority
+    rows = enumerate(heapq.merge(*streams))
+    following = next(rows, None)
+    active = []
+    piece = None  # [(number, row), start, end] of the part of a row being written
+    written, cut = set(), set()
+    time = None
+
+    def write(piece):
+        (number, row), start, end = piece
+        row_start, key, row_end, when, duration, value, kind = row
+        counts[kind] += 1
+        if start == row_start and end == row_end:
+            return duration, value, when, kind
+        if number not in cut:
+            cut.add(number)
+            counts['cut'] += 1
+        if not any(item[0] == number for item in active):
+            # no other piece of the row can follow
+            cut.discard(number)
+        return duration_text(end - start), value, date_text(start), kind
+
+    while following is not None or active:
+        if not active:
+            # nothing covers this time: go to the next row
+            time = following[1][0]
+        while following is not None and following[1][0] <= time:
+            active.append(following)
+            following = next(rows, None)
+        for ended in [item for item in active if item[1][2] <= time]:
+            active.remove(ended)
+            if ended[0] not in written:
+                counts['dropped'] += 1
+            written.discard(ended[0])
+            if piece is None or piece[0] is not ended:
+                cut.discard(ended[0])
+        if not active:
+            continue
+        winner = min(active, key=lambda item: item[1][1])
+        boundary = min(item[1][2] for item in active)
+        if following is not None:
+            boundary = min(boundary, following[1][0])
+        if piece is not None and piece[0] is winner and piece[2] == time:
+            piece[2] = boundary
+        else:
+            if piece is not None:
+                yield write(piece)
+            piece = [winner, time, boundary]
+            written.add(winner[0])
+        time = boundary
+    if piece is not None:
+        yield write(piece)
@@ -0,0 +1,206 @@
+"""
+raster_catalog.py
+SQLite catalog of the processed rasters: which file holds which timestep.
+
+The catalog is built once for a folder and then only updated with the files
+that were added, changed or removed since, so the names of a large archive
+are not parsed again on every run. A timestep or a range of time is then one
+indexed query, and only the files it returns need to be opened.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import re
+import sqlite3
+import datetime
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.timeseries_state import TimeseriesState
+
+
+CATALOG_NAME = 'raster_catalog.sqlite'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+# the product of the files that still have the name of their granule
+PRODUCT_PREFIXES = {'3B-HHR': 'GPM_30min', '3B-DAY': 'GPM_D', '3B-MO': 'GPM_M'}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rasters (
+    path TEXT PRIMARY KEY,
+    time TEXT NOT NULL,
+    product TEXT,
+    aoi TEXT,
+    size INTEGER,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS rasters_time ON rasters (product, aoi, time);
+"""
+
+
+def raster_time(file_name):
+    """
+    Start of the timestep of a raster, from the YYYYMMDD-SHHMMSS part of its name, or None.
+    """
+    found = re.search(r'(\d{8})-S(\d{6})', file_name)
+    if found is None:
+        return None
+    return datetime.datetime.strptime(found.group(1) + found.group(2), '%Y%m%d%H%M%S')
+
+
+def raster_product(file_name):
+    for prefix, product in PRODUCT_PREFIXES.items():
+        if file_name.startswith(prefix):
+            return product
+    return None
+
+
+def folder_settings(directory, product=None, aoi=None):
+    """
+    Product and area of interest of the rasters of a folder.
+
+    The cropped files (Calib_rainfall_*) don't have the product in their name:
+    what isn't given comes from the TimeseriesState that maps_to_timeseries
+    keeps in the folder, or stays None if there is none.
+
+    Returns
+    ----------
+    product, aoi : str
+        Product (GPM_M, GPM_D or GPM_30min) and digest of the --SptSlc shapefile, or None.
+    """
+    if product is None or aoi is None:
+        state = TimeseriesState(directory)
+        product = product if product is not None else state.product
+        aoi = aoi if aoi is not None else state.aoi
+    return product, aoi
+
+
+class RasterCatalog(object):
+    """
+    Catalog of the rasters of one or more folders.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file of the catalog, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def update(self, directory, aoi=None, product=None, extension='.bil'):
+        """
+        Bring the catalog of a folder up to date.
+
+        Only the rasters that are new or whose size or modification time
+        changed are parsed. Rasters that are gone are removed.
+
+        Parameters
+        ----------
+        directory : str
+            Folder of the rasters.
+        aoi : str
+            Name of the area of interest of the rasters, to tell runs apart.
+        product : str
+            Product of the rasters whose name doesn't tell it.
+            Both default to the settings of the folder, see folder_settings.
+        extension : str
+            Extension of the rasters.
+
+        Returns
+        ----------
+        added, removed : int
+            Number of rasters added (or changed) and removed.
+        """
+        directory = os.path.abspath(directory)
+        product, aoi = folder_settings(directory, product, aoi)
+        known = self.entries(directory)
+
+        rows, seen = [], set()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith(extension) or not entry.is_file():
+                    continue
+                seen.add(entry.path)
+                stat = entry.stat()
+                # the product in the name wins over the one of the folder
+                entry_product = raster_product(entry.name) or product
+                if known.get(entry.path) == (stat.st_size, stat.st_mtime, entry_product, aoi):
+                    continue
+                timer = raster_time(entry.name)
+                if timer is None:
+                    continue
+                rows.append((entry.path, timer.strftime(DATE_FORMAT), entry_product, aoi, stat.st_size, stat.st_mtime))
+
+        # only the files of this folder, not of its subfolders
+        removed = [(path,) for path in known if path not in seen and os.path.dirname(path) == directory]
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO rasters VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self.connection.executemany('DELETE FROM rasters WHERE path = ?', removed)
+        return len(rows), len(removed)
+
+    def entries(self, directory):
+        """
+        (size, mtime, product, aoi) of the rasters cataloged under a folder (subfolders included), by path.
+        """
+        # a range of paths rather than LIKE, whose wildcards (_ and %) can be in the names of folders
+        prefix = os.path.join(os.path.abspath(directory), '')
+        after = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return {path: (size, mtime, product, aoi) for path, size, mtime, product, aoi in self.connection.execute(
+            'SELECT path, size, mtime, product, aoi FROM rasters WHERE path >= ? AND path < ?', (prefix, after))}
+
+    def _where(self, product, aoi):
+        clauses, values = [], []
+        if product is not None:
+            clauses.append('product = ?'); values.append(product)
+        if aoi is not None:
+            clauses.append('aoi = ?'); values.append(aoi)
+        return ''.join(' AND ' + clause for clause in clauses), values
+
+    def at(self, time, product=None, aoi=None):
+        """
+        Path of the raster of a timestep, or None.
+
+        Raises a ValueError if several rasters (of other products or areas) match.
+        """
+        where, values = self._where(product, aoi)
+        rows = self.connection.execute('SELECT path FROM rasters WHERE time = ?' + where + ' LIMIT 2',
+                                       [time.strftime(DATE_FORMAT)] + values).fetchall()
+        if len(rows) > 1:
+            raise ValueError(f'Several rasters for {time}, e.g. {rows[0][0]} and {rows[1][0]}: give the product and area')
+        return None if not rows else rows[0][0]
+
+    def between(self, start=None, end=None, product=None, aoi=None):
+        """
+        Rasters of a range of time (both ends included), in order of time.
+
+        Returns
+        ----------
+        rasters : list of (datetime, str)
+            Date and path of each raster.
+        """
+        where, values = self._where(product, aoi)
+        query = 'SELECT time, path FROM rasters WHERE time >= ? AND time <= ?' + where + ' ORDER BY time, path'
+        start = start.strftime(DATE_FORMAT) if start is not None else ''
+        end = end.strftime(DATE_FORMAT) if end is not None else '9999'
+        return [(datetime.datetime.strptime(time, DATE_FORMAT), path)
+                for time, path in self.connection.execute(query, [start, end] + values)]
@@ -0,0 +1,327 @@
+"""
+raster_stack.py
+Stack the processed rasters of a run into one netCDF file, a few timesteps at a time.
+
+Instead of opening every raster, keeping them all in a list and concatenating
+them in memory, the stack is written in blocks of timesteps: xarray writes the
+first block (and with it the coordinates and the coordinate system), and the
+next blocks are appended along the time dimension straight from the memory
+mapped .bil files. Only one block is ever in memory, and its size comes from a
+memory budget.
+
+The stack is a chunked and compressed netCDF4 (HDF5) file or a Zarr store.
+Rainfall maps are mostly zeros, so shuffle + deflate/zstd shrinks them a lot,
+and the chunks decide what is cheap to read: whole maps ('map') or the series
+of a point ('series').
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import datetime
+import numpy
+import xarray as xr
+import rioxarray
+import netCDF4
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools import envi_io
+
+
+DEFAULT_MEMORY_BUDGET = 1024  # MB
+OUTPUT_FORMATS = ['netcdf4', 'zarr', 'netcdf3']
+NETCDF_FORMATS = {'netcdf4': 'NETCDF4', 'netcdf3': 'NETCDF3_64BIT'}
+DEFAULT_OUTPUT_FORMAT = 'netcdf4'
+COMPRESSIONS = ['zlib', 'zstd', 'none']
+DEFAULT_COMPRESSION = 'zlib'
+DEFAULT_COMPLEVEL = 4
+# (time, y, x) chunks, None for the whole dimension
+CHUNK_PRESETS = {
+    'map': (1, None, None),     # a whole map per chunk
+    'series': (1024, 32, 32),   # ~3 weeks of half hours over 3.2 x 3.2 degree tiles
+}
+DEFAULT_CHUNKS = 'series'
+TIME_UNITS = 'seconds since 1970-01-01 00:00:00'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def time_chunk(n_rows, n_cols, dtype, memory_budget=DEFAULT_MEMORY_BUDGET):
+    """
+    Number of timesteps of a block that fits in the memory budget.
+
+    Parameters
+    ----------
+    n_rows, n_cols : int
+        Size of the rasters.
+    dtype : numpy dtype
+        Precision of the stack.
+    memory_budget : float
+        Memory allowed for a block, in MB.
+
+    Returns
+    ----------
+    chunk : int
+        Timesteps per block, at least 1.
+    """
+    step = n_rows * n_cols * numpy.dtype(dtype).itemsize
+    return max(1, int(memory_budget * 1024 * 1024) // step)
+
+
+def block_layout(n_time, n_rows, n_cols, dtype, memory_budget=DEFAULT_MEMORY_BUDGET,
+                 output_format=DEFAULT_OUTPUT_FORMAT, chunks=DEFAULT_CHUNKS):
+    """
+    Timesteps written at a time and storage chunks of a stack.
+
+    The storage chunks are never longer in time than a block that fits in the
+    memory budget, and a block is made of whole storage chunks, so that no
+    chunk is written twice.
+
+    Returns
+    ----------
+    chunk : int
+        Timesteps per block, at least 1.
+    storage : (int, int, int, int)
+        Storage chunks (time, band, y, x), None for netcdf3.
+    """
+    chunk = time_chunk(n_rows, n_cols, dtype, memory_budget)
+    if output_format == 'netcdf3':
+        return chunk, None
+    storage = chunk_shape(chunks, n_time, n_rows, n_cols)
+    storage = (min(storage[0], chunk),) + storage[1:]
+    return chunk // storage[0] * storage[0], storage
+
+
+def read_block(file_names, header, dtype):
+    """
+    Read a block of rasters into a (time, band, y, x) array.
+    """
+    block = numpy.empty((len(file_names), 1, header['lines'], header['samples']), dtype=dtype)
+    for i, file_name in enumerate(file_names):
+        block[i, 0] = envi_io.read_band(file_name, header)
+    return block
+
+
+def template(file_name):
+    """
+    Coordinates and coordinate system of the stack, from its first raster.
+    """
+    with xr.open_dataset(file_name, engine="rasterio") as xds:
+        return xds.drop_vars('band').rename({'band_data': 'precipitation'}).load()
+
+
+def chunk_shape(chunks, n_time, n_rows, n_cols):
+    """
+    Storage chunks (time, band, y, x) of the stack from a preset or a "time,y,x" string.
+
+    Parameters
+    ----------
+    chunks : str
+        'map' (one timestep per chunk, for reading whole maps), 'series' (long
+        time chunks over small tiles, for reading the series of a point) or
+        sizes like '48,64,64'.
+    n_time, n_rows, n_cols : int
+        Size of the stack, the chunks are clipped to it.
+
+    Returns
+    ----------
+    shape : (int, int, int, int)
+        Chunk sizes along time, band, y and x.
+    """
+    if chunks in CHUNK_PRESETS:
+        sizes = CHUNK_PRESETS[chunks]
+    else:
+        try:
+            sizes = [int(size) for size in chunks.split(',')]
+        except ValueError:
+            sizes = []
+        if len(sizes) != 3 or min(sizes) < 1:
+            raise ValueError(f'Unknown chunks {chunks}, use {list(CHUNK_PRESETS)} or time,y,x sizes')
+    t, y, x = [full if size is None else min(size, full) for size, full in zip(sizes, (n_time, n_rows, n_cols))]
+    return max(1, t), 1, max(1, y), max(1, x)
+
+
+def storage_encoding(output_format, dtype, chunks=None, compression=DEFAULT_COMPRESSION, complevel=DEFAULT_COMPLEVEL):
+    """
+    xarray encoding of the precipitation for an output format.
+
+    Parameters
+    ----------
+    output_format : str
+        'netcdf4', 'zarr' or 'netcdf3' (no chunks or compression).
+    dtype : numpy dtype
+        Precision of the precipitation in the file.
+    chunks : tuple of int
+        Storage chunks of the variable, from chunk_shape.
+    compression : str
+        'zlib' (deflate), 'zstd' or 'none'. The bytes are shuffled before.
+    complevel : int
+        Compression level.
+
+    Returns
+    ----------
+    encoding : dict
+        Encoding of the precipitation variable.
+    """
+    if compression not in COMPRESSIONS:
+        raise ValueError(f'Unknown compression {compression}, use one of {COMPRESSIONS}')
+    encoding = {'dtype': dtype}
+    if output_format == 'netcdf3':
+        return encoding
+
+    if output_format == 'netcdf4':
+        if chunks is not None:
+            encoding['chunksizes'] = chunks
+        if compression == 'zlib':
+            encoding.update({'zlib': True, 'complevel': complevel, 'shuffle': True})
+        elif compression == 'zstd':
+            # needs netCDF4 and the netCDF-C library built with zstd
+            encoding.update({'compression': 'zstd', 'complevel': complevel, 'shuffle': True})
+        return encoding
+
+    if output_format == 'zarr':
+        from numcodecs import Blosc
+        if chunks is not None:
+            encoding['chunks'] = chunks
+        encoding['compressor'] = None if compression == 'none' else Blosc(cname=compression, clevel=complevel, shuffle=Blosc.SHUFFLE)
+        return encoding
+
+    raise ValueError(f'Unknown output format {output_format}, use one of {OUTPUT_FORMATS}')
+
+
+def with_grid_mapping(encoding, dataarray):
+    """
+    Storage encoding of a variable that keeps the link to its coordinate system.
+
+    An explicit encoding replaces the one of the variable, where rioxarray
+    keeps grid_mapping (the name of the spatial_ref variable with the CRS).
+    Without it the file has no coordinate system.
+    """
+    grid_mapping = dataarray.encoding.get('grid_mapping', dataarray.attrs.get('grid_mapping'))
+    if grid_mapping is None:
+        return encoding
+    return dict(encoding, grid_mapping=grid_mapping)
+
+
+def read_map(file_name, date):
+    """
+    Map of one processed raster, like a time slice of the stack, without building the stack.
+    """
+    precipitation = template(file_name)['precipitation'].assign_coords(time=date)
+    precipitation.attrs = {'description': 'precipitation amount in mm/s'}
+    return precipitation
+
+
+def stack_file_name(stem, output_format):
+    """
+    Name of an output of the pipeline: .zarr store or .nc file.
+    """
+    return stem + ('.zarr' if output_format == 'zarr' else '.nc')
+
+
+def open_stack(path):
+    """
+    Open a stack written by write_stack, lazily.
+
+    The netCDF files are opened with the netCDF4 library (not rasterio), which
+    keeps their storage chunks in the encoding for point_extraction.read_pixels.
+    """
+    if path.endswith('.zarr'):
+        return xr.open_zarr(path, decode_coords='all')
+    return xr.open_dataset(path, engine='netcdf4', decode_coords='all')
+
+
+def write_slice(dataarray, stem, output_format=DEFAULT_OUTPUT_FORMAT, compression=DEFAULT_COMPRESSION, complevel=DEFAULT_COMPLEVEL):
+    """
+    Write one map of the stack in the output format.
+
+    Returns
+    ----------
+    path : str
+        Name of the file (or store) written.
+    """
+    path = stack_file_name(stem, output_format)
+    name = dataarray.name or 'precipitation'
+    shape = (1,) * (dataarray.ndim - 2) + dataarray.shape[-2:]
+    encoding = {name: with_grid_mapping(storage_encoding(output_format, dataarray.dtype, shape, compression, complevel), dataarray)}
+    if output_format == 'zarr':
+        dataarray.to_dataset(name=name).to_zarr(path, mode='w', encoding=encoding)
+    else:
+        dataarray.to_dataset(name=name).to_netcdf(path, mode='w', format=NETCDF_FORMATS[output_format], encoding=encoding)
+    return path
+
+
+def write_stack(file_names, dates, output_file, dtype, memory_budget=DEFAULT_MEMORY_BUDGET,
+                output_format=DEFAULT_OUTPUT_FORMAT, chunks=DEFAULT_CHUNKS,
+                compression=DEFAULT_COMPRESSION, complevel=DEFAULT_COMPLEVEL):
+    """
+    Write the rasters of a run as one netCDF file (or Zarr store) with a time dimension.
+
+    Parameters
+    ----------
+    file_names : list of str
+        Processed .bil rasters, in order of time. They must all have the same grid.
+    dates : list of datetime
+        Date of each raster.
+    output_file : str
+        Name of the netCDF file or Zarr store.
+    dtype : numpy dtype
+        Precision of the precipitation in the file.
+    memory_budget : float
+        Memory allowed for a block of timesteps, in MB.
+    output_format : str
+        'netcdf4' (HDF5, chunked and compressed), 'zarr' or 'netcdf3' (as before, uncompressed).
+    chunks : str
+        Storage chunks: 'map', 'series' or 'time,y,x' sizes, see chunk_shape.
+    compression : str
+        'zlib', 'zstd' or 'none'.
+    complevel : int
+        Compression level.
+
+    Returns
+    ----------
+    chunk : int
+        Number of timesteps written at a time.
+    """
+    header = envi_io.read_header(envi_io.header_path(file_names[0]))
+    chunk, storage = block_layout(len(file_names), header['lines'], header['samples'], dtype,
+                                  memory_budget, output_format, chunks)
+    # The first block is written by xarray, with the coordinates of the first raster
+    grid = template(file_names[0])
+    encoding = {'precipitation': with_grid_mapping(storage_encoding(output_format, dtype, storage, compression, complevel), grid['precipitation']),
+                'time': {'units': TIME_UNITS, 'calendar': 'proleptic_gregorian', 'dtype': 'float64'}}
+
+    def block_dataset(start):
+        names = file_names[start:start + chunk]
+        block = grid.expand_dims(time=list(dates[start:start + len(names)]))
+        block['precipitation'] = block['precipitation'].copy(data=read_block(names, header, dtype))
+        block['precipitation'].attrs = {'description': 'precipitation amount in mm/s'}
+        return block
+
+    if output_format == 'zarr':
+        block_dataset(0).to_zarr(output_file, mode='w', encoding=encoding)
+        for start in range(chunk, len(file_names), chunk):
+            # only the new timesteps, the coordinates are already in the store
+            block_dataset(start).drop_vars(['x', 'y', 'spatial_ref'], errors='ignore').to_zarr(output_file, append_dim='time')
+            print(f'stacked {min(start + chunk, len(file_names))} of {len(file_names)} files')
+        return chunk
+
+    block_dataset(0).to_netcdf(output_file, mode='w', format=NETCDF_FORMATS[output_format],
+                               unlimited_dims=['time'], encoding=encoding)
+
+    # The rest is appended along time, one block at a time
+    with netCDF4.Dataset(output_file, 'a') as stack:
+        for start in range(chunk, len(file_names), chunk):
+            names = file_names[start:start + chunk]
+            end = start + len(names)
+            stack.variables['time'][start:end] = [(date - EPOCH).total_seconds() for date in dates[start:end]]
+            stack.variables['precipitation'][start:end] = read_block(names, header, dtype)
+            print(f'stacked {end} of {len(file_names)} files')
+    return chunk
@@ -0,0 +1,251 @@
+"""
+resample.py
+Aggregate the half-hourly rasters of a run to coarser time steps in one pass.
+
+The rasters are read in order of time and added to running grids (sum, max and
+number of timesteps) of the current window. When a raster falls in the next
+window, the grids of the finished one are written out and reset, so memory
+holds a few grids whatever the length of the period. Hourly, 3-hourly, daily
+or monthly rainfall then comes from the half-hourly product already on disk
+instead of from separate downloads.
+
+The half-hourly rasters are rates (mm/hr, the precipitationCal of IMERG), so
+the sum of a window is the depth of rain over it: every raster counts for its
+timestep (0.5 h) of rain.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import re
+import sys
+import csv
+import argparse
+import datetime
+import numpy
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools import envi_io
+from gpm_precipitation_tools.raster_catalog import RasterCatalog, CATALOG_NAME
+from gpm_precipitation_tools import series_io
+
+
+STATISTICS = ['sum', 'mean', 'max']
+DEFAULT_STEP_HOURS = 0.5
+FREQUENCY = re.compile(r'^(\d*)(MIN|H|D|M)$')
+
+
+def parse_frequency(freq):
+    """
+    Split a frequency like '3H', 'D', '90MIN' or 'M' into its number and unit.
+    """
+    found = FREQUENCY.match(freq.upper())
+    if found is None:
+        raise ValueError(f'Unknown frequency {freq}, use e.g. 1H, 3H, 1D or 1M')
+    number = int(found.group(1) or 1)
+    if number < 1:
+        raise ValueError(f'Unknown frequency {freq}')
+    return number, found.group(2)
+
+
+def window_start(date, freq):
+    """
+    Start of the window of a frequency that a date falls in.
+
+    Windows of minutes and hours start at midnight, windows of days at
+    1970-01-01 and windows of months in January.
+    """
+    number, unit = parse_frequency(freq)
+    if unit == 'M':
+        months = (date.year * 12 + date.month - 1) // number * number
+        return datetime.datetime(months // 12, months % 12 + 1, 1)
+    if unit == 'D':
+        days = (date - datetime.datetime(1970, 1, 1)).days // number * number
+        return datetime.datetime(1970, 1, 1) + datetime.timedelta(days=days)
+    midnight = datetime.datetime(date.year, date.month, date.day)
+    minutes = number * (60 if unit == 'H' else 1)
+    elapsed = int((date - midnight).total_seconds() // 60)
+    return midnight + datetime.timedelta(minutes=elapsed // minutes * minutes)
+
+
+def window_end(start, freq):
+    """
+    End (excluded) of the window that starts at start.
+    """
+    number, unit = parse_frequency(freq)
+    if unit == 'M':
+        months = start.year * 12 + start.month - 1 + number
+        return datetime.datetime(months // 12, months % 12 + 1, 1)
+    if unit == 'D':
+        return start + datetime.timedelta(days=number)
+    return start + datetime.timedelta(minutes=number * (60 if unit == 'H' else 1))
+
+
+class WindowAccumulator(object):
+    """
+    Running grids of one window: sum, max and number of timesteps.
+    """
+
+    def __init__(self, start, shape):
+        self.start = start
+        self.sum = numpy.zeros(shape, dtype=numpy.float64)
+        self.max = numpy.full(shape, -numpy.inf, dtype=numpy.float64)
+        self.count = 0
+
+    def add(self, band):
+        self.sum += band
+        numpy.maximum(self.max, band, out=self.max)
+        self.count += 1
+
+    def grids(self, step_hours=DEFAULT_STEP_HOURS):
+        """
+        Results of the window.
+
+        Returns
+        ----------
+        grids : dict of 2-D numpy arrays
+            sum: depth of rain (mm), mean: mean rate (mm/hr), max: highest rate (mm/hr).
+        """
+        return {'sum': self.sum * step_hours, 'mean': self.sum / self.count, 'max': self.max}
+
+
+def resample(rasters, freq, output_dir, statistics=STATISTICS, step_hours=DEFAULT_STEP_HOURS, write_rasters=True,
+             weights=None, scaled=True):
+    """
+    Aggregate rasters to a coarser time step, reading each raster once.
+
+    Parameters
+    ----------
+    rasters : list of (datetime, str)
+        Date and path of the rasters, in order of time (e.g. RasterCatalog.between).
+    freq : str
+        Time step of the output: e.g. '1H', '3H', '1D', '1M'.
+    output_dir : str
+        Folder of the output rasters.
+    statistics : list of str
+        Grids to write for each window, among sum, mean and max.
+    step_hours : float
+        Timestep of the input rasters, in hours.
+    write_rasters : bool
+        Write a raster per window and statistic, or only compute the series.
+    weights : 2-D numpy array
+        Fraction of each pixel inside the area the rasters were cropped with
+        (cutline_mask.area_weights): the area means only count the pixels
+        inside. Every pixel counts if None.
+    scaled : bool
+        The rasters were multiplied by the weights when they were cropped
+        (a single area, not catchments).
+
+    Returns
+    ----------
+    series : list of dict
+        One row per window: start, number of timesteps, whether the window
+        is complete, and the area mean of each statistic.
+    """
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise ValueError(f'Unknown statistic {statistic}, use some of {STATISTICS}')
+    os.makedirs(output_dir, exist_ok=True)
+    series = []
+    window = None
+    header = hdr_file = None
+
+    def emit(window):
+        grids = window.grids(step_hours)
+        expected = int(round((window_end(window.start, freq) - window.start).total_seconds() / 3600. / step_hours))
+        row = {'start': window.start.strftime('%Y-%m-%d %H:%M:%S'), 'timesteps': window.count,
+               'complete': window.count == expected}
+        for statistic in statistics:
+            row[statistic] = envi_io.zonal_statistics(grids[statistic], (), weights=weights, scaled=scaled)['mean']
+            if write_rasters:
+                name = 'Calib_rainfall_' + window.start.strftime('%Y%m%d-S%H%M%S') + f'-{freq}_{statistic}.bil'
+                envi_io.write_band(os.path.join(output_dir, name), grids[statistic], hdr_file)
+        series.append(row)
+
+    for date, path in rasters:
+        if header is None:
+            hdr_file = envi_io.header_path(path)
+            header = envi_io.read_header(hdr_file)
+        start = window_start(date, freq)
+        if window is not None and start != window.start:
+            if start < window.start:
+                raise ValueError(f'{path} is older than the rasters before it, give the rasters in order of time')
+            emit(window)
+            window = None
+        if window is None:
+            window = WindowAccumulator(start, (header['lines'], header['samples']))
+        window.add(envi_io.read_band(path, header))
+
+    if window is not None:
+        emit(window)
+    return series
+
+
+def write_series(series, csv_file, statistics=STATISTICS, metadata=None):
+    """
+    Write the series of resample as a CSV file, or as Parquet or NPZ (see series_io) from the extension.
+    """
+    if not csv_file.lower().endswith('.csv'):
+        columns = {'start': [row['start'] for row in series], 'timesteps': [row['timesteps'] for row in series],
+                   'complete': [float(row['complete']) for row in series]}
+        columns.update({statistic: [row[statistic] for row in series] for statistic in statistics})
+        series_io.write_series(csv_file, columns, metadata)
+        return
+    with open(csv_file, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['start', 'timesteps', 'complete'] + list(statistics))
+        for row in series:
+            writer.writerow([row['start'], row['timesteps'], row['complete']] + [row[statistic] for statistic in statistics])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='resample_rainfall',
+                                     description='Aggregate the half-hourly rasters of a folder to a coarser time step.')
+    parser.add_argument('--file_folder', dest='file_folder', required=True, help='Folder with the half-hourly .bil files')
+    parser.add_argument('--freq', dest='freq', default='1D', help='Time step of the output: e.g. 1H, 3H, 1D (default) or 1M')
+    parser.add_argument('--statistics', dest='statistics', default='sum', help='Comma separated statistics: sum (mm), mean (mm/hr), max (mm/hr)')
+    parser.add_argument('--SptSlc', dest='SptSlc', default=None, help='Shapefile the rasters were processed with, for the area means')
+    parser.add_argument('--SptID', dest='SptID', default=None, help='Field of the --SptSlc features with their catchment ID')
+    parser.add_argument('--Fractional', dest='Fractional', action='store_true', help='The rasters were processed with --Fractional')
+    parser.add_argument('--output_dir', dest='output_dir', default=None, help='Folder of the output (default: resampled_<freq> in the file folder)')
+    parser.add_argument('--start_time', dest='start_time', help='Only use the files from this date time (format %%Y-%%m-%%d:%%H%%M%%S)')
+    parser.add_argument('--end_time', dest='end_time', help='Only use the files until this date time (format %%Y-%%m-%%d:%%H%%M%%S)')
+    parser.add_argument('--series_only', dest='series_only', action='store_true', help='Only write the series, not the rasters')
+    parser.add_argument('--series_format', dest='series_format', choices=series_io.SERIES_FORMATS, default=series_io.DEFAULT_SERIES_FORMAT, type=series_io.format_argument, help='Format of the series: csv (default), parquet or npz')
+    args = parser.parse_args(args)
+
+    statistics = [statistic.strip() for statistic in args.statistics.split(',')]
+    start_time = datetime.datetime.strptime(args.start_time, '%Y-%m-%d:%H%M%S') if args.start_time else None
+    end_time = datetime.datetime.strptime(args.end_time, '%Y-%m-%d:%H%M%S') if args.end_time else None
+    output_dir = args.output_dir or os.path.join(args.file_folder, 'resampled_' + args.freq)
+
+    with RasterCatalog(os.path.join(args.file_folder, CATALOG_NAME)) as catalog:
+        catalog.update(args.file_folder)
+        rasters = catalog.between(start_time, end_time, product=None)
+
+    weights = None
+    if args.SptSlc is not None and rasters:
+        from gpm_precipitation_tools.cutline_mask import area_weights
+        x_pixels, y_pixels, window = envi_io.global_window(envi_io.read_header(envi_io.header_path(rasters[0][1])))
+        weights = area_weights(args.SptSlc, x_pixels, y_pixels, window, args.Fractional, args.SptID)
+
+    series = resample(rasters, args.freq, output_dir, statistics, write_rasters=not args.series_only,
+                      weights=weights, scaled=args.SptID is None)
+    write_series(series, os.path.join(output_dir, f'rainfall_{args.freq}' + series_io.EXTENSIONS[args.series_format]), statistics,
+                 {'freq': args.freq, 'source': os.path.abspath(args.file_folder),
+                  'units': {'sum': 'mm', 'mean': 'mm/hr', 'max': 'mm/hr'}})
+    print(f'{len(series)} windows of {args.freq} from {len(rasters)} files')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,235 @@
+"""
+rolling_accumulation.py
+Maximum N-hour rainfall totals per pixel and per catchment, in one pass over the rasters.
+
+The half-hourly rasters are read in order of time into a ring buffer that holds
+the last grids of the longest duration. Each duration keeps a running total:
+at every step the new grid is added and the grid that leaves its window is
+taken off, so a step costs the same whatever the durations. The highest total
+of every pixel and the time it was reached are kept for each duration, and the
+totals of the catchments are written as series along the way.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import sys
+import csv
+import argparse
+import datetime
+import numpy
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools import envi_io
+from gpm_precipitation_tools.raster_catalog import RasterCatalog, CATALOG_NAME
+from gpm_precipitation_tools.resample import DEFAULT_STEP_HOURS
+from gpm_precipitation_tools import series_io
+
+
+DEFAULT_DURATIONS = (1, 3, 6, 24, 72)  # hours
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class RollingAccumulator(object):
+    """
+    Running N-hour totals of a sequence of rate grids, for several durations at once.
+
+    Parameters
+    ----------
+    shape : (int, int)
+        Size of the grids.
+    durations : sequence of numbers
+        Durations in hours.
+    step_hours : float
+        Timestep of the grids, in hours.
+    """
+
+    def __init__(self, shape, durations=DEFAULT_DURATIONS, step_hours=DEFAULT_STEP_HOURS):
+        self.durations = list(durations)
+        self.step_hours = step_hours
+        self.steps = [int(round(duration / step_hours)) for duration in self.durations]
+        if min(self.steps) < 1:
+            raise ValueError(f'The durations must be at least one timestep ({step_hours} h)')
+        self.capacity = max(self.steps)
+        # ring buffer of the last depths (mm) and one running total per duration
+        self.buffer = numpy.zeros((self.capacity,) + tuple(shape), dtype=numpy.float32)
+        self.totals = [numpy.zeros(shape, dtype=numpy.float64) for steps in self.steps]
+        self.maxima = [numpy.zeros(shape, dtype=numpy.float64) for steps in self.steps]
+        self.when = [numpy.full(shape, numpy.nan, dtype=numpy.float64) for steps in self.steps]
+        self.position = 0
+        self.seen = 0
+        self.last = None
+
+    def reset(self):
+        self.buffer[:] = 0
+        for total in self.totals:
+            total[:] = 0
+        self.seen = 0
+
+    def push(self, band, date):
+        """
+        Add the grid (mm/hr) of a timestep. Missing timesteps before it count as dry.
+
+        Returns
+        ----------
+        totals : list of 2-D numpy arrays
+            Total depth (mm) of each duration ending with this timestep
+            (only complete windows count towards the maxima).
+        """
+        if self.last is not None:
+            gap = int(round((date - self.last).total_seconds() / 3600. / self.step_hours))
+            if gap < 1:
+                raise ValueError(f'{date} is not after {self.last}, give the rasters in order of time')
+            if gap - 1 >= self.capacity:
+                # nothing of the windows is left
+                self.reset()
+                self.seen = gap - 1
+            else:
+                for _ in range(gap - 1):
+                    self._step(None)
+        self._step(numpy.asarray(band) * self.step_hours)
+        self.last = date
+
+        hours = (date - EPOCH).total_seconds() / 3600.
+        for steps, total, maximum, when in zip(self.steps, self.totals, self.maxima, self.when):
+            if self.seen >= steps:
+                higher = total > maximum
+                maximum[higher] = total[higher]
+                when[higher] = hours
+        return self.totals
+
+    def _step(self, depth):
+        # the grid added k steps ago is at position - k
+        for steps, total in zip(self.steps, self.totals):
+            total -= self.buffer[(self.position - steps) % self.capacity]
+        if depth is None:
+            self.buffer[self.position] = 0
+        else:
+            self.buffer[self.position] = depth
+            for total in self.totals:
+                total += self.buffer[self.position]
+        self.position = (self.position + 1) % self.capacity
+        self.seen += 1
+
+
+def duration_name(duration):
+    return ('%g' % duration) + 'h'
+
+
+def rolling_maxima(rasters, output_dir, durations=DEFAULT_DURATIONS, zones=None, step_hours=DEFAULT_STEP_HOURS,
+                   series_format=series_io.DEFAULT_SERIES_FORMAT):
+    """
+    Write the maximum N-hour totals of a sequence of rasters and the series of the catchments.
+
+    Parameters
+    ----------
+    rasters : list of (datetime, str)
+        Date and path of the half-hourly rasters, in order of time.
+    output_dir : str
+        Folder of the outputs.
+    durations : sequence of numbers
+        Durations in hours.
+    zones : dict
+        Catchments from cutline_mask.catchment_zones, over the window of the
+        rasters. Without them the series is the mean of the whole raster.
+    step_hours : float
+        Timestep of the rasters, in hours.
+    series_format : str
+        Format of the series: csv, parquet or npz (see series_io).
+
+    Returns
+    ----------
+    outputs : list of str
+        Files written.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    if not rasters:
+        return []
+    hdr_file = envi_io.header_path(rasters[0][1])
+    header = envi_io.read_header(hdr_file)
+    accumulator = RollingAccumulator((header['lines'], header['samples']), durations, step_hours)
+    ids = zones['ids'] if zones is not None else ['area']
+
+    # the series are written as they come, nothing grows in memory
+    series_files = [os.path.join(output_dir, f'rolling_{duration_name(duration)}_catchments.csv') for duration in durations]
+    handles = [open(series_file, 'w', newline='') for series_file in series_files]
+    try:
+        writers = [csv.writer(handle) for handle in handles]
+        for writer in writers:
+            writer.writerow(['date'] + ids)
+        for date, path in rasters:
+            totals = accumulator.push(envi_io.read_band(path, header), date)
+            for steps, total, writer in zip(accumulator.steps, totals, writers):
+                if accumulator.seen < steps:
+                    continue
+                values = envi_io.zonal_means(total, zones) if zones is not None else [total.mean()]
+                writer.writerow([date.strftime('%Y-%m-%d %H:%M:%S')] + [float(value) for value in values])
+    finally:
+        for handle in handles:
+            handle.close()
+
+    if series_format != 'csv':
+        # the series are streamed to CSV, then written whole in their format
+        for n, series_file in enumerate(series_files):
+            columns, metadata = series_io.read_series(series_file)
+            series_files[n] = series_io.series_path(series_file, series_format)
+            series_io.write_series(series_files[n], columns, {'duration_hours': durations[n], 'units': {'catchments': 'mm'}})
+            os.remove(series_file)
+
+    outputs = list(series_files)
+    for duration, maximum, when in zip(durations, accumulator.maxima, accumulator.when):
+        name = os.path.join(output_dir, f'max_{duration_name(duration)}')
+        envi_io.write_band(name + '.bil', maximum, hdr_file)
+        # hours since 1970-01-01 of the end of the wettest window
+        envi_io.write_band(name + '_end.bil', when, hdr_file)
+        outputs += [name + '.bil', name + '_end.bil']
+    return outputs
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='rolling_rainfall',
+                                     description='Maximum N-hour rainfall totals of the half-hourly rasters of a folder.')
+    parser.add_argument('--file_folder', dest='file_folder', required=True, help='Folder with the half-hourly .bil files')
+    parser.add_argument('--durations', dest='durations', default=','.join(str(d) for d in DEFAULT_DURATIONS), help='Comma separated durations in hours (default 1,3,6,24,72)')
+    parser.add_argument('--SptSlc', dest='SptSlc', default=None, help='Shapefile the rasters were processed with, for the catchment series')
+    parser.add_argument('--SptID', dest='SptID', default=None, help='Field of the --SptSlc features with their catchment ID')
+    parser.add_argument('--Fractional', dest='Fractional', action='store_true', help='The rasters were processed with --Fractional')
+    parser.add_argument('--output_dir', dest='output_dir', default=None, help='Folder of the output (default: rolling in the file folder)')
+    parser.add_argument('--start_time', dest='start_time', help='Only use the files from this date time (format %%Y-%%m-%%d:%%H%%M%%S)')
+    parser.add_argument('--end_time', dest='end_time', help='Only use the files until this date time (format %%Y-%%m-%%d:%%H%%M%%S)')
+    parser.add_argument('--series_format', dest='series_format', choices=series_io.SERIES_FORMATS, default=series_io.DEFAULT_SERIES_FORMAT, type=series_io.format_argument, help='Format of the series: csv (default), parquet or npz')
+    args = parser.parse_args(args)
+
+    durations = [float(duration) for duration in args.durations.split(',')]
+    start_time = datetime.datetime.strptime(args.start_time, '%Y-%m-%d:%H%M%S') if args.start_time else None
+    end_time = datetime.datetime.strptime(args.end_time, '%Y-%m-%d:%H%M%S') if args.end_time else None
+
+    with RasterCatalog(os.path.join(args.file_folder, CATALOG_NAME)) as catalog:
+        catalog.update(args.file_folder)
+        rasters = catalog.between(start_time, end_time)
+
+    zones = None
+    if args.SptSlc is not None and args.SptID is not None and rasters:
+        from gpm_precipitation_tools.cutline_mask import catchment_zones
+        x_pixels, y_pixels, window = envi_io.global_window(envi_io.read_header(envi_io.header_path(rasters[0][1])))
+        zone_window, zones = catchment_zones(args.SptSlc, args.SptID, x_pixels, y_pixels, fractional=args.Fractional)
+        if zone_window != window:
+            raise ValueError(f'The rasters were not processed with the catchments of {args.SptSlc}')
+
+    outputs = rolling_maxima(rasters, args.output_dir or os.path.join(args.file_folder, 'rolling'), durations, zones,
+                             series_format=args.series_format)
+    print(f'{len(outputs)} files from {len(rasters)} rasters')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
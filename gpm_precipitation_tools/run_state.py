@@ -0,0 +1,164 @@
+"""
+run_state.py
+SQLite record of the stages each granule of a run went through.
+
+Every granule that is downloaded, processed (translated and cropped into a
+.bil file) or aggregated into the time series gets a row with the digest of
+what it was made from: the raw file and the settings of the run. A run that
+starts again after being stopped only redoes the stages whose row is missing,
+whose digest changed or whose output file is gone.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import sqlite3
+import datetime
+import threading
+
+
+RUN_STATE_NAME = 'run_state.sqlite'
+STAGES = ['downloaded', 'processed', 'aggregated']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stages (
+    granule TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    digest TEXT,
+    output TEXT,
+    done TEXT,
+    PRIMARY KEY (granule, stage)
+);
+"""
+
+
+def file_signature(path):
+    """
+    Size and modification time of a file: changes when the file is downloaded again.
+    """
+    stat = os.stat(path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'
+
+
+class RunState(object):
+    """
+    Stages of the granules of a run.
+
+    Parameters
+    ----------
+    path : str
+        SQLite file of the run state, created if needed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # the granules are recorded from the threads of the streaming mode too
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def clear(self):
+        """
+        Forget every stage, so that the run does everything again.
+        """
+        with self._lock, self.connection:
+            self.connection.execute('DELETE FROM stages')
+
+    def move(self, old_directory, new_directory):
+        """
+        Point the outputs recorded in a directory to the directory it was renamed to.
+        """
+        old_directory = os.path.join(old_directory, '')
+        new_directory = os.path.join(new_directory, '')
+        with self._lock, self.connection:
+            self.connection.execute('UPDATE stages SET output = ? || substr(output, ?) WHERE substr(output, 1, ?) = ?',
+                                    (new_directory, len(old_directory) + 1, len(old_directory), old_directory))
+
+    def mark(self, granule, stage, digest=None, output=None):
+        """
+        Record that a granule went through a stage.
+
+        Parameters
+        ----------
+        granule : str
+            Name of the raw granule.
+        stage : str
+            One of STAGES.
+        digest : str
+            Digest of the input and settings of the stage.
+        output : str
+            File made by the stage, checked when the run starts again.
+        """
+        self.mark_many([granule], stage, {granule: digest}, {granule: output})
+
+    def mark_many(self, granules, stage, digests=None, outputs=None):
+        """
+        Record several granules at once, see mark.
+        """
+        if stage not in STAGES:
+            raise ValueError(f'Unknown stage {stage}, use one of {STAGES}')
+        digests, outputs = digests or {}, outputs or {}
+        done = datetime.datetime.now().isoformat(timespec='seconds')
+        rows = [(granule, stage, digests.get(granule), outputs.get(granule), done) for granule in granules]
+        with self._lock, self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO stages VALUES (?, ?, ?, ?, ?)', rows)
+
+    def is_done(self, granule, stage, digest=None):
+        """
+        True if a granule went through a stage with the same digest and its output is still there.
+        """
+        with self._lock:
+            row = self.connection.execute('SELECT digest, output FROM stages WHERE granule = ? AND stage = ?',
+                                          (granule, stage)).fetchone()
+        if row is None or row[0] != digest:
+            return False
+        return row[1] is None or os.path.exists(row[1])
+
+    def pending(self, granules, stage, digests=None):
+        """
+        The granules that still have to go through a stage, in the order given.
+
+        Parameters
+        ----------
+        granules : list of str
+            Names of the granules.
+        stage : str
+            One of STAGES.
+        digests : dict
+            Digest of each granule for the stage.
+        """
+        digests = digests or {}
+        with self._lock:
+            done = {granule: (digest, output) for granule, digest, output in self.connection.execute(
+                'SELECT granule, digest, output FROM stages WHERE stage = ?', (stage,))}
+        return [granule for granule in granules
+                if granule not in done or done[granule][0] != digests.get(granule)
+                or (done[granule][1] is not None and not os.path.exists(done[granule][1]))]
+
+    def done(self, granules, stage, digests=None):
+        """
+        The granules that went through a stage with the same digest and whose output is still there, in the order given.
+        """
+        pending = set(self.pending(granules, stage, digests))
+        return [granule for granule in granules if granule not in pending]
+
+    def summary(self):
+        """
+        Number of granules that went through each stage.
+        """
+        with self._lock:
+            counts = dict(self.connection.execute('SELECT stage, COUNT(*) FROM stages GROUP BY stage'))
+        return {stage: counts.get(stage, 0) for stage in STAGES}
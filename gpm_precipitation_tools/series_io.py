@@ -0,0 +1,295 @@
+"""
+series_io.py
+Read and write the rainfall time series as CSV, Parquet or NPZ.
+
+A series is a set of named columns of the same length. The date columns (date,
+or start for the windows of resample) are kept as datetime64 and the other
+columns as float64 (or text when they are not numbers). Parquet (with pyarrow) and NPZ files are typed, compressed and
+carry the metadata of the series (product, area of interest, units), so they
+load in a fraction of the time of the CSV text. CSV stays available for export
+and for the tools that read text; it doesn't keep the metadata.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import csv
+import json
+import argparse
+import numpy
+
+
+SERIES_FORMATS = ['csv', 'parquet', 'npz']
+DEFAULT_SERIES_FORMAT = 'csv'
+EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'npz': '.npz'}
+DATE_COLUMNS = ['date', 'start']
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def require_pyarrow():
+    """
+    Import pyarrow, needed by the Parquet series, with a hint if it isn't installed.
+    """
+    try:
+        import pyarrow.parquet
+    except ImportError as error:
+        raise ImportError('Parquet series need pyarrow: pip install gpm_precipitation_tools[parquet] '
+                          '(or pip install pyarrow), or choose csv or npz') from error
+
+
+def format_argument(value):
+    """
+    argparse type of the series format options: parquet is refused while
+    parsing the arguments if pyarrow is missing, not once the series are made.
+    """
+    if value == 'parquet':
+        try:
+            require_pyarrow()
+        except ImportError as error:
+            raise argparse.ArgumentTypeError(str(error))
+    return value
+
+
+def series_format(path):
+    """
+    Format of a series file, from its extension.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    for name, known in EXTENSIONS.items():
+        if extension == known:
+            return name
+    raise ValueError(f'Unknown series format of {path}, use one of {list(EXTENSIONS.values())}')
+
+
+def series_path(path, output_format):
+    """
+    Path of a series with the extension of a format.
+    """
+    if output_format not in SERIES_FORMATS:
+        raise ValueError(f'Unknown series format {output_format}, use one of {SERIES_FORMATS}')
+    return os.path.splitext(path)[0] + EXTENSIONS[output_format]
+
+
+def column_array(name, values):
+    """
+    Typed array of a column: datetime64[s] for the dates, float64 or text for the others.
+    """
+    if name in DATE_COLUMNS:
+        values = numpy.asarray(values)
+        if values.dtype.kind == 'M':
+            return values.astype('datetime64[s]')
+        # '' is a file without a date in its name
+        return numpy.array([value if value not in ('', None) else 'NaT' for value in values], dtype='datetime64[s]')
+    try:
+        return numpy.asarray(values, dtype=numpy.float64)
+    except (TypeError, ValueError):
+        return numpy.asarray(values, dtype=str)
+
+
+def date_strings(dates):
+    """
+    The dates of a column as '%Y-%m-%d %H:%M:%S' text ('' where there is no date).
+    """
+    text = numpy.datetime_as_string(numpy.asarray(dates, dtype='datetime64[s]'), unit='s')
+    return [value.replace('T', ' ') if value != 'NaT' else '' for value in text]
+
+
+def series_columns(path):
+    """
+    Names of the columns of a series file, without reading its values.
+    """
+    output_format = series_format(path)
+    if output_format == 'csv':
+        with open(path, newline='') as f:
+            return next(csv.reader(f), [])
+    if output_format == 'npz':
+        with numpy.load(path, allow_pickle=False) as data:
+            return [str(name) for name in data['__columns__']]
+    import pyarrow.parquet as pq
+    return pq.read_schema(path).names
+
+
+def write_series(path, columns, metadata=None):
+    """
+    Write a series, in the format of the extension of its path.
+
+    Parameters
+    ----------
+    path : str
+        .csv, .parquet or .npz file.
+    columns : dict of sequences
+        Columns of the series, in order.
+    metadata : dict
+        Metadata of the series (e.g. product, aoi, units), kept as JSON in
+        Parquet and NPZ files.
+    """
+    output_format = series_format(path)
+    names = [str(name) for name in columns]
+    arrays = [column_array(name, values) for name, values in zip(names, columns.values())]
+    metadata = {str(key): json.dumps(value) for key, value in (metadata or {}).items()}
+    temporary = path + f'.{os.getpid()}.tmp'
+
+    if output_format == 'csv':
+        text = [date_strings(array) if name in DATE_COLUMNS else array.tolist() for name, array in zip(names, arrays)]
+        with open(temporary, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(names)
+            writer.writerows(zip(*text))
+    elif output_format == 'npz':
+        # the arrays are stored by position: the names of the columns can be anything
+        with open(temporary, 'wb') as f:
+            numpy.savez_compressed(f, __columns__=numpy.array(names, dtype=str),
+                                   __metadata__=numpy.array(json.dumps(metadata)),
+                                   **{f'c{n}': array for n, array in enumerate(arrays)})
+    else:
+        import pyarrow
+        import pyarrow.parquet as pq
+        table = pyarrow.table(dict(zip(names, arrays)))
+        table = table.replace_schema_metadata(metadata)
+        pq.write_table(table, temporary, compression='zstd')
+    os.replace(temporary, path)
+
+
+class SeriesWriter(object):
+    """
+    Write a series a batch of rows at a time, in the format of the extension of its path.
+
+    CSV rows are written as they come and every Parquet batch is a row group,
+    so neither holds the whole series in memory. An NPZ file can't be added
+    to: its batches are kept as typed arrays and written on close.
+
+    Parameters
+    ----------
+    path : str
+        .csv, .parquet or .npz file, replaced on close.
+    names : list of str
+        Columns of the series, in order.
+    metadata : dict
+        Metadata of the series, see write_series.
+    """
+
+    def __init__(self, path, names, metadata=None):
+        self.path = path
+        self.names = [str(name) for name in names]
+        self.metadata = metadata
+        self.format = series_format(path)
+        self.temporary = path + f'.{os.getpid()}.tmp'
+        self._file = self._writer = None
+        self._batches = []
+        if self.format == 'csv':
+            self._file = open(self.temporary, 'w', newline='')
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(self.names)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, error, traceback):
+        if kind is None:
+            self.close()
+        else:
+            self.abort()
+
+    def write(self, rows):
+        """
+        Add a batch of rows (sequences in the order of the columns).
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        if self.format == 'csv':
+            self._writer.writerows(rows)
+            return
+        arrays = [column_array(name, values) for name, values in zip(self.names, zip(*rows))]
+        if self.format == 'npz':
+            self._batches.append(arrays)
+            return
+        import pyarrow
+        import pyarrow.parquet as pq
+        table = pyarrow.table(dict(zip(self.names, arrays)))
+        if self._writer is None:
+            schema = table.schema.with_metadata({str(key): json.dumps(value) for key, value in (self.metadata or {}).items()})
+            self._writer = pq.ParquetWriter(self.temporary, schema, compression='zstd')
+        self._writer.write_table(table.cast(self._writer.schema))
+
+    def close(self):
+        """
+        Finish the file and put it at its path.
+        """
+        if self.format == 'csv':
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
+        else:
+            # NPZ, or a Parquet series without rows
+            columns = [numpy.concatenate(arrays) for arrays in zip(*self._batches)] or [[] for name in self.names]
+            write_series(self.path, dict(zip(self.names, columns)), self.metadata)
+            return
+        os.replace(self.temporary, self.path)
+
+    def abort(self):
+        """
+        Leave the file at the path as it was.
+        """
+        if self._file is not None:
+            self._file.close()
+        elif self._writer is not None:
+            self._writer.close()
+        if os.path.exists(self.temporary):
+            os.remove(self.temporary)
+
+
+def read_series(path):
+    """
+    Read a series written by write_series (or any CSV with a header).
+
+    Returns
+    ----------
+    columns : dict of numpy arrays
+        Columns of the series, in order.
+    metadata : dict
+        Metadata of the series (empty for CSV).
+    """
+    output_format = series_format(path)
+    if output_format == 'csv':
+        with open(path, newline='') as f:
+            reader = csv.reader(f)
+            names = next(reader, [])
+            values = list(zip(*[row for row in reader if row])) or [[] for name in names]
+        return {name: column_array(name, column) for name, column in zip(names, values)}, {}
+
+    if output_format == 'npz':
+        with numpy.load(path, allow_pickle=False) as data:
+            names = [str(name) for name in data['__columns__']]
+            metadata = json.loads(str(data['__metadata__']))
+            columns = {name: data[f'c{n}'] for n, name in enumerate(names)}
+    else:
+        import pyarrow.parquet as pq
+        table = pq.read_table(path)
+        metadata = {key.decode(): value.decode() for key, value in (table.schema.metadata or {}).items()}
+        columns = {name: column_array(name, table.column(name).to_numpy()) for name in table.column_names}
+    return columns, {key: json.loads(value) for key, value in metadata.items()}
+
+
+def extend_series(path, names, rows, date_column, append, metadata=None):
+    """
+    Add rows to a Parquet or NPZ series, merged in by date (see timeseries_state.extend_series).
+    """
+    new = {name: column_array(name, list(values)) for name, values in zip(names, zip(*rows) if rows else [[] for name in names])}
+    if append and os.path.exists(path):
+        existing, previous = read_series(path)
+        if list(existing) != list(names):
+            raise ValueError(f'The columns of {path} are not the columns of this run, make it again without append')
+        date_name = names[date_column]
+        # the new rows replace the existing ones of the same date
+        kept = ~numpy.isin(existing[date_name], new[date_name].astype(existing[date_name].dtype))
+        new = {name: numpy.concatenate([existing[name][kept], new[name].astype(existing[name].dtype)]) for name in names}
+        # a stable sort keeps the rows of the same date in order
+        order = numpy.argsort(new[names[date_column]], kind='stable')
+        new = {name: values[order] for name, values in new.items()}
+        metadata = dict(previous, **(metadata or {}))
+    write_series(path, new, metadata)
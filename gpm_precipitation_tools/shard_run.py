@@ -0,0 +1,494 @@
+"""
+shard_run.py
+Run a long date range as shards on several machines that share a directory.
+
+plan splits the date range (and optionally a set of areas) into shards and
+writes them to shard_plan.json in the shared directory. Any number of workers,
+on any machine that sees the directory, then take the shards one by one: a
+shard is claimed by creating its claim file, which only one worker can do,
+and the worker keeps touching it while PPT_CMD_RUN runs the shard. The claim of
+a worker that died goes stale and another worker takes the shard over. A shard
+that fails is run again, by any worker, until it failed --attempts times. merge
+checks that every shard is done and that their series follow each other
+without gaps or overlaps, and writes the series of the whole range and a
+catalog of the rasters of all the shards, always in the same order.
+
+No scheduler is needed: the claims are plain files in the shared directory.
+`shard_run local --workers N` runs the whole thing on one machine.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import datetime
+import threading
+import subprocess
+
+################################################################################
+################################################################################
+"""Import internal modules"""
+################################################################################
+################################################################################
+
+from gpm_precipitation_tools.timeseries_state import TimeseriesState
+from gpm_precipitation_tools.granule_planner import plan_granules
+from gpm_precipitation_tools.credentials import earthdata_login, login_environment
+
+
+PLAN_NAME = 'shard_plan.json'
+DEFAULT_SHARD_DAYS = 30
+DEFAULT_STALE_AFTER = 900  # seconds without a heartbeat before a claim is taken over
+HEARTBEAT = 60
+DEFAULT_ATTEMPTS = 3  # runs of a shard that fails before the workers leave it
+DATE_FORMAT = '%Y-%m-%d'
+SERIES_KINDS = ['rainfall', 'catchments']
+
+
+def shard_dates(product, start_date, end_date, shard_days=DEFAULT_SHARD_DAYS):
+    """
+    Split a date range (both ends included) into consecutive ranges.
+
+    The shards of the monthly product are whole months, so that no month is
+    in two shards.
+
+    Returns
+    ----------
+    dates : list of (datetime.date, datetime.date)
+        First and last day of each shard.
+    """
+    if end_date < start_date:
+        raise ValueError(f'The end date {end_date} is before the start date {start_date}')
+    shards = []
+    if product == 'GPM_M':
+        months = max(1, shard_days // 30)
+        first = datetime.date(start_date.year, start_date.month, 1)
+        while first <= end_date:
+            index = first.year * 12 + first.month - 1 + months
+            after = datetime.date(index // 12, index % 12 + 1, 1)
+            shards.append((max(first, start_date), min(after - datetime.timedelta(days=1), end_date)))
+            first = after
+        return shards
+    first = start_date
+    while first <= end_date:
+        last = min(first + datetime.timedelta(days=shard_days - 1), end_date)
+        shards.append((first, last))
+        first = last + datetime.timedelta(days=1)
+    return shards
+
+
+def plan_shards(shared_dir, product, start_date, end_date, shard_days=DEFAULT_SHARD_DAYS, tiles=None, run_args=()):
+    """
+    Write the plan of a sharded run.
+
+    Parameters
+    ----------
+    shared_dir : str
+        Directory shared by the workers.
+    product : str
+        GPM_M, GPM_D or GPM_30min.
+    start_date, end_date : datetime.date
+        Date range, both ends included.
+    shard_days : int
+        Number of days of a shard.
+    tiles : list of str
+        Shapefiles of the areas to run separately (--SptSlc of each shard), or
+        None for one area.
+    run_args : list of str
+        Other arguments of PPT_CMD_RUN, the same for every shard (e.g. --SptID ID).
+
+    Returns
+    ----------
+    plan : dict
+        The plan, as written to shard_plan.json.
+    """
+    os.makedirs(os.path.join(shared_dir, 'claims'), exist_ok=True)
+    os.makedirs(os.path.join(shared_dir, 'done'), exist_ok=True)
+    os.makedirs(os.path.join(shared_dir, 'failed'), exist_ok=True)
+    shards = []
+    for tile in (tiles or [None]):
+        for first, last in shard_dates(product, start_date, end_date, shard_days):
+            shards.append({'id': f'{len(shards):05d}', 'start': first.strftime(DATE_FORMAT),
+                           'end': last.strftime(DATE_FORMAT), 'tile': tile})
+    plan = {'product': product, 'start': start_date.strftime(DATE_FORMAT), 'end': end_date.strftime(DATE_FORMAT),
+            'shard_days': shard_days, 'tiles': tiles, 'run_args': list(run_args), 'shards': shards}
+    path = os.path.join(shared_dir, PLAN_NAME)
+    with open(path + f'.{os.getpid()}.tmp', 'w') as f:
+        json.dump(plan, f, indent=1)
+    os.replace(path + f'.{os.getpid()}.tmp', path)
+    return plan
+
+
+def read_plan(shared_dir):
+    with open(os.path.join(shared_dir, PLAN_NAME)) as f:
+        return json.load(f)
+
+
+def shard_dir(shared_dir, shard):
+    return os.path.join(shared_dir, 'shards', shard['id'])
+
+
+def done_path(shared_dir, shard):
+    return os.path.join(shared_dir, 'done', shard['id'] + '.json')
+
+
+def claim_path(shared_dir, shard):
+    return os.path.join(shared_dir, 'claims', shard['id'] + '.claim')
+
+
+def failures_path(shared_dir, shard):
+    return os.path.join(shared_dir, 'failed', shard['id'] + '.json')
+
+
+def failures(shared_dir, shard):
+    """
+    Failed runs of a shard, by any worker.
+    """
+    try:
+        with open(failures_path(shared_dir, shard)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return []
+
+
+def claim_shard(shared_dir, shard, stale_after=DEFAULT_STALE_AFTER):
+    """
+    Try to claim a shard for this worker.
+
+    The claim file is created with O_EXCL, so only one worker gets it. A claim
+    whose file wasn't touched for stale_after seconds is renamed away (only
+    one worker can do that too) and claimed again.
+
+    Returns
+    ----------
+    claimed : bool
+    """
+    path = claim_path(shared_dir, shard)
+    if os.path.exists(done_path(shared_dir, shard)):
+        return False
+    for attempt in range(2):
+        try:
+            descriptor = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                stale = time.time() - os.path.getmtime(path) > stale_after
+            except FileNotFoundError:
+                continue
+            if not stale:
+                return False
+            moved = path + f'.stale.{socket.gethostname()}.{os.getpid()}'
+            try:
+                os.rename(path, moved)
+            except OSError:
+                # another worker took it over first
+                return False
+            if time.time() - os.path.getmtime(moved) <= stale_after:
+                # another worker took it over between the check and the rename: give its claim back
+                os.rename(moved, path)
+                return False
+            continue
+        with os.fdopen(descriptor, 'w') as f:
+            json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'claimed': time.time()}, f)
+        return True
+    return False
+
+
+class Heartbeat(object):
+    """
+    Touch a claim file every few seconds while a shard runs.
+    """
+
+    def __init__(self, path, interval=HEARTBEAT):
+        self.path = path
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._beat, name='shard-heartbeat', daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            try:
+                os.utime(self.path)
+            except OSError:
+                pass
+
+
+def shard_command(plan, shard, process_dir):
+    """
+    PPT_CMD_RUN command of a shard.
+    """
+    command = [sys.executable, '-m', 'gpm_precipitation_tools.PPT_CMD_RUN', '--ProdTP', plan['product'],
+               '--StartDate', shard['start'], '--EndDate', shard['end'], '--ProcessDir', process_dir]
+    if shard['tile'] is not None:
+        command += ['--SptSlc', shard['tile']]
+    return command + list(plan['run_args'])
+
+
+def run_worker(shared_dir, stale_after=DEFAULT_STALE_AFTER, max_shards=None, command=shard_command, environment=None,
+               attempts=DEFAULT_ATTEMPTS):
+    """
+    Take and run the shards of a plan until none is left.
+
+    The worker goes through the plan again as long as it claimed a shard in
+    the last pass, so that it runs again the shards that failed, its own or
+    those of the other workers, until they failed attempts times. It stops
+    when no shard can be claimed: the shards claimed by a worker that is still
+    running are left to it.
+
+    Parameters
+    ----------
+    shared_dir : str
+        Directory shared by the workers, with the plan.
+    stale_after : float
+        Seconds without a heartbeat after which the claim of another worker is taken over.
+    max_shards : int
+        Stop after this many shards.
+    command : function
+        Gives the command of a shard from (plan, shard, process_dir).
+    environment : dict
+        Environment of the shards, with the Earthdata login (see
+        credentials.login_environment). Default: the environment of the worker.
+    attempts : int
+        Number of failed runs after which a shard is left out.
+
+    Returns
+    ----------
+    results : list of (str, int)
+        Id and exit code of the shards run by this worker, once per run.
+    """
+    plan = read_plan(shared_dir)
+    os.makedirs(os.path.join(shared_dir, 'failed'), exist_ok=True)
+    results = []
+    claimed = True
+    while claimed:
+        claimed = False
+        for shard in plan['shards']:
+            if max_shards is not None and len(results) >= max_shards:
+                return results
+            if len(failures(shared_dir, shard)) >= attempts or not claim_shard(shared_dir, shard, stale_after):
+                continue
+            claimed = True
+            process_dir = shard_dir(shared_dir, shard)
+            os.makedirs(process_dir, exist_ok=True)
+            print(f'shard {shard["id"]}: {shard["start"]} to {shard["end"]}' + (f' of {shard["tile"]}' if shard['tile'] else ''))
+            with Heartbeat(claim_path(shared_dir, shard), min(HEARTBEAT, stale_after / 3.)):
+                with open(os.path.join(process_dir, 'worker.log'), 'a') as log:
+                    code = subprocess.call(command(plan, shard, process_dir), stdout=log, stderr=subprocess.STDOUT,
+                                           env=environment)
+            if code == 0:
+                with open(done_path(shared_dir, shard), 'w') as f:
+                    json.dump({'shard': shard, 'host': socket.gethostname(), 'finished': time.time()}, f)
+            else:
+                print(f'shard {shard["id"]} failed with code {code}, see {os.path.join(process_dir, "worker.log")}')
+                # only the worker holding the claim writes the failures of the shard
+                path = failures_path(shared_dir, shard)
+                runs = failures(shared_dir, shard)
+                runs.append({'host': socket.gethostname(), 'code': code, 'finished': time.time()})
+                with open(path + f'.{os.getpid()}.tmp', 'w') as f:
+                    json.dump(runs, f)
+                os.replace(path + f'.{os.getpid()}.tmp', path)
+            os.remove(claim_path(shared_dir, shard))
+            results.append((shard['id'], code))
+    return results
+
+
+def shard_series(shared_dir, shard):
+    """
+    Series files of a finished shard, by kind (rainfall, catchments).
+    """
+    found = {}
+    process_root = shard_dir(shared_dir, shard)
+    for name in sorted(os.listdir(process_root)):
+        directory = os.path.join(process_root, name)
+        if name.endswith('_processed') and os.path.isdir(directory):
+            state = TimeseriesState(directory)
+            for kind, file_name in state.files.items():
+                found[kind] = os.path.join(directory, file_name)
+    return found
+
+
+def merge_shards(shared_dir, output_dir=None):
+    """
+    Check that every shard of a plan is done and assemble their outputs in time order.
+
+    The series of the shards of each area are put end to end into
+    <output_dir>/<area>/<start>_to_<end>_<product>_<kind> with the extension of
+    the shards, after checking that they have the same columns and that their
+    dates increase from one shard to the next. The rasters of all the shards
+    are indexed in <output_dir>/raster_catalog.sqlite, for
+    process_timeseries_files_pipeline --catalog and resample_rainfall.
+
+    A shard whose series doesn't have a row for every granule of its date
+    range (see granule_planner.plan_granules) is a gap and stops the merge.
+
+    Returns
+    ----------
+    report : dict
+        Rows and date range of every merged series. Also written to
+        <output_dir>/merge_report.json.
+    """
+    from gpm_precipitation_tools import series_io
+    from gpm_precipitation_tools.raster_catalog import RasterCatalog, CATALOG_NAME
+    import numpy
+
+    plan = read_plan(shared_dir)
+    output_dir = output_dir or os.path.join(shared_dir, 'merged')
+    missing = [shard['id'] for shard in plan['shards'] if not os.path.exists(done_path(shared_dir, shard))]
+    if missing:
+        raise ValueError(f'{len(missing)} shards are not done: {", ".join(missing)}')
+    os.makedirs(output_dir, exist_ok=True)
+
+    report = {'product': plan['product'], 'start': plan['start'], 'end': plan['end'], 'series': []}
+    for tile in (plan['tiles'] or [None]):
+        shards = sorted([shard for shard in plan['shards'] if shard['tile'] == tile], key=lambda shard: shard['start'])
+        area = os.path.splitext(os.path.basename(tile))[0] if tile is not None else 'area'
+        files = [shard_series(shared_dir, shard) for shard in shards]
+        for kind in SERIES_KINDS:
+            parts = [found[kind] for found in files if kind in found]
+            if not parts:
+                continue
+            if len(parts) != len(shards):
+                raise ValueError(f'Only {len(parts)} of the {len(shards)} shards of {area} have a {kind} series')
+            merged, names, last = None, None, None
+            for shard, part in zip(shards, parts):
+                columns, metadata = series_io.read_series(part)
+                expected = len(plan_granules(plan['product'], shard['start'], shard['end']))
+                if len(columns['date']) != expected:
+                    raise ValueError(f'The {kind} series of shard {shard["id"]} has {len(columns["date"])} timesteps '
+                                     f'instead of {expected}, remove {done_path(shared_dir, shard)} to run it again')
+                if names is not None and list(columns) != names:
+                    raise ValueError(f'The columns of {part} are not the columns of the shards before it')
+                names = list(columns)
+                dates = columns['date']
+                if len(dates) and last is not None and dates.min() <= last:
+                    raise ValueError(f'The series of shard {shard["id"]} overlaps the shard before it')
+                if len(dates):
+                    if (numpy.diff(dates) <= numpy.timedelta64(0, 's')).any():
+                        raise ValueError(f'The series of shard {shard["id"]} is not in order of date')
+                    last = dates.max()
+                merged = columns if merged is None else {name: numpy.concatenate([merged[name], columns[name]]) for name in names}
+            extension = os.path.splitext(parts[0])[1]
+            path = os.path.join(output_dir, area, f'{plan["start"]}_to_{plan["end"]}_{plan["product"]}_{kind}{extension}')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            series_io.write_series(path, merged, dict(metadata, start=plan['start'], end=plan['end'],
+                                                      shards=[shard['id'] for shard in shards]))
+            dates = series_io.date_strings(merged['date'][:1]) + series_io.date_strings(merged['date'][-1:])
+            report['series'].append({'area': area, 'kind': kind, 'path': os.path.relpath(path, output_dir),
+                                     'rows': int(len(merged['date'])), 'first': dates[0] if dates else None,
+                                     'last': dates[-1] if dates else None})
+
+    # the rasters stay where the shards wrote them, the catalog finds them
+    with RasterCatalog(os.path.join(output_dir, CATALOG_NAME)) as catalog:
+        for shard in sorted(plan['shards'], key=lambda shard: shard['id']):
+            for root, directories, names in os.walk(shard_dir(shared_dir, shard)):
+                directories.sort()
+                if any(name.endswith('.bil') for name in names):
+                    catalog.update(root, aoi=os.path.basename(shard['tile']) if shard['tile'] else None)
+        duplicated = catalog.connection.execute(
+            'SELECT time, aoi, COUNT(*) FROM rasters GROUP BY time, product, aoi HAVING COUNT(*) > 1').fetchall()
+        report['rasters'] = catalog.connection.execute('SELECT COUNT(*) FROM rasters').fetchone()[0]
+    if duplicated:
+        raise ValueError(f'{len(duplicated)} timesteps have rasters in several shards, e.g. {duplicated[0][0]}')
+
+    with open(os.path.join(output_dir, 'merge_report.json'), 'w') as f:
+        json.dump(report, f, indent=1, sort_keys=True)
+    return report
+
+
+def run_local(shared_dir, workers, stale_after=DEFAULT_STALE_AFTER, login=None, attempts=DEFAULT_ATTEMPTS):
+    """
+    Run the workers of a plan as processes of this machine, then merge.
+
+    The Earthdata login is looked up (or asked for) once here and given to
+    every worker.
+    """
+    environment = login_environment(login or earthdata_login())
+    command = [sys.executable, '-m', 'gpm_precipitation_tools.shard_run', 'worker', '--shared_dir', shared_dir,
+               '--stale_after', str(stale_after), '--attempts', str(attempts)]
+    processes = [subprocess.Popen(command, env=environment) for n in range(max(1, workers))]
+    codes = [process.wait() for process in processes]
+    if any(codes):
+        raise RuntimeError(f'{sum(1 for code in codes if code)} workers failed')
+    return merge_shards(shared_dir)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='shard_run',
+                                     description='Run a long date range of PPT_CMD_RUN as shards on machines sharing a directory.')
+    commands = parser.add_subparsers(dest='command')
+
+    plan = commands.add_parser('plan', help='Split the date range into shards')
+    plan.add_argument('--shared_dir', dest='shared_dir', required=True, help='Directory shared by the workers')
+    plan.add_argument('--ProdTP', dest='ProdTP', default='GPM_30min', choices=['GPM_M', 'GPM_D', 'GPM_30min'], help='Product')
+    plan.add_argument('--StartDate', dest='StartDate', required=True, help='Start date (format %%Y-%%m-%%d)')
+    plan.add_argument('--EndDate', dest='EndDate', required=True, help='End date, included (format %%Y-%%m-%%d)')
+    plan.add_argument('--shard_days', dest='shard_days', type=int, default=DEFAULT_SHARD_DAYS, help='Days of a shard (default 30, whole months for GPM_M)')
+    plan.add_argument('--tiles', dest='tiles', default=None, help='Comma separated shapefiles of areas to run as separate shards')
+
+    worker = commands.add_parser('worker', help='Run shards until none is left')
+    merge = commands.add_parser('merge', help='Assemble the outputs of the shards')
+    local = commands.add_parser('local', help='Run workers on this machine and merge')
+    for command in [worker, merge, local]:
+        command.add_argument('--shared_dir', dest='shared_dir', required=True, help='Directory shared by the workers')
+    for command in [worker, local]:
+        command.add_argument('--stale_after', dest='stale_after', type=float, default=DEFAULT_STALE_AFTER, help='Seconds without a heartbeat before a claim is taken over')
+        command.add_argument('--attempts', dest='attempts', type=int, default=DEFAULT_ATTEMPTS, help='Failed runs after which a shard is left out (default 3)')
+    worker.add_argument('--max_shards', dest='max_shards', type=int, default=None, help='Stop after this many shards')
+    merge.add_argument('--output_dir', dest='output_dir', default=None, help='Folder of the merged outputs (default: merged in the shared directory)')
+    local.add_argument('--workers', dest='workers', type=int, default=2, help='Number of worker processes')
+
+    # the arguments plan doesn't know go to PPT_CMD_RUN for every shard
+    args, run_args = parser.parse_known_args(args)
+    if args.command is None:
+        parser.print_help()
+        return 2
+    if args.command != 'plan' and run_args:
+        parser.error(f'unrecognized arguments: {" ".join(run_args)}')
+    if args.command == 'plan' and args.tiles and '--SptSlc' in run_args:
+        parser.error('--tiles gives the --SptSlc of each shard, use one or the other')
+
+    if args.command == 'plan':
+        start_date = datetime.datetime.strptime(args.StartDate, DATE_FORMAT).date()
+        end_date = datetime.datetime.strptime(args.EndDate, DATE_FORMAT).date()
+        tiles = [os.path.abspath(tile) for tile in args.tiles.split(',')] if args.tiles else None
+        written = plan_shards(args.shared_dir, args.ProdTP, start_date, end_date, args.shard_days, tiles, run_args)
+        print(f'{len(written["shards"])} shards in {os.path.join(args.shared_dir, PLAN_NAME)}')
+    elif args.command == 'worker':
+        # a worker has no display: the login comes from the environment or ~/.netrc
+        try:
+            login = earthdata_login(interactive=False)
+        except RuntimeError as error:
+            print(error)
+            return 2
+        results = run_worker(args.shared_dir, args.stale_after, args.max_shards,
+                             environment=login_environment(login), attempts=args.attempts)
+        # a shard that failed and then worked is done
+        codes = dict(results)
+        print(f'{len(results)} shards run, {sum(1 for code in codes.values() if code)} failed')
+        return 1 if any(codes.values()) else 0
+    elif args.command == 'merge':
+        report = merge_shards(args.shared_dir, args.output_dir)
+        print(f'{len(report["series"])} series and {report["rasters"]} rasters merged')
+    else:
+        report = run_local(args.shared_dir, args.workers, args.stale_after, attempts=args.attempts)
+        print(f'{len(report["series"])} series and {report["rasters"]} rasters merged')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,179 @@
+"""
+timeseries_state.py
+State of an incremental rainfall time series.
+
+In append mode maps_to_timeseries only reads the .bil files that are new or
+changed since the series was made, and merges their rows into the existing CSV
+files. The state file next to them keeps the name and modification time of
+every file read, the last timestep and a digest of the settings the series was
+made with (product, area, statistics), so that a series is rebuilt from
+scratch instead of mixing two different set-ups.
+"""
+
+################################################################################
+################################################################################
+"""Import Python packages"""
+################################################################################
+################################################################################
+
+import os
+import csv
+import json
+import hashlib
+import datetime
+
+
+STATE_NAME = 'timeseries_state.json'
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def settings_digest(settings):
+    """
+    sha256 of the settings of a series (anything JSON can write).
+    """
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class TimeseriesState(object):
+    """
+    State file of the time series of a working directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the .bil files and of the series.
+    name : str
+        File name of the state.
+    """
+
+    def __init__(self, directory, name=STATE_NAME):
+        self.path = os.path.join(directory, name)
+        self.directory = directory
+        self.last = None
+        self.digest = None
+        self.files = {}
+        # modification time of every .bil file in the series, by name
+        self.inputs = {}
+        # product and area (digest of the --SptSlc) of the .bil files, for the raster catalog
+        self.product = None
+        self.aoi = None
+        self.load()
+
+    def load(self):
+        self.last, self.digest, self.files, self.inputs = None, None, {}, {}
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            self.last = datetime.datetime.strptime(state['last'], DATE_FORMAT) if state['last'] else None
+            self.digest = state['digest']
+            self.files = state['files']
+            self.product, self.aoi = state.get('product'), state.get('aoi')
+            # a state without them reads every file again
+            self.inputs = state.get('inputs', {})
+        except (ValueError, KeyError):
+            # a broken state only means the series is made again
+            self.last, self.digest, self.files, self.inputs = None, None, {}, {}
+
+    def save(self):
+        """
+        Write the state (atomically, an interrupted run keeps the previous one).
+        """
+        state = {'last': self.last.strftime(DATE_FORMAT) if self.last else None,
+                 'digest': self.digest, 'files': self.files, 'product': self.product, 'aoi': self.aoi,
+                 'inputs': self.inputs}
+        temporary = self.path + f'.{os.getpid()}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(state, f, indent=1)
+        os.replace(temporary, self.path)
+
+    def usable(self, digest):
+        """
+        True if the series on disk was made with the same settings and can be extended.
+        """
+        if self.digest != digest or self.last is None:
+            return False
+        return all(os.path.exists(os.path.join(self.directory, name)) for name in self.files.values())
+
+    def changed(self, mtimes):
+        """
+        Names of the files that are new or were modified since they were added to the series.
+
+        Parameters
+        ----------
+        mtimes : dict
+            Modification time of every file of the folder, by name.
+        """
+        return [name for name, mtime in mtimes.items() if self.inputs.get(name) != mtime]
+
+    def series_file(self, kind, name):
+        """
+        Bring the existing series of a kind (rainfall, catchments) to its name for this run.
+
+        The names of the series have the end date of the run in them, so the
+        series of the previous run is renamed instead of starting a new one.
+        """
+        previous = self.files.get(kind)
+        if previous is not None and previous != name and os.path.exists(os.path.join(self.directory, previous)):
+            os.replace(os.path.join(self.directory, previous), os.path.join(self.directory, name))
+        self.files[kind] = name
+        return os.path.join(self.directory, name)
+
+
+def extend_series(path, columns, rows, date_column, append, metadata=None):
+    """
+    Write rows to a series, after the existing ones in append mode.
+
+    Rows that belong before the end of the existing series (late files) are
+    merged in by date, so the series stays in order, and replace the existing
+    rows of the same date (files that changed).
+
+    Parameters
+    ----------
+    path : str
+        File of the series: CSV, or Parquet or NPZ (see series_io).
+    columns : list of str
+        Header of the series.
+    rows : list of lists
+        New rows, in order of date.
+    date_column : int
+        Index of the date column ('%Y-%m-%d %H:%M:%S', sorts like the dates).
+    append : bool
+        Keep the existing rows of the file.
+    metadata : dict
+        Metadata of the series, kept by the Parquet and NPZ files.
+    """
+    if not path.lower().endswith('.csv'):
+        # the columnar files are written whole
+        from gpm_precipitation_tools import series_io
+        series_io.extend_series(path, columns, rows, date_column, append, metadata)
+        return
+
+    if not append or not os.path.exists(path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        return
+
+    with open(path, newline='') as f:
+        existing = list(csv.reader(f))
+    if existing and existing[0] != columns:
+        raise ValueError(f'The columns of {path} are not the columns of this run, make it again without append')
+    last = existing[-1][date_column] if len(existing) > 1 else ''
+
+    if all(str(row[date_column]) > last for row in rows):
+        with open(path, 'a', newline='') as f:
+            csv.writer(f).writerows(rows)
+        return
+
+    dates = set(str(row[date_column]) for row in rows)
+    kept = [row for row in existing[1:] if row[date_column] not in dates]
+    merged = sorted(kept + [list(row) for row in rows], key=lambda row: str(row[date_column]))
+    temporary = path + f'.{os.getpid()}.tmp'
+    with open(temporary, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(merged)
+    os.replace(temporary, path)
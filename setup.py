@@ -14,6 +14,9 @@ requirements = []#'setuptools==57.5.0','gdal==3.0.4','numpy==1.19.5','pandas==1.
 
 test_requirements = [ ]
 
+# optional formats: pip install gpm_precipitation_tools[parquet]
+extras_requirements = {'parquet': ['pyarrow']}
+
 setup(
     author="Marina Ruiz Sanchez-Oro",
     author_email='marina.ruiz.so@ed.ac.uk',
@@ -32,10 +35,15 @@ setup(
     entry_points={
         'console_scripts': [
             'PPT_CMD_RUN=gpm_precipitation_tools.PPT_CMD_RUN:main',
-            'process_timeseries_files_pipeline=gpm_precipitation_tools.process_timeseries_files_pipeline:main'
+            'process_timeseries_files_pipeline=gpm_precipitation_tools.process_timeseries_files_pipeline:main',
+            'resample_rainfall=gpm_precipitation_tools.resample:main',
+            'rolling_rainfall=gpm_precipitation_tools.rolling_accumulation:main',
+            'Add_forecast=gpm_precipitation_tools.Add_forecast:main',
+            'shard_run=gpm_precipitation_tools.shard_run:main'
         ],
     },
     install_requires=requirements,
+    extras_require=extras_requirements,
     license="MIT license",
     long_description=readme + '\n\n' + history,
     include_package_data=True,
@@ -0,0 +1,65 @@
+"""Helpers shared by the tests."""
+
+
+import os
+import shutil
+import tempfile
+
+import numpy
+
+
+def temporary_directory(test):
+    """
+    Make a temporary directory that is removed once the test is over.
+    """
+    directory = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+    return directory
+
+
+def write_envi(path, values, west=-5.0, north=58.0, pixel_size=0.1):
+    """
+    Write a float32 grid as an ENVI .bil file with a WGS84 header, like the processed rasters.
+    """
+    values = numpy.asarray(values, dtype='<f4')
+    values.tofile(path)
+    with open(os.path.splitext(path)[0] + '.hdr', 'w') as f:
+        f.write('ENVI\n'
+                f'samples = {values.shape[1]}\n'
+                f'lines = {values.shape[0]}\n'
+                'bands = 1\n'
+                'header offset = 0\n'
+                'file type = ENVI Standard\n'
+                'data type = 4\n'
+                'interleave = bsq\n'
+                'byte order = 0\n'
+                f'map info = {{Geographic Lat/Lon, 1, 1, {west}, {north}, {pixel_size}, {pixel_size},WGS-84}}\n'
+                'coordinate system string = {GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],'
+                'PRIMEM["Greenwich",0],UNIT["degree",0.0174532925199433],AUTHORITY["EPSG","4326"]]}\n')
+    return path
+
+
+def write_granule(path, values, variable='Grid/precipitationCal'):
+    """
+    Write a grid as a GPM granule: HDF5 (netCDF-4) stored rotated, longitude first, like the GPM files.
+
+    Parameters
+    ----------
+    path : str
+        File of the granule.
+    values : 2d array
+        Rainfall with north up, one row per latitude.
+    variable : str
+        Path of the precipitation variable in the file.
+    """
+    import netCDF4
+
+    values = numpy.asarray(values, dtype='f4')
+    group_name, name = os.path.split(variable)
+    with netCDF4.Dataset(path, 'w') as dataset:
+        group = dataset.createGroup(group_name) if group_name else dataset
+        group.createDimension('lon', values.shape[1])
+        group.createDimension('lat', values.shape[0])
+        # the first column of the stored grid is the south
+        group.createVariable(name, 'f4', ('lon', 'lat'))[:] = numpy.rot90(values, -1)
+    return path
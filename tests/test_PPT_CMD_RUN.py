@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.PPT_CMD_RUN`."""
+
+
+import os
+import csv
+import unittest
+
+import numpy
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+
+from gpm_precipitation_tools import PPT_CMD_RUN
+from gpm_precipitation_tools.run_state import RunState, RUN_STATE_NAME
+from gpm_precipitation_tools.timeseries_state import TimeseriesState
+from tests.helpers import temporary_directory, write_granule
+
+
+def granule_name(day, slot):
+    start = slot * 30
+    return f'3B-HHR-E.MS.MRG.3IMERG.201801{day:02d}-S{start // 60:02d}{start % 60:02d}00-E{start // 60:02d}{start % 60 + 29:02d}59.{start:04d}.V06B.HDF5'
+
+
+class TestPPTCmdRun(unittest.TestCase):
+    """Tests for the command line runs on granules already downloaded (--OP)."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+
+    def run_days(self, end_day, *options):
+        """
+        Process the granules of 2018-01-01 to 2018-01-<end_day>, and give the processed directory.
+        """
+        end_date = f'2018-01-{end_day:02d}'
+        arguments = ['--ProdTP', 'GPM_30min', '--StartDate', '2018-01-01', '--EndDate', end_date,
+                     '--ProcessDir', self.directory, '--OP'] + list(options)
+        self.assertEqual(PPT_CMD_RUN.main(arguments), 0)
+        return os.path.join(self.directory, f'GPM_RAW_30min_2018-01-01_{end_date}_processed')
+
+    def add_granules(self, raw_dir, day):
+        os.makedirs(raw_dir, exist_ok=True)
+        for slot in range(2):
+            # 10 degree pixels over the globe, the same rain everywhere
+            write_granule(os.path.join(raw_dir, granule_name(day, slot)), numpy.full((18, 36), 10 * day + slot))
+
+    def read_series(self, process_dir, end_date):
+        with open(os.path.join(process_dir, f'2018-01-01_to_{end_date}_GPM_30min_rainfall.csv'), newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_append_with_a_new_end_date(self):
+        """Test that a second run with a later EndDate goes on from the series and files of the first one."""
+        first_raw = os.path.join(self.directory, 'GPM_RAW_30min_2018-01-01_2018-01-01')
+        self.add_granules(first_raw, 1)
+        first = self.run_days(1, '--Append')
+        self.assertEqual(len(self.read_series(first, '2018-01-01')), 2)
+        # the processed files stay next to the state that refers to them
+        processed = sorted(name for name in os.listdir(first) if name.endswith('.bil'))
+        self.assertEqual(len(processed), 2)
+        mtimes = {name: os.path.getmtime(os.path.join(first, name)) for name in processed}
+
+        # the granules of the next day arrive in the download directory of the first run
+        self.add_granules(first_raw, 2)
+        second = self.run_days(2, '--Append')
+        self.assertFalse(os.path.exists(first))
+        self.assertFalse(os.path.exists(first_raw))
+
+        rows = self.read_series(second, '2018-01-02')
+        self.assertEqual([row['date'] for row in rows],
+                         ['2018-01-01 00:00:00', '2018-01-01 00:30:00', '2018-01-02 00:00:00', '2018-01-02 00:30:00'])
+        self.assertEqual([float(row['mean']) for row in rows], [10., 11., 20., 21.])
+        # the granules of the first run were neither processed again nor read again
+        self.assertEqual({name: os.path.getmtime(os.path.join(second, name)) for name in processed}, mtimes)
+        state = TimeseriesState(second)
+        self.assertEqual(len(state.inputs), 4)
+        self.assertEqual(state.files, {'rainfall': '2018-01-01_to_2018-01-02_GPM_30min_rainfall.csv'})
+
+    def test_completed_run_again(self):
+        """Test that running a completed run again with --OP neither processes nor aggregates anything."""
+        self.add_granules(os.path.join(self.directory, 'GPM_RAW_30min_2018-01-01_2018-01-01'), 1)
+        process_dir = self.run_days(1)
+        outputs = sorted(name for name in os.listdir(process_dir) if name.endswith('.bil') or name.endswith('.csv'))
+        self.assertEqual(len(outputs), 3)
+        mtimes = {name: os.path.getmtime(os.path.join(process_dir, name)) for name in outputs}
+
+        self.run_days(1)
+        self.assertEqual({name: os.path.getmtime(os.path.join(process_dir, name)) for name in outputs}, mtimes)
+        with RunState(os.path.join(process_dir, RUN_STATE_NAME)) as run_state:
+            self.assertEqual(run_state.summary(), {'downloaded': 2, 'processed': 2, 'aggregated': 2})
+
+    def test_catchments_without_area(self):
+        """Test that --SptID without --SptSlc is refused before anything is downloaded or processed."""
+        with self.assertRaises(SystemExit) as raised:
+            PPT_CMD_RUN.main(['--StartDate', '2018-01-01', '--EndDate', '2018-01-01', '--ProcessDir', self.directory,
+                              '--SptID', 'ID'])
+        self.assertEqual(raised.exception.code, 2)
+        self.assertEqual(os.listdir(self.directory), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.credentials`."""
+
+
+import os
+import unittest
+from unittest import mock
+
+from gpm_precipitation_tools.credentials import earthdata_login, login_environment
+from tests.helpers import temporary_directory
+
+
+class TestCredentials(unittest.TestCase):
+    """Tests for the Earthdata login without the login window."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.netrc = os.path.join(self.directory, 'netrc')
+
+    def test_environment_first(self):
+        """Test that the environment wins over ~/.netrc."""
+        with open(self.netrc, 'w') as f:
+            f.write('machine urs.earthdata.nasa.gov login from_netrc password secret\n')
+        os.chmod(self.netrc, 0o600)
+        environment = login_environment(('from_env', 'pass'), {'NETRC': self.netrc})
+        with mock.patch.dict(os.environ, environment, clear=True):
+            self.assertEqual(earthdata_login(interactive=False), ('from_env', 'pass'))
+        with mock.patch.dict(os.environ, {'NETRC': self.netrc}, clear=True):
+            self.assertEqual(earthdata_login(interactive=False), ('from_netrc', 'secret'))
+
+    def test_no_login(self):
+        """Test that a missing login is an error instead of a window when not interactive."""
+        with mock.patch.dict(os.environ, {'NETRC': self.netrc}, clear=True):
+            with self.assertRaises(RuntimeError):
+                earthdata_login(interactive=False)
+
+
+if __name__ == '__main__':
+    unittest.main()
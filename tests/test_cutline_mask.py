@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.cutline_mask`."""
+
+
+import os
+import json
+import unittest
+
+from gpm_precipitation_tools import cutline_mask
+from tests.helpers import temporary_directory
+
+
+def square(lon, lat, size, **properties):
+    corners = [[lon, lat], [lon + size, lat], [lon + size, lat + size], [lon, lat + size], [lon, lat]]
+    return {'type': 'Feature', 'properties': properties, 'geometry': {'type': 'Polygon', 'coordinates': [corners]}}
+
+
+class TestCutlineMask(unittest.TestCase):
+    """Tests for the masks of the area of interest."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.cache_dir = os.path.join(self.directory, 'masks')
+
+    def write_features(self, name, features):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': features}, f)
+        return path
+
+    def test_area_smaller_than_a_pixel(self):
+        """Test that an area without any pixel centre is weighted by the fraction it covers."""
+        # 10 degree pixels: the square of 1 degree misses the centre (5, 5) of its pixel
+        cutfile = self.write_features('small.geojson', [square(1, 1, 1)])
+        window, mask = cutline_mask.cutline_mask(cutfile, 36, 18, cache_dir=self.cache_dir)
+        self.assertEqual(window, (18, 8, 1, 1))
+        self.assertAlmostEqual(float(mask[0, 0]), 0.01)
+
+    def test_catchment_smaller_than_a_pixel(self):
+        """Test that a small catchment gets its pixel while the others keep theirs."""
+        cutfile = self.write_features('catchments.geojson', [square(10, 0, 10, ID='big'), square(1, 1, 1, ID='small')])
+        window, zones = cutline_mask.catchment_zones(cutfile, 'ID', 36, 18, cache_dir=self.cache_dir)
+        self.assertEqual(zones['ids'], ['big', 'small'])
+        self.assertEqual(window, (18, 8, 2, 1))
+        self.assertEqual(zones['total'][0], 1.)
+        self.assertAlmostEqual(zones['total'][1], 0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.download_engine`."""
+
+
+import os
+import hashlib
+import threading
+import unittest
+from unittest import mock
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from gpm_precipitation_tools import download_engine
+from gpm_precipitation_tools.download_engine import GPMDownloader
+from gpm_precipitation_tools.download_manifest import DownloadManifest
+from tests.helpers import temporary_directory
+
+
+URL = 'https://gpm1.gesdisc.eosdis.nasa.gov/data/GPM_L3/GPM_3IMERGDF.06/2018/01/granule.nc4'
+MODIFIED = 'Mon, 01 Jan 2018 00:00:00 GMT'
+
+
+class StubResponse(object):
+    """
+    Response of the stubbed session: a status, the chunks of the body and headers.
+    """
+
+    def __init__(self, status_code=200, chunks=(), headers=None, on_chunk=None):
+        self.status_code = status_code
+        self.chunks = list(chunks)
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.content = b''.join(chunk for chunk in self.chunks if isinstance(chunk, bytes))
+        self.on_chunk = on_chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f'{self.status_code} error')
+
+    def iter_content(self, chunk_size=1):
+        for chunk in self.chunks:
+            if isinstance(chunk, Exception):
+                raise chunk
+            if self.on_chunk is not None:
+                self.on_chunk()
+            yield chunk
+
+
+class StubSession(object):
+    """
+    Session that answers every request with the next of a list of responses (or exceptions).
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None, stream=False, timeout=None):
+        self.requests.append(('GET', url, headers))
+        return self.next()
+
+    def head(self, url, allow_redirects=False, timeout=None):
+        self.requests.append(('HEAD', url, None))
+        return self.next()
+
+    def next(self):
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        pass
+
+
+class TestDownloadEngine(unittest.TestCase):
+    """Tests for the shared downloader."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.target = os.path.join(self.directory, 'granule.nc4')
+
+    def downloader(self, responses, **options):
+        options.setdefault('backoff', 0)
+        downloader = GPMDownloader('user', 'pass', workers=1, **options)
+        self.addCleanup(downloader.close)
+        session = StubSession(responses)
+        downloader.session = lambda: session
+        return downloader, session
+
+    def test_retry(self):
+        """Test that a failed attempt is tried again, and that the granule is described."""
+        downloader, session = self.downloader([requests.ConnectionError('reset'),
+                                               StubResponse(chunks=[b'precip', b'itation'], headers={'Last-Modified': MODIFIED})])
+        info = downloader.fetch(URL, self.target)
+        self.assertEqual(len(session.requests), 2)
+        self.assertEqual(info, {'size': 13, 'remote_modified': MODIFIED,
+                                'checksum': hashlib.sha256(b'precipitation').hexdigest()})
+        with open(self.target, 'rb') as f:
+            self.assertEqual(f.read(), b'precipitation')
+
+    def test_give_up(self):
+        """Test that a granule that keeps failing gives None and leaves no partial file."""
+        downloader, session = self.downloader([StubResponse(chunks=[b'precip', requests.ConnectionError('reset')])] * 3,
+                                              retries=2)
+        self.assertIsNone(downloader.fetch(URL, self.target))
+        self.assertEqual(len(session.requests), 3)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_not_found(self):
+        """Test that a granule that is not published yet is not tried again."""
+        downloader, session = self.downloader([StubResponse(404)])
+        self.assertIsNone(downloader.fetch(URL, self.target))
+        self.assertEqual(len(session.requests), 1)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_backoff(self):
+        """Test that the retries wait longer and longer, or as long as the server asks."""
+        downloader, session = self.downloader([requests.ConnectionError('reset'), requests.Timeout('slow'),
+                                               StubResponse(503, headers={'Retry-After': '10'}),
+                                               StubResponse(chunks=[b'data'])], retries=3, backoff=1)
+        with mock.patch.object(download_engine.time, 'sleep') as sleep:
+            self.assertIsNotNone(downloader.fetch(URL, self.target))
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 10])
+
+    def test_refused(self):
+        """Test that an answer that won't change (e.g. a wrong login) is not tried again, unlike 429."""
+        for status in [401, 403, 400]:
+            with self.subTest(status=status):
+                downloader, session = self.downloader([StubResponse(status)] * 3, retries=2)
+                self.assertIsNone(downloader.fetch(URL, self.target))
+                self.assertEqual(len(session.requests), 1)
+                self.assertEqual(os.listdir(self.directory), [])
+
+        downloader, session = self.downloader([StubResponse(429), StubResponse(chunks=[b'data'])], retries=2)
+        self.assertIsNotNone(downloader.fetch(URL, self.target))
+        self.assertEqual(len(session.requests), 2)
+
+    def test_workers_kept(self):
+        """Test that the worker threads, and so their sessions, are kept from one call to the next."""
+        downloader = GPMDownloader('user', 'pass', workers=2)
+        downloader.fetch = lambda url, target: {'size': 0, 'remote_modified': None, 'checksum': None}
+        threads, pools = set(), []
+        for n in range(3):
+            downloader.download_all([(URL, self.target)] * 4, on_done=lambda target: threads.add(threading.get_ident()))
+            pools.append(downloader._pool)
+        pool = pools[0]
+        self.assertEqual(pools, [pool] * 3)
+        self.assertLessEqual(len(threads), 2)
+        downloader.close()
+        self.assertIsNone(downloader._pool)
+        self.assertTrue(pool._shutdown)
+
+    def test_partial_file(self):
+        """Test that the data goes to a .part file that is only renamed once complete."""
+        seen = []
+
+        def on_chunk():
+            seen.append((os.path.exists(self.target + '.part'), os.path.exists(self.target)))
+
+        downloader, session = self.downloader([StubResponse(chunks=[b'a', b'b'], on_chunk=on_chunk)])
+        downloader.fetch(URL, self.target)
+        # the .part file is opened before the first chunk arrives, the target only exists at the end
+        self.assertEqual(seen, [(True, False), (True, False)])
+        self.assertEqual(os.listdir(self.directory), ['granule.nc4'])
+
+    def test_outdated(self):
+        """Test that only the missing granules, or the changed ones with revalidate, are kept."""
+        manifest = DownloadManifest(self.directory)
+        downloader, session = self.downloader([StubResponse(chunks=[b'data'], headers={'Last-Modified': MODIFIED})])
+        downloader.download_all([(URL, self.target)], manifest=manifest)
+
+        other = (URL.replace('granule', 'other'), os.path.join(self.directory, 'other.nc4'))
+        jobs = [(URL, self.target), other]
+        self.assertEqual(downloader.outdated(jobs, manifest), [other])
+
+        # the server has a newer version of the granule
+        session.responses = [StubResponse(headers={'Last-Modified': 'Tue, 02 Jan 2018 00:00:00 GMT'})]
+        self.assertEqual(downloader.outdated(jobs, manifest, revalidate=True), jobs)
+        self.assertEqual(session.requests[-1][0], 'HEAD')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.download_manifest`."""
+
+
+import os
+import unittest
+
+from gpm_precipitation_tools.download_manifest import DownloadManifest, file_checksum
+from tests.helpers import temporary_directory
+
+
+class TestDownloadManifest(unittest.TestCase):
+    """Tests for the download manifest."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.name = '3B-DAY.MS.MRG.3IMERG.20180101-S000000-E235959.V06.nc4'
+        self.path = os.path.join(self.directory, self.name)
+        with open(self.path, 'wb') as f:
+            f.write(b'precipitation')
+
+    def test_recorded_file_is_current(self):
+        """Test that a recorded file is skipped, also after reloading."""
+        manifest = DownloadManifest(self.directory)
+        self.assertEqual(manifest.missing([self.name]), [self.name])
+        manifest.record(self.name, 13, 'Mon, 01 Jan 2018 00:00:00 GMT', file_checksum(self.path))
+
+        manifest = DownloadManifest(self.directory)
+        self.assertEqual(manifest.missing([self.name]), [])
+        self.assertTrue(manifest.verify(self.name))
+        self.assertFalse(manifest.is_current(self.name, remote_modified='Tue, 02 Jan 2018 00:00:00 GMT'))
+
+    def test_changed_file_is_not_current(self):
+        """Test that a truncated or deleted file is downloaded again."""
+        manifest = DownloadManifest(self.directory)
+        manifest.record(self.name, 13)
+        with open(self.path, 'wb') as f:
+            f.write(b'precip')
+        self.assertFalse(manifest.is_current(self.name))
+        os.remove(self.path)
+        self.assertFalse(manifest.is_current(self.name))
+
+    def test_interrupted_line_is_ignored(self):
+        """Test that a line cut short by a crash doesn't break the manifest."""
+        manifest = DownloadManifest(self.directory)
+        manifest.record(self.name, 13)
+        with open(manifest.path, 'a') as f:
+            f.write('{"name": "3B-DAY')
+        manifest = DownloadManifest(self.directory)
+        self.assertEqual(list(manifest.entries), [self.name])
+        manifest.record('other.nc4', 1)
+        self.assertEqual(sorted(DownloadManifest(self.directory).entries), [self.name, 'other.nc4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.envi_io`."""
+
+
+import os
+import unittest
+
+import numpy
+
+from gpm_precipitation_tools import envi_io
+from tests.helpers import temporary_directory
+
+
+HEADER = """ENVI
+description = {
+Calib_rainfall_20180101-S000000-V06B_cut.bil}
+samples = 3
+lines = 2
+bands = 1
+header offset = 0
+file type = ENVI Standard
+data type = 4
+interleave = bsq
+byte order = 0
+map info = {Geographic Lat/Lon, 1, 1, -3.5, 56, 0.1, 0.1, WGS-84}
+"""
+
+
+class TestEnviIO(unittest.TestCase):
+    """Tests for the memory-mapped ENVI reader."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.bil = os.path.join(self.directory, 'Calib_rainfall_20180101-S000000-V06B_cut.bil')
+        with open(os.path.join(self.directory, 'Calib_rainfall_20180101-S000000-V06B_cut.hdr'), 'w') as f:
+            f.write(HEADER)
+        self.values = numpy.array([[0, 1, 2], [3, 0, 6]], dtype='<f4')
+        self.values.tofile(self.bil)
+
+    def test_read_header(self):
+        """Test the fields of a GDAL-like header, including a multi-line one."""
+        header = envi_io.read_header(envi_io.header_path(self.bil))
+        self.assertEqual((header['lines'], header['samples'], header['bands']), (2, 3, 1))
+        self.assertEqual(header['dtype'], numpy.dtype('<f4'))
+        self.assertTrue(header['description'].endswith('_cut.bil}'))
+        self.assertEqual(envi_io.data_size(header), os.path.getsize(self.bil))
+
+    def test_statistics(self):
+        """Test the statistics of a memory-mapped band."""
+        band = envi_io.read_band(self.bil)
+        numpy.testing.assert_array_equal(band, self.values)
+        stats = envi_io.zonal_statistics(band, percentiles=(50,))
+        self.assertAlmostEqual(stats['mean'], 2.)
+        self.assertEqual(stats['max'], 6.)
+        self.assertEqual(stats['sum'], 12.)
+        self.assertAlmostEqual(stats['wet_fraction'], 4. / 6)
+        self.assertAlmostEqual(stats['p50'], 1.5)
+        self.assertEqual(list(stats), envi_io.statistic_names((50,)))
+
+    def test_statistics_inside(self):
+        """Test that only the pixels inside the area count, weighted by their fraction inside."""
+        weights = numpy.array([[0, 1, 0.5], [1, 0, 0]], dtype=numpy.float32)
+        stats = envi_io.zonal_statistics(self.values, percentiles=(50,), weights=weights)
+        self.assertAlmostEqual(stats['mean'], (1 + 0.5 * 2 + 3) / 2.5)
+        self.assertEqual(stats['max'], 3.)
+        self.assertEqual(stats['wet_fraction'], 1.)
+        self.assertAlmostEqual(stats['p50'], 2.)
+
+        # the band was multiplied by the weights when it was cropped: 2 is half of a 4
+        stats = envi_io.zonal_statistics(self.values, percentiles=(50,), weights=weights, scaled=True)
+        self.assertAlmostEqual(stats['mean'], (1 + 2 + 3) / 2.5)
+        self.assertAlmostEqual(stats['sum'], 6.)
+        self.assertEqual(stats['max'], 4.)
+        self.assertAlmostEqual(stats['p50'], 3.)
+
+    def test_zonal_means(self):
+        """Test the means of several zones from a sparse label grid."""
+        zones = {'ids': ['a', 'b', 'c'],
+                 'pixel': numpy.array([0, 1, 2, 2, 5]),
+                 'label': numpy.array([0, 0, 0, 1, 1]),
+                 'weight': numpy.array([1, 1, 0.5, 0.5, 1], dtype=numpy.float32)}
+        zones['total'] = numpy.bincount(zones['label'], weights=zones['weight'], minlength=3)
+        means = envi_io.zonal_means(self.values, zones)
+        self.assertAlmostEqual(means[0], (0 + 1 + 0.5 * 2) / 2.5)
+        self.assertAlmostEqual(means[1], (0.5 * 2 + 6) / 1.5)
+        self.assertTrue(numpy.isnan(means[2]))
+
+    def test_global_window(self):
+        """Test the window of the global grid given by the map info."""
+        header = envi_io.read_header(envi_io.header_path(self.bil))
+        self.assertEqual(envi_io.global_window(header), (3600, 1800, (1765, 340, 3, 2)))
+
+
+if __name__ == '__main__':
+    unittest.main()
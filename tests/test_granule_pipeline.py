@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.granule_pipeline`."""
+
+
+import os
+import time
+import threading
+import unittest
+from unittest import mock
+
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+
+from gpm_precipitation_tools import granule_pipeline
+from gpm_precipitation_tools.General_functions import granule_output
+from gpm_precipitation_tools.processed_cache import ProcessedCache
+from gpm_precipitation_tools.download_engine import GPMDownloader
+from gpm_precipitation_tools.run_state import RunState
+from tests.helpers import temporary_directory
+
+
+ARGLIST = ['GPM_30min', '2018-01-01', '2018-01-01', None, None, True, 'float32', None, False]
+
+
+def stub_process_granule(arglist, file_name, zero_dir, fst_dir, backslh):
+    """
+    Process a granule by copying its content to the .bil file and writing a header.
+    """
+    outfile = granule_output(arglist, file_name, fst_dir, backslh)
+    with open(os.path.join(zero_dir, file_name)) as f:
+        content = f.read()
+    if content == 'broken':
+        raise IOError(f"Couldn't open the precipitation in {file_name}")
+    with open(outfile, 'w') as f:
+        f.write(content)
+    with open(os.path.splitext(outfile)[0] + '.hdr', 'w') as f:
+        f.write('ENVI')
+
+
+def stub_process_one(task):
+    """
+    Process a granule without reading it, into an empty file: the granules named broken* fail, slow* take longer.
+    """
+    arglist, file_name, zero_dir, process_dir, backslh = task[:5]
+    if file_name.startswith('slow'):
+        time.sleep(0.5)
+    if file_name.startswith('broken'):
+        return file_name, f"Traceback: couldn't open {file_name}"
+    open(granule_output(arglist, file_name, process_dir, backslh), 'w').close()
+    return file_name, None
+
+
+class TestProcessOne(unittest.TestCase):
+    """Tests for the processing of a single granule."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.zero_dir = os.path.join(self.directory, 'raw')
+        self.process_dir = os.path.join(self.directory, 'processed')
+        os.mkdir(self.zero_dir)
+        os.mkdir(self.process_dir)
+        patcher = mock.patch.object(granule_pipeline, 'process_granule', side_effect=stub_process_granule)
+        self.process_granule = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write_raw(self, name, content):
+        with open(os.path.join(self.zero_dir, name), 'w') as f:
+            f.write(content)
+        return name
+
+    def task(self, file_name, cache=None):
+        settings = granule_pipeline.processing_settings(ARGLIST) if cache is not None else None
+        return (ARGLIST, file_name, self.zero_dir, self.process_dir, os.sep, cache, settings)
+
+    def outputs(self):
+        return sorted(os.listdir(self.process_dir))
+
+    def test_without_cache(self):
+        """Test that a granule is processed every time without a cache, and that its error is caught."""
+        file_name = self.write_raw('granule.HDF5', 'rain')
+        self.assertEqual(granule_pipeline.process_one(self.task(file_name)), (file_name, None))
+        self.assertEqual(granule_pipeline.process_one(self.task(file_name)), (file_name, None))
+        self.assertEqual(self.process_granule.call_count, 2)
+        self.assertEqual(self.outputs(), ['granule.bil', 'granule.hdr'])
+
+        broken = self.write_raw('broken.HDF5', 'broken')
+        name, error = granule_pipeline.process_one(self.task(broken))
+        self.assertEqual(name, broken)
+        self.assertIn("Couldn't open the precipitation in broken.HDF5", error)
+
+    def test_cache_miss_then_hit(self):
+        """Test that a miss processes and stores the granule, and that a hit brings back all of its files."""
+        cache = ProcessedCache(os.path.join(self.directory, 'cache'))
+        file_name = self.write_raw('granule.HDF5', 'rain')
+        self.assertEqual(granule_pipeline.process_one(self.task(file_name, cache)), (file_name, None))
+        self.assertEqual(self.process_granule.call_count, 1)
+        self.assertEqual(len(cache.entries()), 1)
+
+        for name in self.outputs():
+            os.remove(os.path.join(self.process_dir, name))
+        self.assertEqual(granule_pipeline.process_one(self.task(file_name, cache)), (file_name, None))
+        self.assertEqual(self.process_granule.call_count, 1)
+        self.assertEqual(self.outputs(), ['granule.bil', 'granule.hdr'])
+        with open(os.path.join(self.process_dir, 'granule.bil')) as f:
+            self.assertEqual(f.read(), 'rain')
+
+        # another raw file is another key
+        self.write_raw('granule.HDF5', 'more rain')
+        granule_pipeline.process_one(self.task(file_name, cache))
+        self.assertEqual(self.process_granule.call_count, 2)
+        self.assertEqual(len(cache.entries()), 2)
+
+
+class TestProcessGranules(unittest.TestCase):
+    """Tests for the processing of the granules with a pool of processes."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.file_names = ['slow.HDF5', 'a.HDF5', 'broken.HDF5', 'c.HDF5', 'd.HDF5']
+        for file_name in self.file_names:
+            with open(os.path.join(self.directory, file_name), 'w') as f:
+                f.write(file_name)
+        patcher = mock.patch.object(granule_pipeline, 'process_one', stub_process_one)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def process(self, workers, run_state=None):
+        return granule_pipeline.process_granules(ARGLIST, self.file_names, self.directory, self.directory, os.sep,
+                                                 workers=workers, run_state=run_state)
+
+    def test_workers(self):
+        """Test that several processes give the results in the order of the granules, one failure apart."""
+        for workers in [1, 3]:
+            with self.subTest(workers=workers):
+                results = self.process(workers)
+                # slow.HDF5 finishes last with several workers
+                self.assertEqual([file_name for file_name, error in results], self.file_names)
+                self.assertEqual([file_name for file_name, error in results if error is not None], ['broken.HDF5'])
+                self.assertIn("couldn't open broken.HDF5", dict(results)['broken.HDF5'])
+
+    def test_run_state(self):
+        """Test that only the granules that worked are recorded, and that the failed one is tried again."""
+        with RunState(os.path.join(self.directory, 'run_state.sqlite')) as run_state:
+            self.process(2, run_state)
+            self.assertEqual(run_state.summary()['processed'], 4)
+            self.assertEqual(self.process(2, run_state), [('broken.HDF5', "Traceback: couldn't open broken.HDF5")])
+
+
+class TestStreamingProcessor(unittest.TestCase):
+    """Tests for the processing of the granules while they download."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+
+    def streamer(self, **options):
+        return granule_pipeline.StreamingProcessor(ARGLIST, self.directory, self.directory, os.sep, **options)
+
+    def test_back_pressure(self):
+        """Test that a download waits while the queue is full, and goes on once the processing catches up."""
+        started, release = threading.Event(), threading.Event()
+
+        def slow_process_one(task):
+            started.set()
+            release.wait(10)
+            return stub_process_one(task)
+
+        with mock.patch.object(granule_pipeline, 'process_one', side_effect=slow_process_one):
+            with self.streamer(queue_size=1) as streamer:
+                streamer.put('a.HDF5')
+                self.assertTrue(started.wait(10))
+                # a.HDF5 is being processed and b.HDF5 fills the queue
+                streamer.put('b.HDF5')
+                download = threading.Thread(target=streamer.put, args=('c.HDF5',))
+                download.start()
+                download.join(0.2)
+                self.assertTrue(download.is_alive())
+
+                release.set()
+                download.join(10)
+                self.assertFalse(download.is_alive())
+        self.assertEqual(streamer.processed, ['a.HDF5', 'b.HDF5', 'c.HDF5'])
+        self.assertEqual(streamer.failed, [])
+
+    def test_failures_are_collected(self):
+        """Test that a granule that fails is collected in failed and doesn't stop the others."""
+        with mock.patch.object(granule_pipeline, 'process_one', side_effect=stub_process_one):
+            with self.streamer() as streamer:
+                for file_name in ['a.HDF5', 'broken.HDF5', 'c.HDF5']:
+                    streamer.put(file_name)
+        self.assertEqual(streamer.processed, ['a.HDF5', 'c.HDF5'])
+        self.assertEqual(streamer.failed, [('broken.HDF5', "Traceback: couldn't open broken.HDF5")])
+
+    def test_on_done_raises(self):
+        """Test that an error of on_done stops the downloads and the processing instead of being lost."""
+        downloader = GPMDownloader('user', 'pass', workers=2)
+        downloader.fetch = lambda url, target: {'size': 0, 'remote_modified': None, 'checksum': None}
+        # the granule isn't on disk: the run state can't take its signature
+        jobs = [('https://example.com/missing.HDF5', os.path.join(self.directory, 'missing.HDF5'))]
+        with RunState(os.path.join(self.directory, 'run_state.sqlite')) as run_state:
+            with self.assertRaises(FileNotFoundError):
+                with self.streamer(run_state=run_state) as streamer:
+                    downloader.download_all(jobs, on_done=streamer.put)
+        self.assertIsNone(streamer._consumer)
+        self.assertEqual(streamer.processed, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
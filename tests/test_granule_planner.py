@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.granule_planner`."""
+
+
+import datetime
+import unittest
+
+from gpm_precipitation_tools import granule_planner
+
+
+class TestGranulePlanner(unittest.TestCase):
+    """Tests for the offline granule planner."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.now = datetime.datetime(2022, 1, 10)
+
+    def test_half_hourly_names(self):
+        """Test the 48 daily slots of the half-hourly product."""
+        plan = granule_planner.plan_granules('GPM_30min', '2018-01-01', '2018-01-01', now=self.now)
+        self.assertEqual(len(plan), 48)
+        self.assertEqual(plan[0].name, '3B-HHR-E.MS.MRG.3IMERG.20180101-S000000-E002959.0000.V06B.HDF5')
+        self.assertEqual(plan[-1].name, '3B-HHR-E.MS.MRG.3IMERG.20180101-S233000-E235959.1410.V06B.HDF5')
+        self.assertEqual(plan[1].url, granule_planner.GESDISC_URL + 'GPM_3IMERGHHE.06/2018/001/' + plan[1].name)
+
+    def test_daily_names_cross_months(self):
+        """Test the daily product across a month boundary."""
+        plan = granule_planner.plan_granules('GPM_D', '2018-01-30', '2018-02-02', now=self.now)
+        self.assertEqual([g.name for g in plan][0], '3B-DAY.MS.MRG.3IMERG.20180130-S000000-E235959.V06.nc4')
+        self.assertEqual(len(plan), 4)
+        self.assertEqual(len(granule_planner.group_by_directory(plan)), 2)
+
+    def test_monthly_names(self):
+        """Test the monthly product across a year boundary."""
+        plan = granule_planner.plan_granules('GPM_M', '2017-11-15', '2018-02-03', now=self.now)
+        self.assertEqual(len(plan), 4)
+        self.assertEqual(plan[0].name, '3B-MO.MS.MRG.3IMERG.20171101-S000000-E235959.11.V06B.HDF5')
+
+    def test_future_slots_are_dropped(self):
+        """Test that slots that have not ended by now are not planned."""
+        plan = granule_planner.plan_granules('GPM_30min', '2022-01-10', '2022-01-11', now=self.now + datetime.timedelta(hours=1))
+        # 00:00 and 00:30 have ended, 01:00 has just started
+        self.assertEqual([granule.start.strftime('%H:%M') for granule in plan], ['00:00', '00:30'])
+        # the month of now isn't over
+        plan = granule_planner.plan_granules('GPM_M', '2021-11-01', '2022-01-10', now=self.now)
+        self.assertEqual(len(plan), 2)
+
+    def test_verify_plan(self):
+        """Test that the listing replaces renamed granules and drops missing ones."""
+        plan = granule_planner.plan_granules('GPM_D', '2018-01-01', '2018-01-03', now=self.now)
+        listing = ('<a href="3B-DAY.MS.MRG.3IMERG.20180101-S000000-E235959.V06.nc4">x</a>'
+                   '<a href="3B-DAY.MS.MRG.3IMERG.20180101-S000000-E235959.V06.nc4.xml">x</a>'
+                   '<a href="3B-DAY.MS.MRG.3IMERG.20180102-S000000-E235959.V07.nc4">x</a>')
+        verified = granule_planner.verify_plan(plan, 'GPM_D', lambda url: listing)
+        self.assertEqual([g.name for g in verified],
+                         ['3B-DAY.MS.MRG.3IMERG.20180101-S000000-E235959.V06.nc4',
+                          '3B-DAY.MS.MRG.3IMERG.20180102-S000000-E235959.V07.nc4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.image_process`."""
+
+
+import os
+import json
+import unittest
+
+import numpy
+import pytest
+
+pytest.importorskip('osgeo.gdal')
+
+from gpm_precipitation_tools import envi_io
+from gpm_precipitation_tools.image_process import process
+from gpm_precipitation_tools.cutline_mask import cutline_mask
+from tests.helpers import temporary_directory, write_granule
+
+
+class TestProcess(unittest.TestCase):
+    """Tests for the processing of a granule into a .bil file."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.mask_dir = os.path.join(self.directory, 'masks')
+        os.environ['GPM_MASK_CACHE'] = self.mask_dir
+        self.addCleanup(os.environ.pop, 'GPM_MASK_CACHE', None)
+        # 10 degree pixels over the globe, north up, with the fill value of the GPM files in a corner
+        self.values = numpy.arange(18 * 36, dtype='f4').reshape(18, 36) / 10.
+        self.values[0, :3] = -9999.9
+        self.granule = write_granule(os.path.join(self.directory, '3B-HHR-E.MS.MRG.3IMERG.20180101-S000000-E002959.0000.V06B.HDF5'),
+                                     self.values)
+
+    def read(self, name):
+        header = envi_io.read_header(envi_io.header_path(os.path.join(self.directory, name)))
+        return header, numpy.array(envi_io.read_band(os.path.join(self.directory, name), header))
+
+    def write_area(self):
+        corners = [[5, 35], [35, 35], [35, 55], [5, 55], [5, 35]]
+        path = os.path.join(self.directory, 'area.geojson')
+        with open(path, 'w') as f:
+            json.dump({'type': 'FeatureCollection', 'features': [
+                {'type': 'Feature', 'properties': {}, 'geometry': {'type': 'Polygon', 'coordinates': [corners]}}]}, f)
+        return path
+
+    def test_full_read(self):
+        """Test that the whole grid is rotated back north up, with the fill values at 0."""
+        process(os.path.join(self.directory, 'full.bil'), self.granule, 'GPM_30min')
+        header, band = self.read('full.bil')
+        self.assertEqual(band.dtype, numpy.float32)
+        numpy.testing.assert_array_equal(band, numpy.maximum(self.values, 0))
+        self.assertEqual(envi_io.global_window(header), (36, 18, (0, 0, 36, 18)))
+
+    def test_window(self):
+        """Test that the window of the area is the same as the full read, cut and masked."""
+        process(os.path.join(self.directory, 'full.bil'), self.granule, 'GPM_30min')
+        cutfile = self.write_area()
+        process(os.path.join(self.directory, 'cut.bil'), self.granule, 'GPM_30min', cutfile=cutfile)
+        header, full = self.read('full.bil')
+        header, cut = self.read('cut.bil')
+
+        window, mask = cutline_mask(cutfile, 36, 18, cache_dir=self.mask_dir)
+        col_off, row_off, n_cols, n_rows = window
+        self.assertEqual(envi_io.global_window(header), (36, 18, window))
+        numpy.testing.assert_array_equal(cut, full[row_off:row_off + n_rows, col_off:col_off + n_cols] * mask)
+        self.assertTrue(cut.any())
+
+    def test_precision(self):
+        """Test that float64 grids hold the same values as the float32 ones."""
+        process(os.path.join(self.directory, 'single.bil'), self.granule, 'GPM_30min')
+        process(os.path.join(self.directory, 'double.bil'), self.granule, 'GPM_30min', precision='float64')
+        header, single = self.read('single.bil')
+        header, double = self.read('double.bil')
+        self.assertEqual(double.dtype, numpy.float64)
+        numpy.testing.assert_array_equal(double, single.astype('f8'))
+
+    def test_daily_granule(self):
+        """Test that the precipitation of a daily granule is read from the root of the file."""
+        granule = write_granule(os.path.join(self.directory, '3B-DAY.MS.MRG.3IMERG.20180101-S000000-E235959.V06.nc4'),
+                                self.values, variable='precipitationCal')
+        process(os.path.join(self.directory, 'day.bil'), granule, 'GPM_D')
+        header, band = self.read('day.bil')
+        numpy.testing.assert_array_equal(band, numpy.maximum(self.values, 0))
+
+    def test_monthly_scaling(self):
+        """Test that the hourly rate of a monthly granule is scaled in place to the whole month."""
+        granule = write_granule(os.path.join(self.directory, '3B-MO.MS.MRG.3IMERG.20180101-S000000-E235959.01.V06B.HDF5'),
+                                self.values, variable='Grid/precipitation')
+        process(os.path.join(self.directory, 'month.bil'), granule, 'GPM_M')
+        header, band = self.read('month.bil')
+        self.assertEqual(band.dtype, numpy.float32)
+        # 744 hours in January
+        numpy.testing.assert_array_equal(band, numpy.maximum(self.values, 0) * numpy.float32(744))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.listing_cache`."""
+
+
+import datetime
+import unittest
+
+from requests.structures import CaseInsensitiveDict
+
+from gpm_precipitation_tools.download_engine import GPMDownloader
+from gpm_precipitation_tools.listing_cache import ListingCache
+from tests.helpers import temporary_directory
+
+
+ROOT = 'https://gpm1.gesdisc.eosdis.nasa.gov/data/GPM_L3/GPM_3IMERGHHE.06/'
+
+
+class StubResponse(object):
+
+    def __init__(self, status_code, content=b'', headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+
+
+class StubSession(object):
+    """
+    Session that answers every GET with the next of a list of responses and keeps the request headers.
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.headers = []
+
+    def get(self, url, headers=None, timeout=None):
+        self.headers.append(dict(headers or {}))
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+class TestListingCache(unittest.TestCase):
+    """Tests for the cache of the directory listings."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        today = datetime.date.today()
+        # a listing of this week can still change, one of 2018 can't
+        self.recent = ROOT + f'{today.year}/{today.timetuple().tm_yday:03d}/'
+        self.settled = ROOT + '2018/001/'
+
+    def downloader(self, responses, ttl):
+        downloader = GPMDownloader('user', 'pass', workers=1, listing_cache=ListingCache(self.directory, ttl=ttl))
+        session = StubSession(responses)
+        downloader.session = lambda: session
+        return downloader, session
+
+    def test_ttl(self):
+        """Test that a recent listing is read from the cache until it is older than the TTL."""
+        downloader, session = self.downloader([StubResponse(200, b'first'), StubResponse(200, b'second')], ttl=3600)
+        self.assertEqual(downloader.get_text(self.recent), 'first')
+        self.assertEqual(downloader.get_text(self.recent), 'first')
+        self.assertEqual(len(session.headers), 1)
+
+        downloader.listing_cache.ttl = 0
+        self.assertEqual(downloader.get_text(self.recent), 'second')
+        self.assertEqual(len(session.headers), 2)
+
+    def test_settled_period(self):
+        """Test that the listing of a period that ended long ago is never asked for again."""
+        downloader, session = self.downloader([StubResponse(200, b'listing')], ttl=0)
+        self.assertEqual(downloader.get_text(self.settled), 'listing')
+        self.assertEqual(downloader.get_text(self.settled), 'listing')
+        self.assertEqual(len(session.headers), 1)
+        self.assertTrue(downloader.listing_cache.is_final(self.settled))
+        self.assertFalse(downloader.listing_cache.is_final(self.recent))
+
+    def test_not_modified(self):
+        """Test that the validators are sent back and that a 304 keeps the cached listing."""
+        # the server spells the header names in lower case
+        downloader, session = self.downloader([StubResponse(200, b'listing', {'etag': '"v1"', 'last-modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}),
+                                               StubResponse(304)], ttl=0)
+        self.assertEqual(downloader.get_text(self.recent), 'listing')
+        self.assertEqual(downloader.get_text(self.recent), 'listing')
+        self.assertEqual(session.headers[1], {'If-None-Match': '"v1"', 'If-Modified-Since': 'Mon, 01 Jan 2018 00:00:00 GMT'})
+
+        # a server that can't be reached: the old listing is better than none
+        cache = ListingCache(self.directory, ttl=0)
+        self.assertEqual(cache.get_text(self.recent, lambda url, headers: None), 'listing')
+
+
+if __name__ == '__main__':
+    unittest.main()
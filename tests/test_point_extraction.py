@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.point_extraction` and the points of `PrecipitationCube`."""
+
+
+import os
+import datetime
+import unittest
+
+import numpy
+import pandas as pd
+import xarray as xr
+import rioxarray
+
+from gpm_precipitation_tools.raster_stack import storage_encoding, with_grid_mapping
+from gpm_precipitation_tools.precipitation_cube import PrecipitationCube
+from gpm_precipitation_tools.point_extraction import extract_points, storage_chunks
+from tests.helpers import temporary_directory, write_envi
+
+
+class TestPointExtraction(unittest.TestCase):
+    """Tests for the series of many points."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.path = os.path.join(self.directory, 'joint.nc')
+        self.values = numpy.arange(10 * 6 * 8, dtype=numpy.float32).reshape(10, 1, 6, 8)
+        dataset = xr.Dataset({'precipitation': (('time', 'band', 'y', 'x'), self.values)},
+                             coords={'time': pd.date_range('2018-01-01', periods=10, freq='30min'),
+                                     'y': 56 - 0.1 * numpy.arange(6), 'x': -3.5 + 0.1 * numpy.arange(8)})
+        dataset = dataset.rio.write_crs('EPSG:4326')
+        encoding = {'precipitation': with_grid_mapping(storage_encoding('netcdf4', numpy.float32, (4, 1, 2, 2)), dataset['precipitation'])}
+        dataset.to_netcdf(self.path, format='NETCDF4', encoding=encoding)
+
+    def test_points_by_tile(self):
+        """Test that scattered points, several in a tile, get the series of their pixel."""
+        rows = numpy.array([0, 1, 5, 3, 0])
+        cols = numpy.array([0, 1, 7, 2, 6])
+        xs, ys = -3.5 + 0.1 * cols, 56 - 0.1 * rows
+        # a budget of a few timesteps of a tile: several blocks along time
+        with PrecipitationCube(self.path, memory_budget=0.0001) as cube:
+            self.assertEqual(storage_chunks(cube.precipitation), (4, 2, 2))
+            values = cube.point_values(xs, ys)
+            numpy.testing.assert_array_equal(values, self.values[:, 0, rows, cols])
+            numpy.testing.assert_array_equal(cube.point_series(xs[2], ys[2]), self.values[:, 0, 5, 7])
+            table = cube.points(['a', 'b', 'c', 'd', 'e'], xs, ys, layout='long')
+            self.assertEqual(len(table), 50)
+
+        with xr.open_dataset(self.path, engine='netcdf4') as dataset:
+            table = extract_points(dataset, ['a', 'b', 'c', 'd', 'e'], xs, ys, memory_budget=0.0001)
+        numpy.testing.assert_array_equal(table['c'].to_numpy(), self.values[:, 0, 5, 7])
+
+    def test_cube_of_written_stack(self):
+        """Test the points of a cube stacked from rasters, given in another coordinate system."""
+        names = [write_envi(os.path.join(self.directory, f'raster_{n}.bil'), numpy.arange(12).reshape(3, 4) + 100 * n)
+                 for n in range(3)]
+        dates = [datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=30 * n) for n in range(3)]
+        with PrecipitationCube.from_rasters(names, dates, os.path.join(self.directory, 'stack.nc'), numpy.float32) as cube:
+            self.assertEqual(cube.crs.to_epsg(), 4326)
+            # the centre of the pixel of row 1 and column 2 (4.75W 57.85N) in British National Grid
+            series = cube.point_series(236892.1, 887815.7, crs='EPSG:27700')
+            numpy.testing.assert_array_equal(series, [6, 106, 206])
+
+    def test_cube_without_coordinate_system(self):
+        """Test that a stack without a coordinate system is refused when it is opened."""
+        path = os.path.join(self.directory, 'no_crs.nc')
+        with xr.open_dataset(self.path) as dataset:
+            dataset = dataset.drop_vars('spatial_ref').load()
+        # like the stacks written before the storage encoding kept the grid mapping
+        dataset['precipitation'].encoding.pop('grid_mapping', None)
+        dataset['precipitation'].attrs.pop('grid_mapping', None)
+        dataset.to_netcdf(path)
+        with self.assertRaisesRegex(ValueError, 'no coordinate system'):
+            PrecipitationCube(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
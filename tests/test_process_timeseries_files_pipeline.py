@@ -0,0 +1,42 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.process_timeseries_files_pipeline`."""
+
+
+import os
+import datetime
+import unittest
+
+import numpy
+import pandas as pd
+
+from gpm_precipitation_tools import process_timeseries_files_pipeline
+from tests.helpers import temporary_directory, write_envi
+
+
+class TestPipeline(unittest.TestCase):
+    """Tests for the command line of the time series pipeline."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.addCleanup(os.chdir, os.getcwd())
+        start = datetime.datetime(2020, 1, 1)
+        # 30 x 30 pixels of 0.1 degree from 5W 58N, the n-th half hour rains n mm/hr everywhere
+        for n in range(7):
+            date = start + datetime.timedelta(minutes=30 * n)
+            write_envi(os.path.join(self.directory, date.strftime('Calib_rainfall_%Y%m%d-S%H%M%S-V06B_cut.bil')),
+                       numpy.full((30, 30), n))
+
+    def test_point_series(self):
+        """Test that the rasters are stacked and the series of a point is extracted in its coordinate system."""
+        process_timeseries_files_pipeline.main(['--file_folder', self.directory, '-c', 'EPSG:4326', '-x', '-3', '-y', '56'])
+        outputs = [name for name in os.listdir(self.directory) if name.startswith('precipitation_timeseries_point_lon_-3')]
+        self.assertEqual(len(outputs), 1)
+        series = pd.read_csv(os.path.join(self.directory, outputs[0]))
+        self.assertEqual(list(series['precipitation_mm/s']), list(range(7)))
+        self.assertEqual(series['date'].iloc[-1], '2020-01-01 03:00:00')
+
+
+if __name__ == '__main__':
+    unittest.main()
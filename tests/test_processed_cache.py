@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.processed_cache`."""
+
+
+import os
+import time
+import shutil
+import unittest
+from unittest import mock
+
+from gpm_precipitation_tools import processed_cache
+from gpm_precipitation_tools.processed_cache import ProcessedCache
+from tests.helpers import temporary_directory
+
+
+class TestProcessedCache(unittest.TestCase):
+    """Tests for the cache of the processed granules."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.cache = ProcessedCache(os.path.join(self.directory, 'cache'))
+        self.raw = self.write('granule.HDF5', 'raw')
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_store_and_fetch(self):
+        """Test that a stored granule comes back under another name and that the settings are in the key."""
+        key = self.cache.key(self.raw, {'product': 'GPM_30min'})
+        self.assertNotEqual(key, self.cache.key(self.raw, {'product': 'GPM_D'}))
+        self.assertFalse(self.cache.fetch(key, os.path.join(self.directory, 'other.bil')))
+
+        self.write('first.bil', 'grid')
+        self.write('first.hdr', 'header')
+        self.cache.store(key, os.path.join(self.directory, 'first.bil'))
+        self.assertTrue(self.cache.fetch(key, os.path.join(self.directory, 'other.bil')))
+        with open(os.path.join(self.directory, 'other.hdr')) as f:
+            self.assertEqual(f.read(), 'header')
+
+    def test_evict_least_recently_used(self):
+        """Test that the entries used the longest time ago go first."""
+        keys = []
+        for n in range(3):
+            raw = self.write(f'granule{n}.HDF5', f'raw{n}')
+            keys.append(self.cache.key(raw, {}))
+            self.write('out.bil', 'x' * 1000)
+            self.cache.store(keys[-1], os.path.join(self.directory, 'out.bil'))
+            os.utime(self.cache.entry(keys[-1]), (time.time() - 100 + n, time.time() - 100 + n))
+        # the oldest one is used again
+        self.assertTrue(self.cache.fetch(keys[0], os.path.join(self.directory, 'again.bil')))
+
+        self.cache.max_size = 2500 / 1024. / 1024.
+        self.assertEqual(self.cache.evict(), 1)
+        self.assertFalse(os.path.exists(self.cache.entry(keys[1])))
+        self.assertTrue(os.path.exists(self.cache.entry(keys[0])))
+
+    def test_evicted_while_fetching(self):
+        """Test that an entry evicted by another run between two of its files is a miss, not half a granule."""
+        key = self.cache.key(self.raw, {})
+        self.write('first.bil', 'grid')
+        self.write('first.hdr', 'header')
+        self.cache.store(key, os.path.join(self.directory, 'first.bil'))
+        copy = shutil.copy2
+
+        def evicting_copy(source, target):
+            copy(source, target)
+            # the other run evicts everything once the raster is copied
+            ProcessedCache(self.cache.cache_dir, 0).evict()
+
+        target = os.path.join(self.directory, 'other.bil')
+        with mock.patch.object(processed_cache.shutil, 'copy2', evicting_copy):
+            self.assertFalse(self.cache.fetch(key, target))
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.startswith('other')), [])
+        self.assertEqual(self.cache.entries(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
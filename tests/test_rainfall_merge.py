@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.rainfall_merge`."""
+
+
+import os
+import csv
+import unittest
+from unittest import mock
+
+import pytest
+
+from gpm_precipitation_tools import rainfall_merge, series_io
+from gpm_precipitation_tools.rainfall_merge import merge_series, merge_members, member_path, kept_rows, keyed_rows, read_series
+from tests.helpers import temporary_directory
+
+
+class TestRainfallMerge(unittest.TestCase):
+    """Tests for the streaming merge of rainfall series."""
+
+    def setUp(self):
+        self.directory = temporary_directory(self)
+
+    def write(self, name, columns, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            writer.writerows(rows)
+        return path
+
+    def read(self, path):
+        with open(path, newline='') as f:
+            return list(csv.DictReader(f))
+
+    def test_overlap_follows_priority(self):
+        base = self.write('base.csv', ['duration_s', 'rainfall_mm_sec', 'date'],
+                          [[1800, 1, '2020-01-01 00:00:00'], [1800, 2, '2020-01-01 00:30:00']])
+        forecast = self.write('forecast.csv', ['duration_s', 'intensity_mm_sec', 'date'],
+                              [[1800, 9, '2020-01-01 00:30:00'], [1800, 3, '2020-01-01 01:00:00']])
+        output = os.path.join(self.directory, 'merged.csv')
+
+        counts = merge_series([('base', base), ('forecast', forecast)], output)
+        rows = self.read(output)
+        self.assertEqual([row['intensity_mm_sec'] for row in rows], ['1', '2', '3'])
+        self.assertEqual([row['source'] for row in rows], ['base', 'base', 'forecast'])
+        self.assertEqual(counts['dropped'], 1)
+
+        merge_series([('base', base), ('forecast', forecast)], output, priority=['forecast', 'base'])
+        self.assertEqual([row['intensity_mm_sec'] for row in self.read(output)], ['1', '9', '3'])
+
+    def test_overlap_over_time(self):
+        base = self.write('base.csv', ['duration_s', 'rainfall_mm_sec', 'date'],
+                          [[1800, 1, '2020-01-01 00:00:00'], [1800, 2, '2020-01-01 00:30:00']])
+        # an hourly forecast that starts a quarter past
+        forecast = self.write('forecast.csv', ['duration_s', 'intensity_mm_sec', 'date'],
+                              [[3600, 7, '2020-01-01 00:15:00']])
+        output = os.path.join(self.directory, 'merged.csv')
+
+        counts = merge_series([('base', base), ('forecast', forecast)], output)
+        self.assertEqual([(row['date'], row['duration_s'], row['intensity_mm_sec']) for row in self.read(output)],
+                         [('2020-01-01 00:00:00', '1800', '1'), ('2020-01-01 00:30:00', '1800', '2'),
+                          ('2020-01-01 01:00:00', '900', '7')])
+        self.assertEqual((counts['dropped'], counts['cut']), (0, 1))
+
+        counts = merge_series([('base', base), ('forecast', forecast)], output, priority=['forecast', 'base'])
+        self.assertEqual([(row['date'], row['duration_s'], row['intensity_mm_sec']) for row in self.read(output)],
+                         [('2020-01-01 00:00:00', '900', '1'), ('2020-01-01 00:15:00', '3600', '7')])
+        self.assertEqual((counts['dropped'], counts['cut']), (1, 1))
+
+    def test_members_stay_apart(self):
+        base = self.write('base.csv', ['duration_s', 'rainfall_mm_sec', 'date'], [[1800, 1, '2020-01-01 00:00:00']])
+        members = [self.write(f'member{n}.csv', ['duration_s', 'intensity_mm_sec'], [[1800, n], [1800, n]]) for n in [5, 6]]
+        output = os.path.join(self.directory, 'merged.csv')
+
+        counts = merge_members([('base', base)] + [('forecast', member) for member in members], output)
+        self.assertEqual(sorted(counts), [member_path(output, 1), member_path(output, 2)])
+        for n, path in zip([5, 6], sorted(counts)):
+            rows = self.read(path)
+            self.assertEqual([row['intensity_mm_sec'] for row in rows], ['1', str(n), str(n)])
+            self.assertEqual(rows[1]['date'], '2020-01-01 00:30:00')
+            self.assertEqual(counts[path]['dropped'], 0)
+
+    def test_series_without_dates_follow_the_previous_one(self):
+        base = self.write('base.csv', ['duration_s', 'intensity_mm_sec'], [[1800, 1], [1800, 2]])
+        supp = self.write('supp.csv', ['duration_s', 'intensity_mm_sec'], [[3600, 5]])
+        output = os.path.join(self.directory, 'merged.csv')
+
+        merge_series([('base', base), ('supp', supp)], output)
+        rows = self.read(output)
+        self.assertEqual([(row['duration_s'], row['intensity_mm_sec']) for row in rows],
+                         [('1800', '1'), ('1800', '2'), ('3600', '5')])
+        self.assertEqual(rows[2]['date'], '1970-01-01 01:00:00')
+
+    def test_unordered_series_is_refused(self):
+        base = self.write('base.csv', ['duration_s', 'intensity_mm_sec', 'date'],
+                          [[1800, 1, '2020-01-01 00:30:00'], [1800, 2, '2020-01-01 00:00:00']])
+        with self.assertRaises(ValueError):
+            merge_series([('base', base)], os.path.join(self.directory, 'merged.csv'))
+
+    def test_unknown_priority_is_refused(self):
+        base = self.write('base.csv', ['duration_s', 'intensity_mm_sec', 'date'], [[1800, 1, '2020-01-01 00:00:00']])
+        with self.assertRaises(ValueError):
+            merge_series([('base', base)], os.path.join(self.directory, 'merged.csv'), ['base', 'forcast'])
+
+    def test_end_only_read_before_series_without_dates(self):
+        dated = self.write('dated.csv', ['duration_s', 'intensity_mm_sec', 'date'], [[1800, 1, '2020-01-01 00:00:00']])
+        empty = self.write('empty.csv', ['duration_s', 'intensity_mm_sec', 'date'], [])
+        undated = self.write('undated.csv', ['duration_s', 'intensity_mm_sec'], [[3600, 5]])
+        output = os.path.join(self.directory, 'merged.csv')
+        with mock.patch.object(rainfall_merge, 'series_end', side_effect=rainfall_merge.series_end) as series_end:
+            merge_series([('base', dated), ('supp', dated)], output)
+            self.assertEqual(series_end.call_count, 0)
+            # the series just before has no rows: the undated one follows the one before it
+            merge_series([('base', dated), ('supp', empty), ('forecast', undated)], output)
+        self.assertEqual([call.args[0] for call in series_end.call_args_list], [empty, dated])
+        self.assertEqual(self.read(output)[-1]['date'], '2020-01-01 00:30:00')
+
+    def test_only_active_rows_are_remembered(self):
+        # 45 minute forecasts every other hour over a half-hourly base: a base row cut and one dropped under each
+        base = self.write('base.csv', ['duration_s', 'intensity_mm_sec', 'date'],
+                          [[1800, 1, f'2020-01-{1 + n // 48:02d} {n % 48 // 2:02d}:{n % 2 * 30:02d}:00'] for n in range(480)])
+        forecast = self.write('forecast.csv', ['duration_s', 'intensity_mm_sec', 'date'],
+                              [[2700, 9, f'2020-01-{1 + n // 24:02d} {n % 24:02d}:15:00'] for n in range(0, 240, 2)])
+        counts = {'base': 0, 'supp': 0, 'forecast': 0, 'dropped': 0, 'cut': 0}
+        rows = kept_rows([keyed_rows(read_series(forecast), (0, 1), 'forecast'), keyed_rows(read_series(base), (1, 0), 'base')], counts)
+        largest = 0
+        for row in rows:
+            held = rows.gi_frame.f_locals if rows.gi_frame is not None else {'written': (), 'cut': ()}
+            largest = max(largest, len(held['written']), len(held['cut']))
+        self.assertEqual(counts['forecast'], 120)
+        self.assertEqual((counts['cut'], counts['dropped'], counts['base']), (120, 120, 360))
+        self.assertLessEqual(largest, 3)
+
+    def test_columnar_output_in_batches(self):
+        pq = pytest.importorskip('pyarrow.parquet')
+        base = self.write('base.csv', ['duration_s', 'rainfall_mm_sec', 'date'],
+                          [[1800, n, f'2020-01-01 {n // 2:02d}:{n % 2 * 30:02d}:00'] for n in range(5)])
+        with mock.patch.object(rainfall_merge, 'BATCH_ROWS', 2):
+            merge_series([('base', base)], os.path.join(self.directory, 'merged.csv'))
+            merge_series([('base', base)], os.path.join(self.directory, 'merged.parquet'))
+            merge_series([('base', base)], os.path.join(self.directory, 'merged.npz'))
+        self.assertEqual(pq.ParquetFile(os.path.join(self.directory, 'merged.parquet')).num_row_groups, 3)
+        expected = [(row['date'], row['intensity_mm_sec'], row['source']) for row in self.read(os.path.join(self.directory, 'merged.csv'))]
+        for name in ['merged.parquet', 'merged.npz']:
+            columns, metadata = series_io.read_series(os.path.join(self.directory, name))
+            self.assertEqual(list(zip(series_io.date_strings(columns['date']), [str(int(value)) for value in columns['intensity_mm_sec']],
+                                      columns['source'].tolist())), expected)
+            self.assertEqual(metadata['priority'], ['base', 'supp', 'forecast'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.raster_catalog`."""
+
+
+import os
+import datetime
+import unittest
+
+from gpm_precipitation_tools.raster_catalog import RasterCatalog
+from gpm_precipitation_tools.timeseries_state import TimeseriesState
+from tests.helpers import temporary_directory
+
+
+class TestRasterCatalog(unittest.TestCase):
+    """Tests for the catalog of the processed rasters."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        for name in ['Calib_rainfall_20180101-S003000-V06B_cut.bil',
+                     'Calib_rainfall_20180101-S000000-V06B_cut.bil',
+                     '3B-HHR-E.MS.MRG.3IMERG.20180101-S010000-E012959.0060.V06B.bil',
+                     'not_a_raster.hdr']:
+            self.touch(name)
+        self.catalog = RasterCatalog(os.path.join(self.directory, 'catalog.sqlite'))
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.catalog.close()
+
+    def touch(self, name):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(name)
+
+    def test_queries(self):
+        """Test a timestep and a range of time."""
+        self.assertEqual(self.catalog.update(self.directory), (3, 0))
+        path = self.catalog.at(datetime.datetime(2018, 1, 1, 0, 30))
+        self.assertEqual(os.path.basename(path), 'Calib_rainfall_20180101-S003000-V06B_cut.bil')
+        self.assertIsNone(self.catalog.at(datetime.datetime(2018, 1, 2)))
+
+        rasters = self.catalog.between(datetime.datetime(2018, 1, 1, 0, 30), datetime.datetime(2018, 1, 1, 1))
+        self.assertEqual([date.minute for date, path in rasters], [30, 0])
+        self.assertEqual(len(self.catalog.between(product='GPM_30min')), 1)
+
+    def test_incremental_update(self):
+        """Test that only new files are added and that removed files go."""
+        self.catalog.update(self.directory)
+        self.assertEqual(self.catalog.update(self.directory), (0, 0))
+        self.touch('Calib_rainfall_20180101-S013000-V06B_cut.bil')
+        os.remove(os.path.join(self.directory, 'Calib_rainfall_20180101-S000000-V06B_cut.bil'))
+        self.assertEqual(self.catalog.update(self.directory), (1, 1))
+        self.assertEqual(len(self.catalog.between()), 3)
+
+    def test_wildcards_in_folder_names(self):
+        """Test that _ and % in the name of a folder don't bring in the rasters of other folders."""
+        folders = {}
+        for name in ['run_1', 'runX1', 'RUN_1', 'run%1', 'run_10']:
+            folders[name] = os.path.join(self.directory, name)
+            os.mkdir(folders[name])
+            with open(os.path.join(folders[name], 'Calib_rainfall_20180101-S000000-V06B_cut.bil'), 'w') as f:
+                f.write(name)
+            self.assertEqual(self.catalog.update(folders[name]), (1, 0))
+        for name, folder in folders.items():
+            self.assertEqual([os.path.dirname(path) for path in self.catalog.entries(folder)], [folder])
+        self.assertEqual(len(self.catalog.entries(self.directory)), 5)
+
+    def test_settings_of_the_folder(self):
+        """Test that the cropped files get the product and area of the time series of the folder."""
+        self.touch('3B-HHR-E.MS.MRG.3IMERG.20180101-S000000-E002959.0000.V06B.bil')
+        self.catalog.update(self.directory)
+        # two files of the same timestep and nothing to tell them apart
+        with self.assertRaises(ValueError):
+            self.catalog.at(datetime.datetime(2018, 1, 1))
+
+        state = TimeseriesState(self.directory)
+        state.product, state.aoi = 'GPM_D', 'digest'
+        state.save()
+        # the files are not changed, but their settings are
+        self.assertEqual(self.catalog.update(self.directory), (4, 0))
+        path = self.catalog.at(datetime.datetime(2018, 1, 1), 'GPM_D', 'digest')
+        self.assertEqual(os.path.basename(path), 'Calib_rainfall_20180101-S000000-V06B_cut.bil')
+        self.assertEqual(len(self.catalog.between(product='GPM_D', aoi='digest')), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
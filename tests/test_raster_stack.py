@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.raster_stack`."""
+
+
+import os
+import datetime
+import unittest
+import importlib.util
+
+import numpy
+
+from gpm_precipitation_tools.raster_stack import block_layout, time_chunk, template, write_stack, open_stack, \
+    stack_file_name, read_map, write_slice, OUTPUT_FORMATS
+from tests.helpers import temporary_directory, write_envi
+
+
+class TestRasterStack(unittest.TestCase):
+    """Tests for the blocks and chunks of the stack."""
+
+    def test_budget_over_preset(self):
+        """Test that a long time chunk doesn't make a block larger than the memory budget."""
+        # 1800 x 3600 float32 maps are ~25 MB, 64 of them fit in 1600 MB
+        chunk, storage = block_layout(5000, 1800, 3600, numpy.float32, memory_budget=1600, chunks='series')
+        self.assertEqual(time_chunk(1800, 3600, numpy.float32, 1600), 64)
+        self.assertEqual(chunk, 64)
+        self.assertEqual(storage, (64, 1, 32, 32))
+
+    def test_whole_chunks(self):
+        """Test that a block is made of whole storage chunks."""
+        chunk, storage = block_layout(5000, 10, 10, numpy.float32, memory_budget=0.01, chunks='3,5,5')
+        self.assertEqual(storage, (3, 1, 5, 5))
+        self.assertEqual(chunk, 24)
+        chunk, storage = block_layout(5000, 10, 10, numpy.float32, memory_budget=0.01, output_format='netcdf3')
+        self.assertEqual((chunk, storage), (26, None))
+
+    def test_coordinate_system(self):
+        """Test that the stacks and slices of every format keep the coordinate system of the rasters."""
+        directory = temporary_directory(self)
+        names = [write_envi(os.path.join(directory, f'raster_{n}.bil'), numpy.full((3, 4), n)) for n in range(5)]
+        dates = [datetime.datetime(2020, 1, 1) + datetime.timedelta(minutes=30 * n) for n in range(5)]
+        crs = template(names[0]).rio.crs
+        self.assertIsNotNone(crs)
+        for output_format in OUTPUT_FORMATS:
+            with self.subTest(output_format=output_format):
+                if output_format == 'zarr' and importlib.util.find_spec('zarr') is None:
+                    self.skipTest('zarr is not installed')
+                path = os.path.join(directory, stack_file_name('stack_' + output_format, output_format))
+                # a tiny budget: the stack is written in several blocks
+                write_stack(names, dates, path, numpy.float32, memory_budget=0.0001, output_format=output_format, chunks='map')
+                with open_stack(path) as stack:
+                    self.assertEqual(stack.rio.crs, crs)
+                    numpy.testing.assert_array_equal(stack['precipitation'].values[:, 0, 0, 0], range(5))
+
+                path = write_slice(read_map(names[0], dates[0]), os.path.join(directory, 'slice_' + output_format), output_format)
+                with open_stack(path) as stack:
+                    self.assertEqual(stack.rio.crs, crs)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.resample`."""
+
+
+import os
+import datetime
+import unittest
+
+import numpy
+
+from gpm_precipitation_tools import envi_io
+from gpm_precipitation_tools.resample import resample, window_start, window_end
+from tests.helpers import temporary_directory
+
+
+HEADER = """ENVI
+samples = 2
+lines = 1
+bands = 1
+header offset = 0
+data type = 4
+interleave = bsq
+byte order = 0
+"""
+
+
+class TestResample(unittest.TestCase):
+    """Tests for the temporal resampling."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+
+    def test_windows(self):
+        """Test the start and end of the windows of each unit."""
+        date = datetime.datetime(2018, 2, 14, 16, 30)
+        self.assertEqual(window_start(date, '3H'), datetime.datetime(2018, 2, 14, 15))
+        self.assertEqual(window_start(date, '1D'), datetime.datetime(2018, 2, 14))
+        self.assertEqual(window_start(date, 'M'), datetime.datetime(2018, 2, 1))
+        self.assertEqual(window_end(datetime.datetime(2018, 12, 1), '1M'), datetime.datetime(2019, 1, 1))
+
+    def test_hourly_sum(self):
+        """Test that two half hours make a complete hour and the third one a partial hour."""
+        rasters = []
+        for n, values in enumerate([[1, 0], [3, 2], [5, 0]]):
+            date = datetime.datetime(2018, 1, 1) + datetime.timedelta(minutes=30 * n)
+            path = os.path.join(self.directory, date.strftime('Calib_rainfall_%Y%m%d-S%H%M%S-V06B_cut.bil'))
+            numpy.array([values], dtype='<f4').tofile(path)
+            with open(path[:-4] + '.hdr', 'w') as f:
+                f.write(HEADER)
+            rasters.append((date, path))
+
+        output_dir = os.path.join(self.directory, 'hourly')
+        series = resample(rasters, '1H', output_dir, statistics=['sum', 'max'])
+        self.assertEqual([(row['timesteps'], row['complete']) for row in series], [(2, True), (1, False)])
+        self.assertAlmostEqual(series[0]['sum'], (0.5 * 4 + 0.5 * 2) / 2)
+
+        band = envi_io.read_band(os.path.join(output_dir, 'Calib_rainfall_20180101-S000000-1H_max.bil'))
+        numpy.testing.assert_array_equal(band, [[3, 2]])
+
+        # only the first pixel is inside the area
+        series = resample(rasters, '1H', output_dir, statistics=['sum'], write_rasters=False,
+                          weights=numpy.array([[1, 0]], dtype=numpy.float32))
+        self.assertAlmostEqual(series[0]['sum'], 0.5 * 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.rolling_accumulation`."""
+
+
+import os
+import csv
+import datetime
+import unittest
+
+import numpy
+
+from gpm_precipitation_tools import envi_io
+from gpm_precipitation_tools.rolling_accumulation import RollingAccumulator, rolling_maxima, EPOCH
+from tests.helpers import temporary_directory
+
+
+HEADER = """ENVI
+samples = 2
+lines = 1
+bands = 1
+header offset = 0
+data type = 4
+interleave = bsq
+byte order = 0
+"""
+
+
+class TestRollingAccumulation(unittest.TestCase):
+    """Tests for the maximum N-hour totals."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+
+    def test_rolling_totals(self):
+        """Test the running 1 and 2-hour totals, with a missing half hour."""
+        accumulator = RollingAccumulator((1, 1), durations=[1, 2])
+        start = datetime.datetime(2018, 1, 1)
+        for minutes, rate in [(0, 2), (30, 4), (60, 6), (120, 8)]:
+            accumulator.push(numpy.array([[rate]], dtype=numpy.float32), start + datetime.timedelta(minutes=minutes))
+        # 1 h: 1+2, 2+3, 3+0, 0+4 (mm), 2 h: 1+2+3+0, 2+3+0+4
+        self.assertEqual(accumulator.maxima[0][0, 0], 5)
+        self.assertEqual(accumulator.maxima[1][0, 0], 9)
+        self.assertEqual(accumulator.when[1][0, 0], (start + datetime.timedelta(hours=2) - EPOCH).total_seconds() / 3600.)
+
+    def test_rolling_maxima(self):
+        """Test the maps of the maximum totals and the series of the area."""
+        rasters = []
+        start = datetime.datetime(2018, 1, 1)
+        for n, values in enumerate([[2, 0], [4, 2], [6, 0]]):
+            date = start + datetime.timedelta(minutes=30 * n)
+            path = os.path.join(self.directory, date.strftime('Calib_rainfall_%Y%m%d-S%H%M%S-V06B_cut.bil'))
+            numpy.array([values], dtype='<f4').tofile(path)
+            with open(path[:-4] + '.hdr', 'w') as f:
+                f.write(HEADER)
+            rasters.append((date, path))
+
+        output_dir = os.path.join(self.directory, 'rolling')
+        outputs = rolling_maxima(rasters, output_dir, durations=[1])
+        self.assertEqual([os.path.basename(output) for output in outputs],
+                         ['rolling_1h_catchments.csv', 'max_1h.bil', 'max_1h_end.bil'])
+
+        # 1 h totals (mm): [1+2, 0+1] at 00:30 and [2+3, 1+0] at 01:00
+        numpy.testing.assert_array_equal(envi_io.read_band(os.path.join(output_dir, 'max_1h.bil')), [[5, 1]])
+        hours = [(start + datetime.timedelta(minutes=minutes) - EPOCH).total_seconds() / 3600. for minutes in [60, 30]]
+        numpy.testing.assert_array_equal(envi_io.read_band(os.path.join(output_dir, 'max_1h_end.bil')), [hours])
+
+        # the first half hour doesn't make a whole hour
+        with open(os.path.join(output_dir, 'rolling_1h_catchments.csv'), newline='') as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows, [['date', 'area'], ['2018-01-01 00:30:00', '2.0'], ['2018-01-01 01:00:00', '3.0']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.run_state`."""
+
+
+import os
+import shutil
+import unittest
+
+from gpm_precipitation_tools.run_state import RunState
+from tests.helpers import temporary_directory
+
+
+class TestRunState(unittest.TestCase):
+    """Tests for the stages of the granules of a run."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.state = RunState(os.path.join(self.directory, 'run_state.sqlite'))
+        self.output = os.path.join(self.directory, 'a.bil')
+        with open(self.output, 'w') as f:
+            f.write('a')
+
+    def tearDown(self):
+        """Tear down test fixtures, if any."""
+        self.state.close()
+
+    def test_pending(self):
+        """Test that only the granules not done with the same digest are pending."""
+        self.state.mark('a.HDF5', 'processed', 'one', self.output)
+        self.state.mark_many(['b.HDF5'], 'processed', {'b.HDF5': 'one'})
+        self.assertTrue(self.state.is_done('a.HDF5', 'processed', 'one'))
+        self.assertFalse(self.state.is_done('a.HDF5', 'processed', 'two'))
+        self.assertEqual(self.state.pending(['a.HDF5', 'b.HDF5', 'c.HDF5'], 'processed', {'a.HDF5': 'one', 'b.HDF5': 'two'}),
+                         ['b.HDF5', 'c.HDF5'])
+
+        self.assertEqual(self.state.done(['c.HDF5', 'a.HDF5', 'b.HDF5'], 'processed', {'a.HDF5': 'one', 'b.HDF5': 'two'}),
+                         ['a.HDF5'])
+
+        os.remove(self.output)
+        self.assertEqual(self.state.pending(['a.HDF5'], 'processed', {'a.HDF5': 'one'}), ['a.HDF5'])
+        # a granule whose output is gone is not done, e.g. it mustn't count as aggregated
+        self.assertEqual(self.state.done(['a.HDF5'], 'processed', {'a.HDF5': 'one'}), [])
+
+    def test_move(self):
+        """Test that the outputs follow a renamed directory, and only those of that directory."""
+        renamed = os.path.join(self.directory, 'renamed')
+        os.mkdir(renamed)
+        shutil.move(self.output, os.path.join(renamed, 'a.bil'))
+        self.state.mark('a.HDF5', 'processed', 'one', os.path.join(self.directory, 'a.bil'))
+        self.state.mark('b.HDF5', 'processed', 'one', os.path.join(self.directory + '_processed', 'b.bil'))
+        self.assertFalse(self.state.is_done('a.HDF5', 'processed', 'one'))
+
+        self.state.move(self.directory, renamed)
+        self.assertTrue(self.state.is_done('a.HDF5', 'processed', 'one'))
+        row = self.state.connection.execute("SELECT output FROM stages WHERE granule = 'b.HDF5'").fetchone()
+        self.assertEqual(row[0], os.path.join(self.directory + '_processed', 'b.bil'))
+
+    def test_persists_and_clears(self):
+        """Test that the state survives a new run and that it can be cleared."""
+        self.state.mark('a.HDF5', 'downloaded', 'one')
+        self.state.close()
+        self.state = RunState(os.path.join(self.directory, 'run_state.sqlite'))
+        self.assertEqual(self.state.summary(), {'downloaded': 1, 'processed': 0, 'aggregated': 0})
+        self.state.clear()
+        self.assertEqual(self.state.summary()['downloaded'], 0)
+        with self.assertRaises(ValueError):
+            self.state.mark('a.HDF5', 'unknown')
+
+
+if __name__ == '__main__':
+    unittest.main()
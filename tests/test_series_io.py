@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.series_io`."""
+
+
+import os
+import sys
+import argparse
+import unittest
+from unittest import mock
+
+import numpy
+import pytest
+
+from gpm_precipitation_tools import series_io
+from tests.helpers import temporary_directory
+
+
+class TestSeriesIO(unittest.TestCase):
+    """Tests for the series files."""
+
+    def setUp(self):
+        self.directory = temporary_directory(self)
+        self.columns = {'duration_s': [1800, 1800], 'rainfall_mm_sec': [0.5, 0.25],
+                        'date': ['2020-01-01 00:00:00', '2020-01-01 00:30:00']}
+
+    def test_round_trip(self):
+        for output_format in ['csv', 'npz']:
+            path = series_io.series_path(os.path.join(self.directory, 'series'), output_format)
+            series_io.write_series(path, self.columns, {'product': 'GPM_30min'})
+            columns, metadata = series_io.read_series(path)
+            self.assertEqual(list(columns), ['duration_s', 'rainfall_mm_sec', 'date'])
+            self.assertEqual(columns['date'].dtype, numpy.dtype('datetime64[s]'))
+            numpy.testing.assert_array_equal(columns['rainfall_mm_sec'], [0.5, 0.25])
+            self.assertEqual(series_io.series_columns(path), list(columns))
+            if output_format == 'npz':
+                self.assertEqual(metadata, {'product': 'GPM_30min'})
+
+    def test_parquet_round_trip(self):
+        pytest.importorskip('pyarrow')
+        path = os.path.join(self.directory, 'series.parquet')
+        series_io.write_series(path, self.columns, {'product': 'GPM_30min', 'units': {'duration_s': 's'}})
+        columns, metadata = series_io.read_series(path)
+        self.assertEqual(list(columns), ['duration_s', 'rainfall_mm_sec', 'date'])
+        self.assertEqual(columns['date'].dtype, numpy.dtype('datetime64[s]'))
+        self.assertEqual(series_io.date_strings(columns['date']), self.columns['date'])
+        numpy.testing.assert_array_equal(columns['duration_s'], [1800., 1800.])
+        numpy.testing.assert_array_equal(columns['rainfall_mm_sec'], [0.5, 0.25])
+        self.assertEqual(metadata, {'product': 'GPM_30min', 'units': {'duration_s': 's'}})
+        self.assertEqual(series_io.series_columns(path), list(columns))
+
+        # appended rows are merged by date
+        series_io.extend_series(path, list(self.columns), [[1800, 0.75, '2020-01-01 00:15:00']], 2, True)
+        columns, metadata = series_io.read_series(path)
+        numpy.testing.assert_array_equal(columns['rainfall_mm_sec'], [0.5, 0.75, 0.25])
+        self.assertEqual(metadata['product'], 'GPM_30min')
+
+    def test_parquet_without_pyarrow(self):
+        parser = argparse.ArgumentParser()
+        parser.add_argument('--series_format', choices=series_io.SERIES_FORMATS, default=series_io.DEFAULT_SERIES_FORMAT,
+                            type=series_io.format_argument)
+        self.assertEqual(parser.parse_args(['--series_format', 'npz']).series_format, 'npz')
+        # an import of a module set to None fails
+        with mock.patch.dict(sys.modules, {'pyarrow': None, 'pyarrow.parquet': None}):
+            with self.assertRaises(ImportError):
+                series_io.require_pyarrow()
+            with self.assertRaises(SystemExit), mock.patch('sys.stderr'):
+                parser.parse_args(['--series_format', 'parquet'])
+            self.assertEqual(parser.parse_args([]).series_format, 'csv')
+
+    def test_extend_merges_by_date(self):
+        path = os.path.join(self.directory, 'series.npz')
+        names = list(self.columns)
+        series_io.extend_series(path, names, [[1800, 0.5, '2020-01-01 01:00:00']], 2, False)
+        series_io.extend_series(path, names, [[1800, 0.25, '2020-01-01 00:30:00']], 2, True)
+        columns, metadata = series_io.read_series(path)
+        self.assertEqual(series_io.date_strings(columns['date']), ['2020-01-01 00:30:00', '2020-01-01 01:00:00'])
+        numpy.testing.assert_array_equal(columns['rainfall_mm_sec'], [0.25, 0.5])
+
+        # a file that changed replaces its row
+        series_io.extend_series(path, names, [[1800, 0.75, '2020-01-01 00:30:00']], 2, True)
+        columns, metadata = series_io.read_series(path)
+        numpy.testing.assert_array_equal(columns['rainfall_mm_sec'], [0.75, 0.5])
+
+
+if __name__ == '__main__':
+    unittest.main()
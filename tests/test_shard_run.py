@@ -0,0 +1,129 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.shard_run`."""
+
+
+import os
+import sys
+import json
+import time
+import datetime
+import unittest
+
+from gpm_precipitation_tools import shard_run, series_io
+from gpm_precipitation_tools.timeseries_state import TimeseriesState
+from tests.helpers import temporary_directory
+
+
+class TestShardRun(unittest.TestCase):
+    """Tests for the shards of a run."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+
+    def test_shard_dates(self):
+        """Test that the shards cover the range once, in whole months for GPM_M."""
+        shards = shard_run.shard_dates('GPM_30min', datetime.date(2020, 1, 1), datetime.date(2020, 3, 1), 30)
+        self.assertEqual(shards[0], (datetime.date(2020, 1, 1), datetime.date(2020, 1, 30)))
+        self.assertEqual(shards[-1][1], datetime.date(2020, 3, 1))
+        for (first, last), (after, end) in zip(shards, shards[1:]):
+            self.assertEqual(after, last + datetime.timedelta(days=1))
+
+        months = shard_run.shard_dates('GPM_M', datetime.date(2020, 1, 15), datetime.date(2020, 3, 10), 30)
+        self.assertEqual(months, [(datetime.date(2020, 1, 15), datetime.date(2020, 1, 31)),
+                                  (datetime.date(2020, 2, 1), datetime.date(2020, 2, 29)),
+                                  (datetime.date(2020, 3, 1), datetime.date(2020, 3, 10))])
+
+    def test_claims(self):
+        """Test that a shard is claimed once and that a stale claim is taken over."""
+        plan = shard_run.plan_shards(self.directory, 'GPM_D', datetime.date(2020, 1, 1), datetime.date(2020, 1, 10), 5)
+        shard = plan['shards'][0]
+        self.assertTrue(shard_run.claim_shard(self.directory, shard))
+        self.assertFalse(shard_run.claim_shard(self.directory, shard))
+
+        old = time.time() - 3600
+        os.utime(shard_run.claim_path(self.directory, shard), (old, old))
+        self.assertTrue(shard_run.claim_shard(self.directory, shard, stale_after=60))
+
+    def test_worker_runs_every_shard(self):
+        """Test that a worker runs the shards of the plan, with the arguments of the plan."""
+        shard_run.plan_shards(self.directory, 'GPM_D', datetime.date(2020, 1, 1), datetime.date(2020, 1, 10), 5,
+                              run_args=['--SptID', 'ID'])
+        seen = []
+
+        def command(plan, shard, process_dir):
+            seen.append(shard_run.shard_command(plan, shard, process_dir))
+            # the shards get the login of the worker and never open the login window
+            return [sys.executable, '-c', 'import os; assert os.environ["EARTHDATA_USERNAME"] == "user"']
+
+        environment = shard_run.login_environment(('user', 'pass'))
+        results = shard_run.run_worker(self.directory, command=command, environment=environment)
+        self.assertEqual(results, [('00000', 0), ('00001', 0)])
+        self.assertEqual(seen[1][seen[1].index('--StartDate') + 1], '2020-01-06')
+        self.assertEqual(seen[1][-2:], ['--SptID', 'ID'])
+        # everything is done: another worker has nothing left
+        self.assertEqual(shard_run.run_worker(self.directory, command=command, environment=environment), [])
+
+    def test_failed_shard_is_run_again(self):
+        """Test that a failed shard is run again in the same worker, until it failed as many times as allowed."""
+        shard_run.plan_shards(self.directory, 'GPM_D', datetime.date(2020, 1, 1), datetime.date(2020, 1, 10), 5)
+        marker = os.path.join(self.directory, 'failed_once')
+
+        def command(plan, shard, process_dir):
+            if shard['id'] == '00000':
+                # fails the first time only
+                return [sys.executable, '-c', f'import os, sys; os.path.exists({marker!r}) or (open({marker!r}, "w"), sys.exit(1))']
+            return [sys.executable, '-c', 'import sys; sys.exit(3)']
+
+        results = shard_run.run_worker(self.directory, command=command, attempts=2)
+        self.assertEqual(results, [('00000', 1), ('00001', 3), ('00000', 0), ('00001', 3)])
+        self.assertTrue(os.path.exists(shard_run.done_path(self.directory, {'id': '00000'})))
+        self.assertEqual([run['code'] for run in shard_run.failures(self.directory, {'id': '00001'})], [3, 3])
+        self.assertEqual(os.listdir(os.path.join(self.directory, 'claims')), [])
+        # the shard that failed too often is left out by the other workers too
+        self.assertEqual(shard_run.run_worker(self.directory, command=command, attempts=2), [])
+        self.assertEqual(shard_run.run_worker(self.directory, command=command, attempts=3), [('00001', 3)])
+
+    def write_shards(self, days_of_shards):
+        """
+        Write the daily rainfall series of finished shards of 2020-01-01 to 2020-01-04, with the rain of day n at n mm.
+        """
+        plan = shard_run.plan_shards(self.directory, 'GPM_D', datetime.date(2020, 1, 1), datetime.date(2020, 1, 4), 2)
+        for shard, days in zip(plan['shards'], days_of_shards):
+            directory = os.path.join(shard_run.shard_dir(self.directory, shard), 'GPM_RAW_DAY_processed')
+            os.makedirs(directory)
+            state = TimeseriesState(directory)
+            with open(state.series_file('rainfall', 'rainfall.csv'), 'w') as f:
+                f.write('duration_s,rainfall_mm_sec,date\n')
+                f.writelines(f'86400,{day}.0,2020-01-0{day} 00:00:00\n' for day in days)
+            state.save()
+            with open(shard_run.done_path(self.directory, shard), 'w') as f:
+                f.write('{}')
+
+    def test_merge(self):
+        """Test that the series of consistent shards are put end to end, and reported."""
+        self.write_shards([[1, 2], [3, 4]])
+        report = shard_run.merge_shards(self.directory)
+        output_dir = os.path.join(self.directory, 'merged')
+        path = os.path.join('area', '2020-01-01_to_2020-01-04_GPM_D_rainfall.csv')
+        self.assertEqual(report['series'], [{'area': 'area', 'kind': 'rainfall', 'path': path, 'rows': 4,
+                                             'first': '2020-01-01 00:00:00', 'last': '2020-01-04 00:00:00'}])
+        self.assertEqual(report['rasters'], 0)
+        with open(os.path.join(output_dir, 'merge_report.json')) as f:
+            self.assertEqual(json.load(f), report)
+
+        columns, metadata = series_io.read_series(os.path.join(output_dir, path))
+        self.assertEqual(series_io.date_strings(columns['date']),
+                         [f'2020-01-0{day} 00:00:00' for day in [1, 2, 3, 4]])
+        self.assertEqual(list(columns['rainfall_mm_sec']), [1., 2., 3., 4.])
+
+    def test_merge_finds_gaps(self):
+        """Test that a shard with missing timesteps stops the merge."""
+        self.write_shards([[1, 2], [3]])
+        with self.assertRaisesRegex(ValueError, 'shard 00001 has 1 timesteps instead of 2'):
+            shard_run.merge_shards(self.directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+
+"""Tests for `gpm_precipitation_tools.timeseries_state`."""
+
+
+import os
+import csv
+import datetime
+import unittest
+
+from gpm_precipitation_tools.timeseries_state import TimeseriesState, extend_series, settings_digest
+from tests.helpers import temporary_directory
+
+
+class TestTimeseriesState(unittest.TestCase):
+    """Tests for the append mode of the time series."""
+
+    def setUp(self):
+        """Set up test fixtures, if any."""
+        self.directory = temporary_directory(self)
+        self.path = os.path.join(self.directory, 'series.csv')
+        self.columns = ['duration_s', 'rainfall_mm_sec', 'date']
+
+    def read(self):
+        with open(self.path, newline='') as f:
+            return list(csv.reader(f))
+
+    def test_extend_in_order(self):
+        """Test that new rows go after the existing ones, and late rows in their place."""
+        extend_series(self.path, self.columns, [[1800, 0.1, '2022-01-01 00:00:00']], 2, False)
+        extend_series(self.path, self.columns, [[1800, 0.3, '2022-01-01 01:00:00']], 2, True)
+        extend_series(self.path, self.columns, [[1800, 0.2, '2022-01-01 00:30:00']], 2, True)
+        self.assertEqual([row[2] for row in self.read()[1:]],
+                         ['2022-01-01 00:00:00', '2022-01-01 00:30:00', '2022-01-01 01:00:00'])
+        with self.assertRaises(ValueError):
+            extend_series(self.path, ['duration_s', 'date'], [], 1, True)
+
+    def test_changed_files(self):
+        """Test that new and modified files are read again and replace their rows."""
+        state = TimeseriesState(self.directory)
+        state.inputs = {'a.bil': 1.0, 'b.bil': 2.0}
+        state.save()
+        state = TimeseriesState(self.directory)
+        self.assertEqual(state.changed({'a.bil': 1.0, 'b.bil': 3.0, 'c.bil': 1.0}), ['b.bil', 'c.bil'])
+
+        extend_series(self.path, self.columns, [[1800, 0.1, '2022-01-01 00:00:00'], [1800, 0.3, '2022-01-01 00:30:00']], 2, False)
+        extend_series(self.path, self.columns, [[1800, 0.2, '2022-01-01 00:00:00']], 2, True)
+        self.assertEqual([row[1:] for row in self.read()[1:]],
+                         [['0.2', '2022-01-01 00:00:00'], ['0.3', '2022-01-01 00:30:00']])
+
+    def test_state(self):
+        """Test that the state survives a reload and that other settings start again."""
+        digest = settings_digest({'product': 'GPM_30min', 'percentiles': [50, 90, 99]})
+        state = TimeseriesState(self.directory)
+        self.assertFalse(state.usable(digest))
+
+        extend_series(state.series_file('rainfall', 'a_to_b.csv'), self.columns, [], 2, False)
+        state.last, state.digest = datetime.datetime(2022, 1, 1, 0, 30), digest
+        state.save()
+
+        state = TimeseriesState(self.directory)
+        self.assertTrue(state.usable(digest))
+        self.assertFalse(state.usable(settings_digest({'product': 'GPM_D'})))
+        self.assertEqual(state.last, datetime.datetime(2022, 1, 1, 0, 30))
+        # the next run has another end date: the series follows it
+        state.series_file('rainfall', 'a_to_c.csv')
+        self.assertEqual(sorted(os.listdir(self.directory)), ['a_to_c.csv', 'timeseries_state.json'])
+
+
+if __name__ == '__main__':
+    unittest.main()